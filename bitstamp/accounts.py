@@ -0,0 +1,137 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from bitstamp.bitstamp import Bitstamp
+
+DEFAULT_WORKERS = 16
+# Bitstamp allows 8000 requests per 10 minutes per account
+DEFAULT_REQUESTS_PER_SECOND = 13
+
+
+class RateLimiter(object):
+	def __init__(self, rate, burst=None):
+		'''
+		Token bucket: on average at most rate calls per second, with up to burst calls at once.
+		:param rate: calls per second
+		:param burst: size of the bucket, defaults to rate
+		:return: The limiter object
+		'''
+		if rate <= 0:
+			raise Exception('Rate has to be a positive number')
+
+		self.rate = float(rate)
+		self.burst = float(burst if burst is not None else rate)
+		self.tokens = self.burst
+		self.updated = time.monotonic()
+		self.lock = threading.Lock()
+
+	def __refill(self):
+		now = time.monotonic()
+		self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def try_acquire(self, tokens=1):
+		'''
+		Takes the tokens only if they are all available right now, without blocking.
+		:param tokens: number of calls about to be made
+		:return: True if the tokens were taken
+		'''
+		with self.lock:
+			self.__refill()
+			if self.tokens < tokens:
+				return False
+			self.tokens -= tokens
+			return True
+
+	def wait(self):
+		'''
+		Blocks until a call is allowed and takes a token.
+		:return: seconds spent waiting
+		'''
+		with self.lock:
+			self.__refill()
+			self.tokens -= 1
+			delay = -self.tokens / self.rate if self.tokens < 0 else 0
+
+		if delay > 0:
+			time.sleep(delay)
+
+		return delay
+
+
+class MultiAccountExecutor(object):
+	def __init__(self, accounts, max_workers=DEFAULT_WORKERS, requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+	             session=None):
+		'''
+		Runs the same call across many accounts concurrently. All the clients share one connection pool, while every
+		account keeps its own nonce and rate limit; calls of one account never overlap, so its nonces reach the API in
+		order.
+		:param accounts: dict of account name to Bitstamp constructor arguments (config_file_path or api_key, secret
+		 and customer_id) or to a Bitstamp instance; instances are moved to the shared session unless they were
+		 created with a session of their own, which they keep
+		:param max_workers: number of calls in flight at once
+		:param requests_per_second: rate limit of every account
+		:param session: optional requests.Session, one with a pool of max_workers connections is created by default
+		:return: The executor object
+		'''
+		if session is None:
+			session = requests.Session()
+			adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+			session.mount('https://', adapter)
+			session.mount('http://', adapter)
+
+		self.session = session
+		self.clients = {}
+		self.limiters = {}
+		self.locks = {}
+
+		for name, account in accounts.items():
+			if isinstance(account, Bitstamp):
+				if account.http is requests:
+					account.http = session
+				self.clients[name] = account
+			else:
+				self.clients[name] = Bitstamp(session=session, **account)
+			self.limiters[name] = RateLimiter(requests_per_second)
+			self.locks[name] = threading.Lock()
+
+		self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+	def __call_account(self, name, method, args, kwargs):
+		started = time.time()
+
+		with self.locks[name]:
+			self.limiters[name].wait()
+			try:
+				result = getattr(self.clients[name], method)(*args, **kwargs)
+				error = None
+			except Exception as exception:
+				result = None
+				error = exception
+
+		return {
+			'result': result,
+			'error': error,
+			'elapsed': time.time() - started,
+		}
+
+	def run(self, method, *args, **kwargs):
+		'''
+		Calls the Bitstamp method with the same arguments on every account at once.
+		:param method: name of a Bitstamp method, e.g. 'balance'
+		:return: dict of account name to a dict with result, error (the exception raised, if any) and elapsed seconds
+		'''
+		if not callable(getattr(Bitstamp, method, None)):
+			raise Exception('Bitstamp has no method {}'.format(method))
+
+		futures = {name: self.executor.submit(self.__call_account, name, method, args, kwargs) for name in self.clients}
+
+		return {name: future.result() for name, future in futures.items()}
+
+	def close(self):
+		self.executor.shutdown()
+		self.session.close()
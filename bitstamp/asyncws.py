@@ -0,0 +1,176 @@
+'''
+Native asyncio streaming of the web socket channels, without a thread running attach_ws. Requires the websockets
+package (pip install bitstamp[asyncio]).
+'''
+import asyncio
+import json
+
+from bitstamp.bitstamp import BTC_USD, WS_CHANNEL_LIVE_TRADES, WS_CHANNEL_ORDER_BOOK, WS_CHANNEL_ORDER_BOOK_DIFF
+
+PUSHER_CHANNELS = {
+	WS_CHANNEL_LIVE_TRADES: 'live_trades',
+	WS_CHANNEL_ORDER_BOOK: 'order_book',
+	WS_CHANNEL_ORDER_BOOK_DIFF: 'diff_order_book',
+}
+DATA_EVENTS = ['data', 'trade']
+# Number of messages a stream buffers before it starts dropping the oldest ones
+DEFAULT_MAXSIZE = 1000
+
+
+def pusher_channel(channel, pair=None):
+	'''
+	Returns the name of the Pusher channel, pairs other than BTC/USD have their own channels with the pair as suffix.
+	:param channel: one of bitstamp.WS_CHANNEL_LIVE_TRADES, bitstamp.WS_CHANNEL_ORDER_BOOK or bitstamp.WS_CHANNEL_ORDER_BOOK_DIFF
+	:param pair: one of the currency pairs
+	:return: channel name
+	'''
+	if channel not in PUSHER_CHANNELS:
+		raise Exception('Unknown channel {}'.format(channel))
+
+	if pair is None or pair == BTC_USD:
+		return PUSHER_CHANNELS[channel]
+
+	return '{}_{}'.format(PUSHER_CHANNELS[channel], pair)
+
+
+class Subscription(object):
+	def __init__(self, maxsize):
+		'''
+		Bounded buffer of one stream. When the consumer is too slow, the oldest messages are dropped.
+		:param maxsize: number of buffered messages
+		:return: The subscription object
+		'''
+		self.queue = asyncio.Queue(maxsize)
+		self.dropped = 0
+
+	def put(self, item):
+		if self.queue.full():
+			self.queue.get_nowait()
+			self.dropped += 1
+
+		self.queue.put_nowait(item)
+
+
+class AsyncStreamClient(object):
+	def __init__(self, endpoint, connect=None):
+		'''
+		All the streams of one client share a single web socket connection. The connection is opened with the first
+		stream and closed when the last one ends; Pusher channels are subscribed to and unsubscribed from as streams
+		come and go.
+		:param endpoint: web socket endpoint (Bitstamp.websockets_endpoint)
+		:param connect: optional coroutine function that opens a connection to a URL, defaults to websockets.connect
+		:return: The client object
+		'''
+		if connect is None:
+			try:
+				import websockets
+			except ImportError:
+				raise Exception('Async streams require the websockets package (pip install websockets)')
+
+			connect = websockets.connect
+
+		self.endpoint = endpoint
+		self.connect = connect
+		self.connection = None
+		self.reader = None
+		self.lock = None
+		self.subscriptions = {}
+
+	async def stream(self, channel, pair=None, maxsize=DEFAULT_MAXSIZE):
+		'''
+		Yields the messages of the channel as they arrive. Breaking out of the loop or cancelling the task that
+		iterates unsubscribes the stream.
+		:param channel: one of bitstamp.WS_CHANNEL_LIVE_TRADES, bitstamp.WS_CHANNEL_ORDER_BOOK or bitstamp.WS_CHANNEL_ORDER_BOOK_DIFF
+		:param pair: one of the currency pairs
+		:param maxsize: number of messages buffered for this stream
+		:return: async generator of decoded messages
+		'''
+		name = pusher_channel(channel, pair)
+		subscription = Subscription(maxsize)
+		await self.__subscribe(name, subscription)
+
+		try:
+			while True:
+				item = await subscription.queue.get()
+
+				if isinstance(item, Exception):
+					raise item
+
+				yield item
+		finally:
+			await self.__unsubscribe(name, subscription)
+
+	async def __subscribe(self, name, subscription):
+		if self.lock is None:
+			self.lock = asyncio.Lock()
+
+		async with self.lock:
+			if self.connection is None:
+				self.connection = await self.connect(self.endpoint)
+				self.reader = asyncio.ensure_future(self.__read(self.connection))
+
+			if name not in self.subscriptions:
+				self.subscriptions[name] = set()
+				await self.connection.send(json.dumps({'event': 'pusher:subscribe', 'data': {'channel': name}}))
+
+			self.subscriptions[name].add(subscription)
+
+	async def __unsubscribe(self, name, subscription):
+		async with self.lock:
+			subscriptions = self.subscriptions.get(name)
+
+			if subscriptions is None or subscription not in subscriptions:
+				return
+
+			subscriptions.discard(subscription)
+			if subscriptions:
+				return
+
+			del self.subscriptions[name]
+			if self.connection is None:
+				return
+
+			if self.subscriptions:
+				await self.connection.send(json.dumps({'event': 'pusher:unsubscribe', 'data': {'channel': name}}))
+			else:
+				await self.__close()
+
+	async def __close(self):
+		connection = self.connection
+		self.connection = None
+		self.reader.cancel()
+		await connection.close()
+
+	async def __read(self, connection):
+		'''
+		Reads the connection and dispatches the messages to the streams of their channels.
+		:param connection: open web socket connection
+		:return: None
+		'''
+		try:
+			async for raw in connection:
+				message = json.loads(raw)
+				event = message.get('event')
+
+				if event in DATA_EVENTS:
+					subscriptions = self.subscriptions.get(message.get('channel'))
+					if subscriptions:
+						data = json.loads(message.get('data'))
+						for subscription in subscriptions:
+							subscription.put(data)
+				elif event == 'pusher:ping':
+					await connection.send(json.dumps({'event': 'pusher:pong', 'data': {}}))
+
+			error = Exception('Web socket connection was closed')
+		except asyncio.CancelledError:
+			raise
+		except Exception as exception:
+			error = exception
+
+		# Let every stream know the connection is gone, the next stream will open a new one
+		if self.connection is connection:
+			self.connection = None
+		for subscriptions in self.subscriptions.values():
+			for subscription in subscriptions:
+				subscription.put(error)
+		self.subscriptions = {}
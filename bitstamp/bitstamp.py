@@ -1,13 +1,20 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
 from datetime import datetime
+import asyncio
 import json
 import hmac
 import hashlib
+import threading
 import time
 
 import websocket
 import requests
 
+from bitstamp import fixedpoint
+from bitstamp import streaming
+
 EXAMPLES_URL = 'https://github.com/Pancho/bitstamp'
 BITSTAMP_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
 WS_CHANNEL_LIVE_TRADES = 'live-trades'
@@ -23,10 +30,90 @@ ALL_PAIRS = [
 	BTC_EUR,
 	BTC_EUR,
 ]
+# Number of decimal places prices of each pair are quoted in, used in the fixed-point mode
+PRICE_DECIMALS = {
+	BTC_USD: 2,
+	BTC_EUR: 2,
+	EUR_USD: 5,
+}
+# Minimal order volume (price * amount) in the quote currency
+MINIMAL_ORDER_VOLUME = 5
+# How old (in seconds) a snapshot from the snapshot cache can be before a live request is made instead
+DEFAULT_MAX_STALENESS = 5
+DEFAULT_BATCH_WORKERS = 8
+ORDER_SIDE_BUY = 'buy'
+ORDER_SIDE_SELL = 'sell'
+# Amend modes: send the cancel and the new order at the same time, cancel before placing, or place before cancelling
+AMEND_CONCURRENT = 'concurrent'
+AMEND_CANCEL_FIRST = 'cancel_first'
+AMEND_PLACE_FIRST = 'place_first'
+# Number of the latest amend latencies kept in Bitstamp.amend_latencies
+AMEND_LATENCY_HISTORY = 1000
+RESULT_LIST = 'list'
+RESULT_OBJECT = 'object'
+
+
+class Endpoint(object):
+	def __init__(self, method, path=None, pair_path=None, signed=False, params=None, result=RESULT_OBJECT):
+		'''
+		Describes one resource of the REST API.
+		:param method: HTTP method, GET or POST
+		:param path: path relative to the API endpoint, used when no currency pair is given (None if a pair is required)
+		:param pair_path: path with a {} placeholder for the currency pair (None if the resource doesn't take a pair)
+		:param signed: True if the resource requires signature
+		:param params: names of the parameters the resource takes
+		:param result: RESULT_LIST or RESULT_OBJECT, the type of the JSON result
+		:return: The endpoint object
+		'''
+		self.method = method
+		self.path = path
+		self.pair_path = pair_path
+		self.signed = signed
+		self.params = params or []
+		self.result = result
+
+
+class RequestTemplate(object):
+	def __init__(self, endpoint, url, pair_url):
+		'''
+		Endpoint bound to a client: the URLs are complete, only values, nonce and signature are left to fill in.
+		:param endpoint: Endpoint
+		:param url: full URL without a currency pair
+		:param pair_url: full URL with a {} placeholder for the currency pair
+		:return: The template object
+		'''
+		self.method = endpoint.method
+		self.url = url
+		self.pair_url = pair_url
+		self.signed = endpoint.signed
+		self.params = endpoint.params
+		self.result = endpoint.result
+
+
+ENDPOINTS = {
+	'ticker': Endpoint('GET', pair_path='v2/ticker/{}/'),
+	'order_book': Endpoint('GET', pair_path='v2/order_book/{}/'),
+	'transactions': Endpoint('GET', pair_path='v2/transactions/{}/', params=['time'], result=RESULT_LIST),
+	'eur_usd': Endpoint('GET', 'eur_usd/'),
+	'balance': Endpoint('POST', 'v2/balance/', 'v2/balance/{}/', signed=True),
+	'user_transactions': Endpoint('POST', 'v2/user_transactions/', 'v2/user_transactions/{}/', signed=True,
+	                              params=['offset', 'limit', 'sort'], result=RESULT_LIST),
+	'open_orders': Endpoint('POST', 'v2/open_orders/all/', 'v2/open_orders/{}/', signed=True, result=RESULT_LIST),
+	'order_status': Endpoint('POST', 'order_status/', signed=True, params=['id']),
+	'buy_limit_order': Endpoint('POST', pair_path='v2/buy/{}/', signed=True, params=['price', 'amount', 'limit_price']),
+	'sell_limit_order': Endpoint('POST', pair_path='v2/sell/{}/', signed=True, params=['price', 'amount', 'limit_price']),
+	'cancel_order': Endpoint('POST', 'cancel_order/', signed=True, params=['id']),
+	'withdrawal_requests': Endpoint('POST', 'withdrawal_requests/', signed=True, result=RESULT_LIST),
+	'bitcoin_withdrawal': Endpoint('POST', 'bitcoin_withdrawal/', signed=True, params=['amount', 'address']),
+	'unconfirmed_bitcoin_deposits': Endpoint('POST', 'unconfirmed_btc/', signed=True, result=RESULT_LIST),
+	'wallet_address': Endpoint('POST', 'bitcoin_deposit_address/', signed=True),
+}
 
 
 class Bitstamp(object):
-	def __init__(self, config_file_path=None, api_key=None, secret=None, customer_id=None, api_endpoint=None):
+	def __init__(self, config_file_path=None, api_key=None, secret=None, customer_id=None, api_endpoint=None,
+	             fixed_point=False, snapshot_cache=None, max_staleness=DEFAULT_MAX_STALENESS, session=None,
+	             clock=None):
 		'''
 		Constructor. You can instantiate this class with either file path or with all three values that would otherwise
 		 be found in the config file.
@@ -34,6 +121,12 @@ class Bitstamp(object):
 		:param api_key: API key found on https://www.bitstamp.net/account/security/api/
 		:param secret: Secret found on https://www.bitstamp.net/account/security/api/ (disappears after some time)
 		:param customer_id: Customer ID found on https://www.bitstamp.net/account/balance/
+		:param api_endpoint: optional base URL of the REST API
+		:param fixed_point: if True, prices and amounts are integers (price ticks and satoshis), see PRICE_DECIMALS
+		:param snapshot_cache: optional bitstamp.snapshot.SnapshotCache ticker, order_book and eur_usd are read from
+		:param max_staleness: age in seconds after which a cached snapshot is ignored and the API is called instead
+		:param session: optional requests.Session, e.g. to share its connection pool between several clients
+		:param clock: optional bitstamp.clock.ClockSync, fed with the timing of every response and used for nonces
 		:return: The client object
 		'''
 		# None of the parameters are necessary, but to work properly, we need at least one pair from one source
@@ -56,6 +149,12 @@ class Bitstamp(object):
 			self.api_endpoint = 'https://www.bitstamp.net/api/'
 		else:
 			self.api_endpoint = api_endpoint
+		self.fixed_point = fixed_point
+		self.snapshot_cache = snapshot_cache
+		self.max_staleness = max_staleness
+		# Both requests and a requests.Session have get and post with the same signature
+		self.http = requests if session is None else session
+		self.clock = clock
 		# Why didn't I use the pushed API?
 		# 1. I wanted this client lib to be Python3 compatible - Pusher doesn't support that (clearly) yet
 		# 2. Don't want all the ballast that comes along (a whole lib for three channels and supporting libs)
@@ -67,6 +166,14 @@ class Bitstamp(object):
 			WS_CHANNEL_ORDER_BOOK_DIFF: '{"event":"pusher:subscribe","data":{"channel":"diff_order_book"}}',
 		}
 		self.ws_data_events = ['data', 'trade']
+		self.async_streams = None
+		self.__nonce_lock = threading.Lock()
+		self.__last_nonce = 0
+		self.__amend_executor = None
+		self.amend_latencies = deque(maxlen=AMEND_LATENCY_HISTORY)
+		self.__signer = hmac.new(self.secret.encode('utf8'), digestmod=hashlib.sha256)
+		self.__signature_suffix = '{}{}'.format(self.customer_id, self.api_key).encode('utf8')
+		self.templates = self.__build_templates()
 
 	def __str__(self):
 		'''
@@ -140,13 +247,160 @@ class Bitstamp(object):
 	def __get_signature(self):
 		'''
 		Returns the signature for the next REST API call. nonce will be a timestamp (time.time()) multiplied by 1000,
-		so we include some of the decimal part to reduce the chance of sending the same one more than once.
+		so we include some of the decimal part to reduce the chance of sending the same one more than once. Nonces
+		are strictly increasing even if several calls are signed in the same millisecond. With a clock, the timestamp is
+		taken on the estimated server clock, so a drifting local clock doesn't push nonces out of the accepted range.
 		:return: nonce, signature (tuple)
 		'''
-		nonce = str(int(time.time() * 1000))
-		signature_raw = '{}{}{}'.format(nonce, self.customer_id, self.api_key)
-		return nonce, hmac.new(self.secret.encode('utf8'), msg=signature_raw.encode('utf8'),
-		                       digestmod=hashlib.sha256).hexdigest().upper()
+		now = time.time() if self.clock is None else self.clock.now()
+		with self.__nonce_lock:
+			self.__last_nonce = max(int(now * 1000), self.__last_nonce + 1)
+			nonce = str(self.__last_nonce)
+		# The key is set up once in the constructor, only the message has to be hashed for every call
+		signer = self.__signer.copy()
+		signer.update(nonce.encode('utf8') + self.__signature_suffix)
+		return nonce, signer.hexdigest().upper()
+
+	def __build_templates(self):
+		'''
+		Builds request templates of all the endpoints, so a call only has to fill in the values, nonce and signature.
+		:return: dict of endpoint name to RequestTemplate
+		'''
+		templates = {}
+
+		for name, endpoint in ENDPOINTS.items():
+			templates[name] = RequestTemplate(
+				endpoint,
+				None if endpoint.path is None else '{}{}'.format(self.api_endpoint, endpoint.path),
+				None if endpoint.pair_path is None else '{}{}'.format(self.api_endpoint, endpoint.pair_path),
+			)
+
+		return templates
+
+	def prepare(self, name, currency=None, **params):
+		'''
+		Prepares (and signs, if the endpoint requires it) a request to one of the ENDPOINTS without sending it.
+		Values are not validated here, the public methods do that before they call this one.
+		:param name: name of the endpoint
+		:param currency: one of the currency pairs, for endpoints that take it
+		:param params: values of the endpoint's parameters, None values are left out
+		:return: (HTTP method, URL, data) tuple that can be passed to send
+		'''
+		template = self.templates[name]
+
+		if currency is None:
+			if template.url is None:
+				raise Exception('Endpoint {} needs a currency pair'.format(name))
+			url = template.url
+		else:
+			if template.pair_url is None:
+				raise Exception('Endpoint {} doesn\'t take a currency pair'.format(name))
+			url = template.pair_url.format(currency)
+
+		data = {}
+		if template.signed:
+			nonce, signature = self.__get_signature()
+			data['key'] = self.api_key
+			data['nonce'] = nonce
+			data['signature'] = signature
+
+		for param in template.params:
+			value = params.get(param)
+			if value is not None:
+				data[param] = value
+
+		return template.method, url, data
+
+	def send(self, prepared, stream=False):
+		'''
+		Sends a prepared request.
+		:param prepared: result of prepare
+		:param stream: if True, the body is not downloaded until it's read from the response
+		:return: requests response
+		'''
+		method, url, data = prepared
+		sent = time.time()
+
+		if method == 'GET':
+			response = self.http.get(url, params=data, stream=stream)
+		else:
+			response = self.http.post(url, data=data, stream=stream)
+
+		if self.clock is not None:
+			self.clock.add_response(sent, time.time(), response)
+
+		return response
+
+	def call(self, name, currency=None, **params):
+		'''
+		Prepares the request to the endpoint, sends it and returns the decoded result.
+		:param name: name of the endpoint
+		:param currency: one of the currency pairs, for endpoints that take it
+		:param params: values of the endpoint's parameters
+		:return: decoded JSON result
+		'''
+		return json.loads(self.send(self.prepare(name, currency, **params)).text)
+
+	async def call_async(self, name, currency=None, **params):
+		'''
+		Same as call, for use in asyncio code; the request runs in the default executor so the loop isn't blocked.
+		:return: decoded JSON result
+		'''
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(None, lambda: self.call(name, currency, **params))
+
+	def batch(self, calls, max_workers=DEFAULT_BATCH_WORKERS):
+		'''
+		Calls several endpoints concurrently. Unsigned calls run in parallel; signed calls are sent one after another
+		in a single worker, as the API rejects nonces that arrive out of order.
+		:param calls: list of (name, currency, params dict) tuples
+		:param max_workers: number of requests in flight at once
+		:return: list of decoded results in the order of calls; a failed call's exception is put in its place
+		'''
+		def run(indexed_calls):
+			results = []
+			for index, (name, currency, params) in indexed_calls:
+				try:
+					results.append((index, self.call(name, currency, **params)))
+				except Exception as exception:
+					results.append((index, exception))
+			return results
+
+		signed = [(index, call) for index, call in enumerate(calls) if self.templates[call[0]].signed]
+		unsigned = [[(index, call)] for index, call in enumerate(calls) if not self.templates[call[0]].signed]
+		groups = unsigned + ([signed] if signed else [])
+		results = [None] * len(calls)
+
+		with ThreadPoolExecutor(max_workers=max_workers) as executor:
+			for group_results in executor.map(run, groups):
+				for index, result in group_results:
+					results[index] = result
+
+		return results
+
+	def iter_call(self, name, currency=None, chunk_size=streaming.DEFAULT_CHUNK_SIZE, **params):
+		'''
+		Calls the endpoint and parses the result incrementally while it's being downloaded (see streaming).
+		:param name: name of the endpoint
+		:param currency: one of the currency pairs, for endpoints that take it
+		:param chunk_size: number of bytes read from the response at once
+		:param params: values of the endpoint's parameters
+		:return: generator of items for list results, generator of (key, value) tuples for object results
+		'''
+		response = self.send(self.prepare(name, currency, **params), stream=True)
+
+		with response:
+			if self.templates[name].result == RESULT_LIST:
+				for item in streaming.iter_array(response.iter_content(chunk_size)):
+					yield item
+			else:
+				for member in streaming.iter_object(response.iter_content(chunk_size)):
+					yield member
+
+	@staticmethod
+	def __validate_timespan(timespan):
+		if timespan != 'hour' and timespan != 'minute':
+			raise Exception('Parameter time can be only "hour" or "minute". Default is "hour"')
 
 	@staticmethod
 	def __parse_ticker(blob):
@@ -162,33 +416,116 @@ class Bitstamp(object):
 
 		return blob
 
+	@staticmethod
+	def __parse_ticker_fixed(blob, currency):
+		price_decimals = PRICE_DECIMALS[currency]
+
+		blob['timestamp'] = int(blob.get('timestamp'))
+		for key in ['high', 'ask', 'last', 'low', 'open', 'bid', 'vwap']:
+			blob[key] = fixedpoint.parse(blob.get(key), price_decimals)
+		blob['volume'] = fixedpoint.parse(blob.get('volume'), fixedpoint.AMOUNT_DECIMALS)
+
+		return blob
+
+	def __parse_order_book(self, blob, currency):
+		if 'bids' not in blob or 'asks' not in blob:
+			return blob
+
+		blob['timestamp'] = int(blob.get('timestamp'))
+		if self.fixed_point:
+			blob['bids'] = fixedpoint.parse_levels(blob.get('bids'), PRICE_DECIMALS[currency])
+			blob['asks'] = fixedpoint.parse_levels(blob.get('asks'), PRICE_DECIMALS[currency])
+		else:
+			blob['bids'] = [(float(price), float(amount)) for price, amount in blob.get('bids')]
+			blob['asks'] = [(float(price), float(amount)) for price, amount in blob.get('asks')]
+
+		return blob
+
+	def __order_values(self, amount, price, currency, limit_price):
+		'''
+		Validates the values of a limit order and formats them the way the API expects them. In fixed-point mode
+		amount is in satoshis and prices are in ticks of the pair (see PRICE_DECIMALS), so the volume check is exact.
+		:return: dict with formatted price, amount and optionally limit_price
+		'''
+		if amount < 0:
+			raise Exception('Amount has to be a positive float')
+
+		if price < 0:
+			raise Exception('Price has to be a positive float')
+
+		if self.fixed_point:
+			price_decimals = PRICE_DECIMALS[currency]
+			minimal_volume = MINIMAL_ORDER_VOLUME * 10 ** (price_decimals + fixedpoint.AMOUNT_DECIMALS)
+		else:
+			minimal_volume = MINIMAL_ORDER_VOLUME
+
+		if (price * amount) < minimal_volume:
+			raise Exception('Order volume (price * amount) has to be at least 5$')
+
+		if self.fixed_point:
+			values = {
+				'price': fixedpoint.to_string(price, price_decimals),
+				'amount': fixedpoint.to_string(amount, fixedpoint.AMOUNT_DECIMALS),
+			}
+		else:
+			values = {
+				'price': '{:.2f}'.format(price),
+				'amount': '{:.8f}'.format(amount),
+			}
+
+		if limit_price is not None:
+			if limit_price < 0:
+				raise Exception('Limit price has to be a positive float')
+
+			if (limit_price * amount) < minimal_volume:
+				raise Exception('Order volume (limit_price * amount) has to be at least 5$')
+
+			if self.fixed_point:
+				values['limit_price'] = fixedpoint.to_string(limit_price, price_decimals)
+			else:
+				values['limit_price'] = limit_price
+
+		return values
+
 	def ticker(self, currency=BTC_USD, parsed=False):
 		'''
 		This method will call ticker resource and return the result.
 		:param currency: one of the currency pairs
-		:param parsed: if True, blob will be parsed
+		:param parsed: if True, blob will be parsed (to integers in fixed-point mode)
 		:return: ticker blob (dict)
 		'''
-		resource = 'v2/ticker/{}/'.format(currency)
+		blob = None
+		if self.snapshot_cache is not None:
+			blob = self.snapshot_cache.ticker(currency, self.max_staleness)
 
-		response = requests.get('{}{}'.format(self.api_endpoint, resource))
+		if blob is None:
+			blob = self.call('ticker', currency)
 
-		if parsed:
-			return self.__parse_ticker(json.loads(response.text))
+		if parsed and self.fixed_point:
+			return self.__parse_ticker_fixed(blob, currency)
+		elif parsed:
+			return self.__parse_ticker(blob)
 		else:
-			return json.loads(response.text)
+			return blob
 
-	def order_book(self, currency=BTC_USD):
+	def order_book(self, currency=BTC_USD, parsed=False):
 		'''
 		This method will call order_book resource and return the result.
 		:param currency: one of the currency pairs
+		:param parsed: if True, levels will be parsed to (price, amount) tuples (of integers in fixed-point mode)
 		:return: order book blob (dict)
 		'''
-		resource = 'v2/order_book/{}/'.format(currency)
+		blob = None
+		if self.snapshot_cache is not None:
+			blob = self.snapshot_cache.order_book(currency, self.max_staleness)
 
-		response = requests.get('{}{}'.format(self.api_endpoint, resource))
+		if blob is None:
+			blob = self.call('order_book', currency)
 
-		return json.loads(response.text)
+		if parsed:
+			return self.__parse_order_book(blob, currency)
+		else:
+			return blob
 
 	def transactions(self, currency=BTC_USD, timespan='hour'):
 		'''
@@ -197,109 +534,87 @@ class Bitstamp(object):
 		:param timespan: minute/hour string
 		:return: list of transactions made in the past minute/hour
 		'''
-		resource = 'v2/transactions/{}/'.format(currency)
+		self.__validate_timespan(timespan)
 
-		if timespan != 'hour' and timespan != 'minute':
-			raise Exception('Parameter time can be only "hour" or "minute". Default is "hour"')
+		return self.call('transactions', currency, time=timespan)
 
-		response = requests.get('{}{}'.format(self.api_endpoint, resource), data={
-			'time': timespan
-		})
+	def iter_order_book(self, currency=BTC_USD, chunk_size=streaming.DEFAULT_CHUNK_SIZE):
+		'''
+		This method will call order_book resource and yield the result while it's still being downloaded, so the whole
+		order book is never held in memory at once.
+		:param currency: one of the currency pairs
+		:param chunk_size: number of bytes read from the response at once
+		:return: generator of (key, value) tuples: ('timestamp', timestamp) and one ('bids', level) or ('asks', level)
+		 for each level of the order book, in the order they were received
+		'''
+		return self.iter_call('order_book', currency, chunk_size)
+
+	def iter_transactions(self, currency=BTC_USD, timespan='hour', chunk_size=streaming.DEFAULT_CHUNK_SIZE):
+		'''
+		This method will call transactions resource and yield transactions one by one while the response is still
+		being downloaded.
+		:param currency: one of the currency pairs
+		:param timespan: minute/hour string
+		:param chunk_size: number of bytes read from the response at once
+		:return: generator of transactions made in the past minute/hour
+		'''
+		self.__validate_timespan(timespan)
 
-		return json.loads(response.text)
+		return self.iter_call('transactions', currency, chunk_size, time=timespan)
 
 	def eur_usd(self):
 		'''
 		This method will call eur_usd resource and return the result.
 		:return: dict with the exchange rates between USD and EUR currencies
 		'''
-		resource = 'eur_usd/'
+		blob = None
+		if self.snapshot_cache is not None:
+			blob = self.snapshot_cache.eur_usd(self.max_staleness)
 
-		response = requests.get('{}{}'.format(self.api_endpoint, resource))
+		if blob is None:
+			blob = self.call('eur_usd')
 
-		return json.loads(response.text)
+		return blob
 
 	def balance(self, currency=None):
 		'''
 		This method will call balance resource and return the result.
 		This is a resource that requires signature.
-		:param currency: one of the currency pairs
+		:param currency: one of the currency pairs, if None, balances of all the pairs are returned
 		:return: a dict containing all the info about user account balance, BTC included
 		'''
-		if currency is not None:  # This is the case when user want all of their balances
-			resource = 'v2/balance/'
-		else:
-			resource = 'v2/balance/{}/'.format(currency)
-
-		nonce, signature = self.__get_signature()
-
-		response = requests.post('{}{}'.format(self.api_endpoint, resource), data={
-			'key': self.api_key,
-			'nonce': nonce,
-			'signature': signature,
-		})
-
-		return json.loads(response.text)
+		return self.call('balance', currency)
 
 	def user_transactions(self, currency=None, offset=0, limit=100, sort='desc'):
 		'''
 		This method will call user_transactions resource and return the result.
 		This is a resource that requires signature.
-		:param currency: one of the currency pairs
+		:param currency: one of the currency pairs, if None, transactions of all the pairs are returned
 		:param offset: offset, useful for pagination, that has to be positive number
 		:param limit: limit of how many transactions you will receive, in range (0, 1000]
 		:param sort: one of the values: 'desc' or 'asc'
 		:return: a list of user's transactions
 		'''
-		if currency is not None:  # This is the case when user want all of their transactions
-			resource = 'v2/user_transactions/'
-		else:
-			resource = 'v2/user_transactions/{}/'.format(currency)
-
 		if offset < 0:
 			raise Exception('Offset has to be a positive number')
 
 		if limit < 1 or limit > 1000:
 			raise Exception('Limit has to be a number from range [1, 1000]')
 
-		if sort is not USER_TRANSACTION_ORDERING_ASC and sort is not USER_TRANSACTION_ORDERING_DESC:
+		if sort != USER_TRANSACTION_ORDERING_ASC and sort != USER_TRANSACTION_ORDERING_DESC:
 			raise Exception('Sort parameter has to be one of {} or {}'.format(USER_TRANSACTION_ORDERING_DESC,
 			                                                                  USER_TRANSACTION_ORDERING_ASC))
 
-		nonce, signature = self.__get_signature()
-
-		response = requests.post('{}{}'.format(self.api_endpoint, resource), data={
-			'key': self.api_key,
-			'nonce': nonce,
-			'signature': signature,
-			'offset': offset,
-			'limit': limit,
-			'sort': sort,
-		})
-
-		return json.loads(response.text)
+		return self.call('user_transactions', currency, offset=offset, limit=limit, sort=sort)
 
 	def open_orders(self, currency=None):
 		'''
 		This method will call open_orders resource and return the result.
 		This is a resource that requires signature.
-		:param currency: one of the currency pairs
+		:param currency: one of the currency pairs, if None, open orders of all the pairs are returned
 		:return: a list of dictionaries that represent orders that haven't been closed yet
 		'''
-		if currency is not None:  # This is the case when user want all of their transactions
-			resource = 'v2/open_orders/'
-		else:
-			resource = 'v2/open_orders/{}/'.format(currency)
-
-		nonce, signature = self.__get_signature()
-
-		response = requests.post('{}{}'.format(self.api_endpoint, resource), data={
-			'key': self.api_key,
-			'nonce': nonce,
-			'signature': signature,
-		})
-
-		return json.loads(response.text)
+		return self.call('open_orders', currency)
 
 	def order_status(self, order_id):
 		'''
@@ -307,108 +622,119 @@ class Bitstamp(object):
 		This is a resource that requires signature.
 		:return: a dictionary that represent order current status and the transactions that have acted upon it
 		'''
-		resource = 'order_status/'
-
-		nonce, signature = self.__get_signature()
-
-		response = requests.post('{}{}'.format(self.api_endpoint, resource), data={
-			'key': self.api_key,
-			'nonce': nonce,
-			'signature': signature,
-			'id': order_id,
-		})
-
-		return json.loads(response.text)
+		return self.call('order_status', id=order_id)
 
 	def buy_limit_order(self, amount, price, currency=BTC_USD, limit_price=None):
 		'''
 		This method will call buy resource and return the result.
 		This is a resource that requires signature.
 		This method will throw exception if amount * price yields a float that's less than 5
-		:param amount: a float, the will be rounded to 8 decimal places, has to be positive
-		:param price:  a float that will be rounded to 2 decimal places, has to be positive
+		:param amount: a float, the will be rounded to 8 decimal places, has to be positive (satoshis in fixed-point mode)
+		:param price:  a float that will be rounded to 2 decimal places, has to be positive (ticks in fixed-point mode)
 		:param currency: one of the currency pairs
-		:param limit_price: a float that will be rounded to 2 decimal places, has to be positive
+		:param limit_price: a float that will be rounded to 2 decimal places, has to be positive (ticks in fixed-point mode)
 		:return: a boolean value, True if the order has been successfully opened, False if it failed
 		'''
-		resource = 'v2/buy/{}/'.format(currency)
-
-		if amount < 0:
-			raise Exception('Amount has to be a positive float')
-
-		if price < 0:
-			raise Exception('Price has to be a positive float')
-
-		if (price * amount) < 5:
-			raise Exception('Order volume (price * amount) has to be at least 5$')
-
-		nonce, signature = self.__get_signature()
-
-		data = {
-			'key': self.api_key,
-			'nonce': nonce,
-			'signature': signature,
-			'price': '{:.2f}'.format(price),
-			'amount': '{:.8f}'.format(amount),
-		}
-
-		if limit_price is not None:
-			if limit_price < 0:
-				raise Exception('Limit price has to be a positive float')
-
-			if (limit_price * amount) < 5:
-				raise Exception('Order volume (limit_price * amount) has to be at least 5$')
-
-			data['limit_price'] = limit_price
-
-		response = requests.post('{}{}'.format(self.api_endpoint, resource), data=data)
-
-		return json.loads(response.text)
+		return self.call('buy_limit_order', currency, **self.__order_values(amount, price, currency, limit_price))
 
 	def sell_limit_order(self, amount, price, currency=BTC_USD, limit_price=None):
 		'''
 		This method will call sell resource and return the result.
 		This is a resource that requires signature.
 		This method will throw exception if amount * price yields a float that's less than 5
-		:param amount: a float, the will be rounded to 8 decimal places, has to be positive
-		:param price:  a float that will be rounded to 2 decimal places, has to be positive
+		:param amount: a float, the will be rounded to 8 decimal places, has to be positive (satoshis in fixed-point mode)
+		:param price:  a float that will be rounded to 2 decimal places, has to be positive (ticks in fixed-point mode)
 		:param currency: one of the currency pairs
-		:param limit_price: a float that will be rounded to 2 decimal places, has to be positive
+		:param limit_price: a float that will be rounded to 2 decimal places, has to be positive (ticks in fixed-point mode)
 		:return: a boolean value, True if the order has been successfully opened, False if it failed
 		'''
-		resource = 'v2/sell/{}/'.format(currency)
+		return self.call('sell_limit_order', currency, **self.__order_values(amount, price, currency, limit_price))
 
-		if amount < 0:
-			raise Exception('Amount has to be a positive float')
+	@staticmethod
+	def is_error(result):
+		'''
+		:param result: decoded result of a call
+		:return: True if the API responded with an error
+		'''
+		return isinstance(result, dict) and ('error' in result or result.get('status') == 'error')
 
-		if price < 0:
-			raise Exception('Price has to be a positive float')
+	@staticmethod
+	def __is_nonce_error(result):
+		return Bitstamp.is_error(result) and 'nonce' in json.dumps(result).lower()
+
+	def amend_order(self, order_id, amount, price, side=ORDER_SIDE_BUY, currency=BTC_USD, limit_price=None,
+	                mode=AMEND_CONCURRENT):
+		'''
+		Replaces an open order with a new limit order. Both requests are validated and signed before anything is sent.
+		In the concurrent mode the cancel and the new order are in flight at the same time, so the quote is updated in
+		about one round trip. The API rejects a nonce lower than one it has already seen, so if one of the two requests
+		overtakes the other, the one that arrived second is signed again and resent once.
+		:param order_id: ID of the order to cancel
+		:param amount: amount of the new order (see buy_limit_order)
+		:param price: price of the new order (see buy_limit_order)
+		:param side: ORDER_SIDE_BUY or ORDER_SIDE_SELL
+		:param currency: one of the currency pairs
+		:param limit_price: optional limit price of the new order
+		:param mode: AMEND_CONCURRENT, AMEND_CANCEL_FIRST (the new order is placed only if the cancel succeeded) or
+		 AMEND_PLACE_FIRST (the old order is cancelled only if the new one was placed)
+		:return: dict with results of the cancel and the order (None if it wasn't sent) and the latency in seconds
+		'''
+		if side != ORDER_SIDE_BUY and side != ORDER_SIDE_SELL:
+			raise Exception('Side has to be one of {} or {}'.format(ORDER_SIDE_BUY, ORDER_SIDE_SELL))
 
-		if (price * amount) < 5:
-			raise Exception('Order volume (price * amount) has to be at least 5$')
+		if mode not in [AMEND_CONCURRENT, AMEND_CANCEL_FIRST, AMEND_PLACE_FIRST]:
+			raise Exception('Mode has to be one of {}, {} or {}'.format(AMEND_CONCURRENT, AMEND_CANCEL_FIRST,
+			                                                           AMEND_PLACE_FIRST))
 
-		nonce, signature = self.__get_signature()
+		if order_id is None:
+			raise Exception('You have to provide an order id (you can get the list of open orders with open_roders())')
 
-		data = {
-			'key': self.api_key,
-			'nonce': nonce,
-			'signature': signature,
-			'price': '{:.2f}'.format(price),
-			'amount': '{:.8f}'.format(amount),
+		order_name = '{}_limit_order'.format(side)
+		values = self.__order_values(amount, price, currency, limit_price)
+		cancel_request = self.prepare('cancel_order', id=order_id)
+		order_request = self.prepare(order_name, currency, **values)
+
+		started = time.time()
+		cancel = None
+		order = None
+
+		if mode == AMEND_CONCURRENT:
+			if self.__amend_executor is None:
+				self.__amend_executor = ThreadPoolExecutor(max_workers=2)
+
+			cancel_future = self.__amend_executor.submit(lambda: json.loads(self.send(cancel_request).text))
+			order = json.loads(self.send(order_request).text)
+			cancel = cancel_future.result()
+
+			if self.__is_nonce_error(cancel):
+				cancel = self.call('cancel_order', id=order_id)
+			if self.__is_nonce_error(order):
+				order = self.call(order_name, currency, **values)
+		elif mode == AMEND_CANCEL_FIRST:
+			# The order was signed after the cancel, so both can be sent as they are
+			cancel = json.loads(self.send(cancel_request).text)
+			if not self.is_error(cancel):
+				order = json.loads(self.send(order_request).text)
+		else:
+			# The order was signed after the cancel, so the cancel has to be signed again to be sent after it
+			order = json.loads(self.send(order_request).text)
+			if not self.is_error(order):
+				cancel = self.call('cancel_order', id=order_id)
+
+		latency = time.time() - started
+		self.amend_latencies.append(latency)
+
+		return {
+			'cancel': cancel,
+			'order': order,
+			'latency': latency,
 		}
 
-		if limit_price is not None:
-			if limit_price < 0:
-				raise Exception('Limit price has to be a positive float')
-
-			if (limit_price * amount) < 5:
-				raise Exception('Order volume (limit_price * amount) has to be at least 5$')
-
-			data['limit_price'] = limit_price
-
-		response = requests.post('{}{}'.format(self.api_endpoint, resource), data=data)
-
-		return json.loads(response.text)
+	def __format_amount(self, amount):
+		if self.fixed_point:
+			return fixedpoint.to_string(amount, fixedpoint.AMOUNT_DECIMALS)
+		else:
+			return '{:.8f}'.format(amount)
 
 	def cancel_order(self, order_id):
 		'''
@@ -417,21 +743,10 @@ class Bitstamp(object):
 		:param order_id: integer or string if the order's ID (can be found via open_orders method)
 		:return: a boolean value, True if the order has been successfully closed, False if it failed
 		'''
-		resource = 'cancel_order/'
-
 		if order_id is None:
 			raise Exception('You have to provide an order id (you can get the list of open orders with open_roders())')
 
-		nonce, signature = self.__get_signature()
-
-		response = requests.post('{}{}'.format(self.api_endpoint, resource), data={
-			'key': self.api_key,
-			'nonce': nonce,
-			'signature': signature,
-			'id': order_id,
-		})
-
-		return json.loads(response.text)
+		return self.call('cancel_order', id=order_id)
 
 	def withdrawal_requests(self):
 		'''
@@ -439,45 +754,23 @@ class Bitstamp(object):
 		This is a resource that requires signature.
 		:return: a list of dictionaries, each representing one withdrawal request
 		'''
-		resource = 'withdrawal_requests/'
-
-		nonce, signature = self.__get_signature()
-
-		response = requests.post('{}{}'.format(self.api_endpoint, resource), data={
-			'key': self.api_key,
-			'nonce': nonce,
-			'signature': signature,
-		})
-
-		return json.loads(response.text)
+		return self.call('withdrawal_requests')
 
 	def bitcoin_withdrawal(self, amount, address):
 		'''
 		This method will call bitcoin_withdrawal and return the result.
 		This is a resource that requires signature.
-		:param amount: a positive number, BTC amount for withdrawal
+		:param amount: a positive number, BTC amount for withdrawal (satoshis in fixed-point mode)
 		:param address: a wallet address, a string that's longer than 25 characters and shorter than 35 characters
 		:return: a boolean if withdrawal was successful and false if it failed
 		'''
-		resource = 'bitcoin_withdrawal/'
-
 		if amount <= 0:
 			raise Exception('Amount has to be a positive float')
 
 		if address is None or address.strip() == '' or len(address) < 25 or len(address) > 34:
 			raise Exception('You need to specify a valid address to which you want to send your BTC')
 
-		nonce, signature = self.__get_signature()
-
-		response = requests.post('{}{}'.format(self.api_endpoint, resource), data={
-			'key': self.api_key,
-			'nonce': nonce,
-			'signature': signature,
-			'amount': '{:.8f}'.format(amount),
-			'address': address,
-		})
-
-		return json.loads(response.text)
+		return self.call('bitcoin_withdrawal', amount=self.__format_amount(amount), address=address)
 
 	def unconfirmed_bitcoin_deposits(self):
 		'''
@@ -485,17 +778,7 @@ class Bitstamp(object):
 		This is a resource that requires signature.
 		:return:a list of pending BTC deposits to your wallet
 		'''
-		resource = 'unconfirmed_btc/'
-
-		nonce, signature = self.__get_signature()
-
-		response = requests.post('{}{}'.format(self.api_endpoint, resource), data={
-			'key': self.api_key,
-			'nonce': nonce,
-			'signature': signature,
-		})
-
-		return json.loads(response.text)
+		return self.call('unconfirmed_bitcoin_deposits')
 
 	def wallet_address(self):
 		'''
@@ -503,17 +786,7 @@ class Bitstamp(object):
 		This is a resource that requires signature.
 		:return: a string representing your wallet address
 		'''
-		resource = 'bitcoin_deposit_address/'
-
-		nonce, signature = self.__get_signature()
-
-		response = requests.post('{}{}'.format(self.api_endpoint, resource), data={
-			'key': self.api_key,
-			'nonce': nonce,
-			'signature': signature,
-		})
-
-		return json.loads(response.text)
+		return self.call('wallet_address')
 
 	def __on_open(self, channel):
 		channel_string = self.ws_channels[channel]
@@ -529,6 +802,14 @@ class Bitstamp(object):
 	def __generic_close_callback(self, *args, **kwargs):
 		pass
 
+	def message_handler(self, callback):
+		'''
+		Returns the on_message handler attach_ws runs the callback with, e.g. to drive it with recorded frames.
+		:param callback: a method that will react to the decoded messages
+		:return: handler that takes the web socket and a raw frame and calls the callback for frames with data
+		'''
+		return self.__data_message_closure(callback)
+
 	def attach_ws(self, channel, callback, error_callback=None, close_callback=None):
 		'''
 		This method lets you attach a callback or callbacks to a specific channel that will react each time web socket
@@ -564,6 +845,26 @@ class Bitstamp(object):
 		else:
 			raise Exception('Web socket hasn\'t been opened yet')
 
+	def stream(self, channel, pair=None, maxsize=None):
+		'''
+		This method returns an async iterator over the messages of a channel, for use in asyncio code instead of
+		attach_ws (async for trade in api.stream(bitstamp.WS_CHANNEL_LIVE_TRADES): ...). All the streams of one client
+		share one web socket connection. Requires the websockets package.
+		:param channel: one of bitstamp.WS_CHANNEL_LIVE_TRADES, bitstamp.WS_CHANNEL_ORDER_BOOK or bitstamp.WS_CHANNEL_ORDER_BOOK_DIFF
+		:param pair: one of the currency pairs, defaults to BTC/USD
+		:param maxsize: optional number of messages buffered before the oldest are dropped
+		:return: async generator of decoded messages
+		'''
+		from bitstamp import asyncws
+
+		if self.async_streams is None:
+			self.async_streams = asyncws.AsyncStreamClient(self.websockets_endpoint)
+
+		if maxsize is None:
+			maxsize = asyncws.DEFAULT_MAXSIZE
+
+		return self.async_streams.stream(channel, pair, maxsize)
+
 	def __data_message_closure(self, callback):
 		# Send through only those messages that actually have any relevant data
 		def on_message(ws, message):
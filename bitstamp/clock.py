@@ -0,0 +1,230 @@
+from collections import deque
+from email.utils import parsedate_to_datetime
+import threading
+import time
+
+from bitstamp.histogram import LatencyHistogram, PERCENTILES
+
+DEFAULT_WINDOW = 64
+# The Date header has whole seconds
+SECOND_RESOLUTION = 1.0
+
+
+class ClockSync(object):
+	def __init__(self, window=DEFAULT_WINDOW):
+		'''
+		Estimates the offset of the exchange clock from the local one (server time - local time) and the round trip
+		time. Like NTP, every request timed on both ends gives an interval the offset has to lie in: the server time
+		was read somewhere between sending the request and receiving the response. Intersecting the intervals of the
+		last window samples narrows the offset well below the one second resolution of the Date header. Exchange
+		timestamps of events (tickers, trades) only tell that the event happened before it was received, so they raise
+		the lower bound. Samples that contradict newer ones (the local clock drifted or was stepped) are dropped.
+		:param window: number of samples the estimate is taken from
+		:return: The clock object
+		'''
+		self.samples = deque(maxlen=window)
+		self.events = deque(maxlen=window)
+		self.lock = threading.Lock()
+		self.low = None
+		self.high = None
+		self.min_rtt = None
+
+	def add_sample(self, sent, received, server_time, resolution=SECOND_RESOLUTION):
+		'''
+		:param sent: local time the request was sent
+		:param received: local time the response was received
+		:param server_time: server time in the response, truncated to the resolution
+		:param resolution: resolution of server_time in seconds
+		:return: None
+		'''
+		with self.lock:
+			self.samples.append((server_time - received, server_time + resolution - sent, received - sent))
+			self.__estimate()
+
+	def add_response(self, sent, received, response):
+		'''
+		Adds a sample from the Date header of a requests response, if it has one.
+		:return: True if a sample was added
+		'''
+		date = response.headers.get('Date') if getattr(response, 'headers', None) is not None else None
+
+		if not date:
+			return False
+
+		try:
+			server_time = parsedate_to_datetime(date).timestamp()
+		except (TypeError, ValueError):
+			return False
+
+		self.add_sample(sent, received, server_time)
+
+		return True
+
+	def add_event(self, server_time, received):
+		'''
+		The event happened at server_time or, if the timestamp is truncated, a little later, and before it was
+		received, so server_time - received is the lower bound of the offset whatever the resolution of the timestamp.
+		:param server_time: exchange timestamp of an event
+		:param received: local time the event was received
+		:return: None
+		'''
+		with self.lock:
+			self.events.append(server_time - received)
+			self.__estimate()
+
+	def __estimate(self):
+		low = None
+		high = None
+		kept = 0
+
+		# From the newest sample back, stop at the first one that doesn't overlap the newer ones
+		for sample_low, sample_high, rtt in reversed(self.samples):
+			new_low = sample_low if low is None else max(low, sample_low)
+			new_high = sample_high if high is None else min(high, sample_high)
+			if new_low > new_high:
+				break
+			low, high = new_low, new_high
+			kept += 1
+
+		while len(self.samples) > kept:
+			self.samples.popleft()
+
+		if self.samples:
+			self.min_rtt = min(rtt for sample_low, sample_high, rtt in self.samples)
+
+		for event_low in self.events:
+			if low is None or (high is not None and event_low > high):
+				continue
+			low = max(low, event_low)
+
+		self.low = low
+		self.high = high
+
+	def synchronized(self):
+		return self.low is not None
+
+	def offset(self):
+		'''
+		:return: estimated server time - local time in seconds, 0 until the first sample
+		'''
+		if self.low is None:
+			return 0.0
+
+		return (self.low + self.high) / 2
+
+	def error(self):
+		'''
+		:return: the most the estimated offset can be off by in seconds, None until the first sample
+		'''
+		if self.low is None:
+			return None
+
+		return (self.high - self.low) / 2
+
+	def now(self):
+		'''
+		:return: current server time as estimated from the local clock
+		'''
+		return time.time() + self.offset()
+
+	def age(self, server_time, local_time=None):
+		'''
+		:param server_time: exchange timestamp, e.g. the timestamp of a ticker
+		:param local_time: local time the age is taken at, defaults to now
+		:return: seconds that passed on the exchange clock since the timestamp
+		'''
+		if local_time is None:
+			local_time = time.time()
+
+		return local_time + self.offset() - server_time
+
+
+def message_time(data):
+	'''
+	:param data: a decoded web socket message (or ticker, order book)
+	:return: exchange timestamp in seconds, the microsecond one if the message has it, or None if it has none
+	'''
+	microtimestamp = data.get('microtimestamp')
+	if microtimestamp is not None:
+		return int(microtimestamp) / 1000000.0
+
+	timestamp = data.get('timestamp')
+	if timestamp is not None:
+		return float(timestamp)
+
+	return None
+
+
+class LatencyTracker(object):
+	def __init__(self, clock):
+		'''
+		Splits the latency of every message into the delivery delay (exchange timestamp to the handler, on the
+		exchange clock) and the processing delay (time spent in the handler). Delivery delays are only as exact as
+		the clock offset and the timestamp resolution; trades carry a microsecond timestamp, most other messages only
+		whole seconds.
+		:param clock: ClockSync the exchange timestamps are corrected with
+		:return: The tracker object
+		'''
+		self.clock = clock
+		self.delivery = LatencyHistogram()
+		self.processing = LatencyHistogram()
+		# Messages whose timestamp was later than their corrected arrival, a sign that the offset is off
+		self.early = 0
+		self.last_delivery = None
+
+	def record(self, server_time, received, handled):
+		'''
+		:param server_time: exchange timestamp of the message
+		:param received: local time the handler got the message
+		:param handled: local time the handler finished
+		:return: None
+		'''
+		delivery = received + self.clock.offset() - server_time
+		if delivery < 0:
+			self.early += 1
+
+		self.last_delivery = delivery
+		self.delivery.record(int(delivery * 1000000000))
+		self.processing.record(int((handled - received) * 1000000000))
+
+	def wrap(self, callback, feed_clock=False):
+		'''
+		Returns a callback for attach_ws that calls the callback and records the latencies of every message. The
+		decoding of the frame happens before the callback is reached, so it counts as delivery.
+		:param callback: the callback to measure
+		:param feed_clock: if True, message timestamps also raise the lower bound of the clock offset
+		:return: callback
+		'''
+		def on_message(data):
+			received = time.time()
+			result = callback(data)
+			handled = time.time()
+
+			server_time = message_time(data)
+			if server_time is not None:
+				if feed_clock:
+					self.clock.add_event(server_time, received)
+				self.record(server_time, received, handled)
+
+			return result
+
+		return on_message
+
+	def report(self):
+		'''
+		:return: dict with the number of messages, delivery and processing percentiles in milliseconds, the number of
+		 early messages and the clock offset with its error in seconds
+		'''
+		def percentiles(histogram):
+			latency = {'p{}'.format(percent): histogram.percentile(percent) / 1000000.0 for percent in PERCENTILES}
+			latency['max'] = histogram.maximum / 1000000.0
+			return latency
+
+		return {
+			'messages': self.delivery.count,
+			'delivery_ms': percentiles(self.delivery),
+			'processing_ms': percentiles(self.processing),
+			'early': self.early,
+			'offset': self.clock.offset(),
+			'offset_error': self.clock.error(),
+		}
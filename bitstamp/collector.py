@@ -0,0 +1,162 @@
+from collections import deque
+import json
+import time
+
+from bitstamp.bitstamp import BTC_USD
+
+MINUTE_WINDOW = 60
+HOUR_WINDOW = 3600
+# Polls that are closer than this to the end of the window switch to the bigger window, to allow for clock skew
+# and the time the request takes
+WINDOW_MARGIN = 10
+DEFAULT_INTERVAL = 10
+DEFAULT_INDEX_SIZE = 10000
+
+
+class TradeCollector(object):
+	def __init__(self, api, sink, currency=BTC_USD, interval=DEFAULT_INTERVAL, index_size=DEFAULT_INDEX_SIZE,
+	             gap_callback=None, backfill=False):
+		'''
+		Builds a continuous history of public trades by polling transactions(timespan='minute'). Overlapping polls
+		are de-duplicated by trade id against an index of the last index_size trades, so memory stays flat no matter
+		how long the collector runs. When a poll comes too late for the minute window, the hour window is used.
+		:param api: Bitstamp instance
+		:param sink: callable that is called with every new trade, in the order of trade ids
+		:param currency: one of the currency pairs
+		:param interval: seconds between two polls, has to be well below a minute
+		:param index_size: number of the latest trade ids remembered for de-duplication
+		:param gap_callback: optional callable called with (last_seen_date, polled_at) when even the hour window
+		 can't cover the time since the last poll, so some trades may be missing; called once per gap, however many
+		 polls fail before it's closed
+		:param backfill: if True, the first poll collects the past hour instead of the past minute
+		:return: The collector object
+		'''
+		if interval >= MINUTE_WINDOW - WINDOW_MARGIN:
+			raise Exception('Interval has to be less than {} seconds'.format(MINUTE_WINDOW - WINDOW_MARGIN))
+
+		if index_size < 1:
+			raise Exception('Index size has to be a positive number')
+
+		self.api = api
+		self.sink = sink
+		self.currency = currency
+		self.interval = interval
+		self.index_size = index_size
+		self.gap_callback = gap_callback
+		self.backfill = backfill
+		self.seen = set()
+		self.order = deque()
+		self.last_poll = None
+		self.last_date = None
+		self.collected = 0
+		self.gaps = 0
+		# last_poll of the gap reported last, failed polls retry the same window and shouldn't report it again
+		self.reported_gap = None
+		# Polls that raised, e.g. connection errors, responses that aren't JSON or error responses
+		self.errors = 0
+		self.last_error = None
+		self.running = False
+
+	def __timespan(self, now):
+		if self.last_poll is None:
+			return 'hour' if self.backfill else 'minute'
+
+		elapsed = now - self.last_poll
+
+		if elapsed > HOUR_WINDOW - WINDOW_MARGIN and self.reported_gap != self.last_poll:
+			self.reported_gap = self.last_poll
+			self.gaps += 1
+			if self.gap_callback is not None:
+				self.gap_callback(self.last_date, now)
+
+		if elapsed > MINUTE_WINDOW - WINDOW_MARGIN:
+			return 'hour'
+
+		return 'minute'
+
+	def __is_new(self, trade_id):
+		if trade_id in self.seen:
+			return False
+
+		# Trades older than everything in a full index were already written (or are from before the collector started)
+		if len(self.order) == self.index_size and trade_id < self.order[0]:
+			return False
+
+		return True
+
+	def __remember(self, trade_id):
+		self.seen.add(trade_id)
+		self.order.append(trade_id)
+
+		if len(self.order) > self.index_size:
+			self.seen.discard(self.order.popleft())
+
+	def poll(self, now=None):
+		'''
+		Polls transactions once and passes the trades that weren't seen yet to the sink.
+		:param now: time of the poll, defaults to time.time()
+		:return: number of new trades
+		'''
+		if now is None:
+			now = time.time()
+
+		timespan = self.__timespan(now)
+		transactions = self.api.transactions(currency=self.currency, timespan=timespan)
+
+		if not isinstance(transactions, list):
+			raise Exception('Polling transactions failed: {}'.format(transactions))
+
+		count = 0
+		for trade in sorted(transactions, key=lambda transaction: int(transaction.get('tid'))):
+			trade_id = int(trade.get('tid'))
+
+			if not self.__is_new(trade_id):
+				continue
+
+			self.sink(trade)
+			self.__remember(trade_id)
+			self.last_date = int(trade.get('date'))
+			count += 1
+
+		self.last_poll = now
+		self.collected += count
+
+		return count
+
+	def run(self):
+		'''
+		Polls every interval seconds until stop is called. A failed poll is counted in errors and the next one
+		covers the time since the last good poll (switching to the hour window if needed).
+		:return: None
+		'''
+		self.running = True
+
+		while self.running:
+			started = time.time()
+			try:
+				self.poll(started)
+			except Exception as exception:
+				self.errors += 1
+				self.last_error = exception
+			time.sleep(max(0, self.interval - (time.time() - started)))
+
+	def stop(self):
+		self.running = False
+
+
+class JsonLinesSink(object):
+	def __init__(self, path):
+		'''
+		Sink that appends every trade to a file as one JSON object per line.
+		:param path: path to the file
+		:return: The sink object
+		'''
+		self.file = open(path, 'a')
+
+	def __call__(self, trade):
+		self.file.write(json.dumps(trade))
+		self.file.write('\n')
+		self.file.flush()
+
+	def close(self):
+		self.file.close()
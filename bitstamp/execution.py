@@ -0,0 +1,404 @@
+import asyncio
+import math
+import time
+
+from bitstamp.accounts import RateLimiter
+from bitstamp.bitstamp import Bitstamp, BTC_USD, MINIMAL_ORDER_VOLUME, ORDER_SIDE_BUY, ORDER_SIDE_SELL
+
+DEFAULT_INTERVAL = 5
+DEFAULT_CHILD_AGE = 60
+# A sixth of the per account limit of the API, so other clients of the account keep most of it
+DEFAULT_REQUESTS_PER_SECOND = 2
+DEFAULT_REQUEST_BURST = 10
+
+PARENT_ACTIVE = 'active'
+PARENT_CANCELLING = 'cancelling'
+PARENT_DONE = 'done'
+PARENT_CANCELLED = 'cancelled'
+
+CHILD_WORKING = 'working'
+# Gone from the open orders, the final fill is read with order_status
+CHILD_CLOSING = 'closing'
+CHILD_DONE = 'done'
+# Statuses order_status reports for orders that can't be filled any more
+FINAL_STATUSES = ['Finished', 'Canceled']
+
+
+class ChildOrder(object):
+	def __init__(self, order_id, amount, price, placed_at):
+		self.id = str(order_id)
+		self.amount = amount
+		self.price = price
+		self.placed_at = placed_at
+		self.filled = 0.0
+		self.state = CHILD_WORKING
+		self.cancelled = False
+
+	def remaining(self):
+		return self.amount - self.filled
+
+
+class ParentOrder(object):
+	def __init__(self, side, amount, price, currency=BTC_USD, duration=0, slices=1, display_size=None,
+	             max_child_age=DEFAULT_CHILD_AGE, limit_price=None):
+		'''
+		An order worked through child limit orders. With duration and slices it's a TWAP order: the amount is released
+		in equal slices spread over the duration. With display_size it's an iceberg order: only one child of at most
+		display_size is on the book at a time and the next one is placed when it's filled. Both can be combined.
+		:param side: ORDER_SIDE_BUY or ORDER_SIDE_SELL
+		:param amount: total amount as a float
+		:param price: price of the children, either a float or a callable that takes the time and returns the price
+		 (e.g. the best bid), so children can follow the market
+		:param currency: one of the currency pairs
+		:param duration: seconds the amount is released over, 0 releases it all at once
+		:param slices: number of equal slices the amount is released in
+		:param display_size: largest amount on the book at a time, None for no limit
+		:param max_child_age: seconds after which a child whose price is no longer the current one is replaced
+		:param limit_price: worst price a child may have, caps the prices returned by a price callable
+		:return: The parent order object
+		'''
+		if side != ORDER_SIDE_BUY and side != ORDER_SIDE_SELL:
+			raise Exception('Side has to be one of {} or {}'.format(ORDER_SIDE_BUY, ORDER_SIDE_SELL))
+
+		if amount <= 0:
+			raise Exception('Amount has to be a positive float')
+
+		if slices < 1:
+			raise Exception('Slices has to be a positive number')
+
+		if duration < 0:
+			raise Exception('Duration can\'t be negative')
+
+		if display_size is not None and display_size <= 0:
+			raise Exception('Display size has to be a positive float')
+
+		self.side = side
+		self.amount = amount
+		self.price = price
+		self.currency = currency
+		self.duration = duration
+		self.slices = slices
+		self.display_size = display_size
+		self.max_child_age = max_child_age
+		self.limit_price = limit_price
+		self.started = None
+		self.filled = 0.0
+		self.children = []
+		self.state = PARENT_ACTIVE
+		self.errors = []
+
+	def released(self, now):
+		'''
+		:param now: current time
+		:return: amount that may be filled or on the book at the time
+		'''
+		if self.duration == 0 or self.slices == 1:
+			return self.amount
+
+		released_slices = min(self.slices, int((now - self.started) * self.slices / self.duration) + 1)
+
+		return self.amount * released_slices / self.slices
+
+	def current_price(self, now):
+		price = self.price(now) if callable(self.price) else self.price
+
+		if self.limit_price is not None:
+			price = min(price, self.limit_price) if self.side == ORDER_SIDE_BUY else max(price, self.limit_price)
+
+		return price
+
+	def working(self):
+		return [child for child in self.children if child.state == CHILD_WORKING]
+
+	def closing(self):
+		return [child for child in self.children if child.state == CHILD_CLOSING]
+
+	def reserved(self):
+		'''
+		:return: amount of the children that are on the book or may still be filled
+		'''
+		return sum(child.remaining() for child in self.children if child.state != CHILD_DONE)
+
+	def remaining(self):
+		return self.amount - self.filled
+
+	def cancel(self):
+		'''
+		Stops working the order, its children are cancelled by the next poll of the scheduler.
+		:return: None
+		'''
+		if self.state == PARENT_ACTIVE:
+			self.state = PARENT_CANCELLING
+
+	def done(self):
+		return self.state == PARENT_DONE or self.state == PARENT_CANCELLED
+
+
+class ExecutionScheduler(object):
+	def __init__(self, api, interval=DEFAULT_INTERVAL, requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+	             request_burst=DEFAULT_REQUEST_BURST):
+		'''
+		Works any number of parent orders from one thread or event loop. Every poll reads the open orders once for all
+		the parents, resolves the fills of children that left the book with order_status, then cancels, replaces and
+		places children. All the requests come out of one budget; work that doesn't fit in it waits for the next poll,
+		and the parents take turns being served first, so one large order can't starve the others.
+		:param api: Bitstamp instance (not in fixed-point mode)
+		:param interval: seconds between two polls
+		:param requests_per_second: request budget
+		:param request_burst: most requests one poll may make
+		:return: The scheduler object
+		'''
+		if api.fixed_point:
+			raise Exception('The scheduler works with float amounts and prices, the client can\'t be in fixed-point mode')
+
+		self.api = api
+		self.interval = interval
+		self.budget = RateLimiter(requests_per_second, burst=request_burst)
+		self.parents = []
+		self.requests = 0
+		self.polls = 0
+		# Requests and polls that raised, e.g. connection errors or responses that aren't JSON
+		self.errors = 0
+		self.last_error = None
+		self.running = False
+
+	def add(self, parent, now=None):
+		'''
+		Starts working the parent order; its first children are placed by the next poll.
+		:param parent: ParentOrder
+		:param now: start of the order, defaults to time.time()
+		:return: the parent order
+		'''
+		parent.started = time.time() if now is None else now
+		self.parents.append(parent)
+
+		return parent
+
+	def active(self):
+		return [parent for parent in self.parents if not parent.done()]
+
+	def __request(self, tokens=1):
+		if not self.budget.try_acquire(tokens):
+			return False
+
+		self.requests += tokens
+
+		return True
+
+	@staticmethod
+	def __fail(parent, result):
+		parent.errors.append(result)
+
+	def __call(self, method, *args):
+		'''
+		Calls the API method. A request that raises is counted in errors and returns an error result instead, so it's
+		handled like an error response and the rest of the poll goes on.
+		:return: result of the call
+		'''
+		try:
+			return getattr(self.api, method)(*args)
+		except Exception as exception:
+			self.errors += 1
+			self.last_error = exception
+			return {'error': str(exception)}
+
+	def __track(self):
+		working = [child for parent in self.active() for child in parent.working()]
+
+		if working and self.__request():
+			open_orders = self.__call('open_orders')
+
+			if Bitstamp.is_error(open_orders):
+				return
+
+			amounts = {str(order.get('id')): float(order.get('amount')) for order in open_orders}
+
+			for parent in self.active():
+				for child in parent.working():
+					if child.id in amounts:
+						self.__set_filled(parent, child, child.amount - amounts[child.id])
+					else:
+						child.state = CHILD_CLOSING
+
+		for parent in self.active():
+			for child in parent.closing():
+				if not self.__request():
+					return
+				self.__resolve(parent, child)
+
+	@staticmethod
+	def __set_filled(parent, child, filled):
+		parent.filled += filled - child.filled
+		child.filled = filled
+
+	def __resolve(self, parent, child):
+		'''
+		Reads the final fill of a child that left the book with order_status.
+		:return: True if the child is done
+		'''
+		status = self.__call('order_status', child.id)
+
+		if Bitstamp.is_error(status):
+			self.__fail(parent, status)
+			return False
+
+		if status.get('status') not in FINAL_STATUSES:
+			# In Queue or Open: it may still execute, so it keeps its amount; only a child that wasn't cancelled
+			# goes back to being tracked through open_orders
+			if not child.cancelled:
+				child.state = CHILD_WORKING
+			return False
+
+		base = parent.currency[:3]
+		filled = sum(abs(float(transaction.get(base) or 0)) for transaction in status.get('transactions', []))
+		self.__set_filled(parent, child, filled)
+		child.state = CHILD_DONE
+
+		return True
+
+	def __cancel(self, parent, child):
+		'''
+		Cancels the child. cancel_order only tells whether the order was cancelled, not how much of it was filled, so
+		the child keeps its amount until order_status gives the final fill, here if the budget allows, otherwise in
+		the next poll.
+		:return: True if the child is done
+		'''
+		result = self.__call('cancel_order', child.id)
+		child.state = CHILD_CLOSING
+
+		if Bitstamp.is_error(result):
+			# Most likely filled in the meantime, order_status tells
+			return False
+
+		child.cancelled = True
+
+		if not self.__request():
+			return False
+
+		return self.__resolve(parent, child)
+
+	def __place(self, parent, amount, price, now):
+		if parent.side == ORDER_SIDE_BUY:
+			result = self.__call('buy_limit_order', amount, price, parent.currency)
+		else:
+			result = self.__call('sell_limit_order', amount, price, parent.currency)
+
+		if Bitstamp.is_error(result):
+			self.__fail(parent, result)
+			return None
+
+		child = ChildOrder(result.get('id'), amount, price, now)
+		parent.children.append(child)
+
+		return child
+
+	def __work(self, parent, now):
+		if parent.state == PARENT_CANCELLING:
+			for child in parent.working():
+				if not self.__request():
+					return
+				self.__cancel(parent, child)
+
+			if not parent.working() and not parent.closing():
+				parent.state = PARENT_CANCELLED
+			return
+
+		price = parent.current_price(now)
+
+		for child in parent.working():
+			if now - child.placed_at < parent.max_child_age:
+				continue
+
+			if child.price == price:
+				# Replacing it would only lose its place in the queue
+				child.placed_at = now
+				continue
+
+			if not self.__request():
+				return
+
+			# The rest of the child is placed again at the current price below, once its fill is known
+			self.__cancel(parent, child)
+
+		reserved = parent.reserved()
+		unplaced = parent.released(now) - parent.filled - reserved
+		remaining = parent.remaining() - reserved
+
+		if parent.display_size is not None:
+			if reserved > 0:
+				return
+			unplaced = min(unplaced, parent.display_size)
+
+		amount = math.floor(unplaced * 10 ** 8) / 10 ** 8
+
+		if amount * price < MINIMAL_ORDER_VOLUME:
+			# A remainder below the minimal order volume can never be placed
+			if remaining * price < MINIMAL_ORDER_VOLUME and not parent.working() and not parent.closing():
+				parent.state = PARENT_DONE
+			return
+
+		if self.__request():
+			self.__place(parent, amount, price, now)
+
+	def poll(self, now=None):
+		'''
+		Tracks fills and places, replaces or cancels children of all the parent orders, as far as the budget allows.
+		:param now: time of the poll, defaults to time.time()
+		:return: number of parent orders still being worked
+		'''
+		if now is None:
+			now = time.time()
+
+		self.__track()
+
+		parents = self.active()
+		if parents:
+			# Rotate the order parents are served in, so the budget is shared out fairly over the polls
+			start = self.polls % len(parents)
+			for parent in parents[start:] + parents[:start]:
+				self.__work(parent, now)
+
+		self.polls += 1
+
+		return len(self.active())
+
+	def run(self):
+		'''
+		Polls every interval seconds until all the parent orders are done or stop is called. A poll that raises (e.g.
+		a price callable failing) is counted in errors and the next one picks up from the state the children are in.
+		:return: None
+		'''
+		self.running = True
+
+		while self.running and self.active():
+			started = time.time()
+			try:
+				self.poll(started)
+			except Exception as exception:
+				self.errors += 1
+				self.last_error = exception
+			time.sleep(max(0, self.interval - (time.time() - started)))
+
+		self.running = False
+
+	async def run_async(self):
+		'''
+		Same as run for asyncio code: polls run in the default executor, so the event loop isn't blocked by requests.
+		:return: None
+		'''
+		loop = asyncio.get_running_loop()
+		self.running = True
+
+		while self.running and self.active():
+			started = time.time()
+			try:
+				await loop.run_in_executor(None, self.poll, started)
+			except Exception as exception:
+				self.errors += 1
+				self.last_error = exception
+			await asyncio.sleep(max(0, self.interval - (time.time() - started)))
+
+		self.running = False
+
+	def stop(self):
+		self.running = False
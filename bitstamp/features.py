@@ -0,0 +1,291 @@
+'''
+Microstructure features kept up to date from the diff-order-book and live-trades channels. Requires the numpy
+package (pip install bitstamp[features]).
+'''
+from bisect import bisect_left, insort
+import json
+import math
+
+from bitstamp.asyncws import DATA_EVENTS, pusher_channel
+from bitstamp.bitstamp import BTC_USD, WS_CHANNEL_LIVE_TRADES, WS_CHANNEL_ORDER_BOOK, WS_CHANNEL_ORDER_BOOK_DIFF
+from bitstamp.clock import message_time
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+FEATURES = ['mid', 'spread', 'microprice', 'imbalance', 'volatility', 'trade_flow', 'trade_imbalance']
+MID, SPREAD, MICROPRICE, IMBALANCE, VOLATILITY, TRADE_FLOW, TRADE_IMBALANCE = range(len(FEATURES))
+DEFAULT_DEPTH = 5
+DEFAULT_WINDOW = 100
+# Event kinds of evaluate, named after the Pusher channels
+EVENT_ORDER_BOOK = 'order_book'
+EVENT_ORDER_BOOK_DIFF = 'diff_order_book'
+EVENT_TRADE = 'live_trades'
+EVENT_CHANNELS = {
+	EVENT_ORDER_BOOK: WS_CHANNEL_ORDER_BOOK,
+	EVENT_ORDER_BOOK_DIFF: WS_CHANNEL_ORDER_BOOK_DIFF,
+	EVENT_TRADE: WS_CHANNEL_LIVE_TRADES,
+}
+TRADE_TYPE_BUY = 0
+
+
+def require_numpy():
+	if numpy is None:
+		raise Exception('Features require the numpy package (pip install numpy)')
+
+
+class RingWindow(object):
+	def __init__(self, size):
+		'''
+		The last size values in a fixed numpy array, with their sum kept up to date in constant time per value. The
+		sum is recomputed from the array once per lap, so rounding errors can't build up.
+		:param size: number of values in the window
+		:return: The window object
+		'''
+		require_numpy()
+
+		if size < 1:
+			raise Exception('Window size has to be a positive number')
+
+		self.values = numpy.zeros(size)
+		self.size = size
+		self.index = 0
+		self.count = 0
+		self.sum = 0.0
+
+	def push(self, value):
+		self.sum += value - self.values[self.index]
+		self.values[self.index] = value
+		self.index += 1
+		self.count = min(self.count + 1, self.size)
+
+		if self.index == self.size:
+			self.index = 0
+			self.sum = float(self.values.sum())
+
+	def full(self):
+		return self.count == self.size
+
+
+class BookSide(object):
+	def __init__(self, descending):
+		'''
+		Price levels of one side of the book, with the prices kept sorted so the top levels are at hand.
+		:param descending: True for bids, whose best price is the highest
+		:return: The side object
+		'''
+		self.descending = descending
+		self.amounts = {}
+		# Ascending, bids are read from the end
+		self.prices = []
+
+	def clear(self):
+		self.amounts.clear()
+		del self.prices[:]
+
+	def set(self, price, amount):
+		if amount == 0:
+			if price in self.amounts:
+				del self.amounts[price]
+				del self.prices[bisect_left(self.prices, price)]
+		else:
+			if price not in self.amounts:
+				insort(self.prices, price)
+			self.amounts[price] = amount
+
+	def best(self):
+		if not self.prices:
+			return None
+
+		return self.prices[-1] if self.descending else self.prices[0]
+
+	def volume(self, depth):
+		prices = self.prices[-depth:] if self.descending else self.prices[:depth]
+
+		return sum(self.amounts[price] for price in prices)
+
+
+class FeatureEngine(object):
+	def __init__(self, depth=DEFAULT_DEPTH, window=DEFAULT_WINDOW):
+		'''
+		Updates microstructure features with every book change and trade instead of recomputing them from full
+		order_book and transactions results:
+		mid, spread and microprice (mid weighted by the sizes at the top of book), imbalance of the volume on the top
+		depth levels (bids - asks over bids + asks), realized volatility (square root of the sum of squared log
+		returns of the last window trades), trade flow (signed volume of the last window trades, buys positive) and
+		trade imbalance (trade flow over the traded volume).
+		:param depth: number of levels per side the imbalance is taken over
+		:param window: number of trades the volatility and the trade flow are taken over
+		:return: The engine object
+		'''
+		require_numpy()
+
+		self.depth = depth
+		self.bids = BookSide(True)
+		self.asks = BookSide(False)
+		self.squared_returns = RingWindow(window)
+		self.signed_volume = RingWindow(window)
+		self.volume = RingWindow(window)
+		self.last_price = None
+		self.timestamp = None
+		self.vector = numpy.full(len(FEATURES), numpy.nan)
+
+	def latest(self):
+		'''
+		:return: the feature vector (see FEATURES for the order), not a copy: it's updated in place by the engine, so
+		 copy it to keep the values of a moment
+		'''
+		return self.vector
+
+	def __update_book(self):
+		bid = self.bids.best()
+		ask = self.asks.best()
+		vector = self.vector
+
+		if bid is None or ask is None:
+			vector[MID] = vector[SPREAD] = vector[MICROPRICE] = vector[IMBALANCE] = numpy.nan
+			return
+
+		bid_size = self.bids.amounts[bid]
+		ask_size = self.asks.amounts[ask]
+		vector[MID] = (bid + ask) / 2
+		vector[SPREAD] = ask - bid
+		vector[MICROPRICE] = (bid * ask_size + ask * bid_size) / (bid_size + ask_size)
+
+		bid_volume = self.bids.volume(self.depth)
+		ask_volume = self.asks.volume(self.depth)
+		vector[IMBALANCE] = (bid_volume - ask_volume) / (bid_volume + ask_volume)
+
+	def update_order_book(self, order_book):
+		'''
+		Replaces the book, e.g. with an order_book() result or an order book channel message.
+		:param order_book: dict with bids and asks lists of [price, amount]
+		:return: the feature vector
+		'''
+		self.bids.clear()
+		self.asks.clear()
+
+		return self.update_diff(order_book)
+
+	def update_diff(self, diff):
+		'''
+		Applies a diff-order-book channel message: levels with amount 0 are removed, others are set.
+		:param diff: decoded message
+		:return: the feature vector
+		'''
+		for price, amount in diff.get('bids', []):
+			self.bids.set(float(price), float(amount))
+		for price, amount in diff.get('asks', []):
+			self.asks.set(float(price), float(amount))
+
+		self.timestamp = message_time(diff)
+		self.__update_book()
+
+		return self.vector
+
+	def update_trade(self, trade):
+		'''
+		Applies a live-trades channel message (or a transactions() entry).
+		:param trade: decoded message
+		:return: the feature vector
+		'''
+		price = float(trade.get('price'))
+		amount = float(trade.get('amount'))
+		vector = self.vector
+
+		if self.last_price is not None:
+			self.squared_returns.push(math.log(price / self.last_price) ** 2)
+			vector[VOLATILITY] = math.sqrt(max(self.squared_returns.sum, 0.0))
+		self.last_price = price
+
+		self.signed_volume.push(amount if int(trade.get('type')) == TRADE_TYPE_BUY else -amount)
+		self.volume.push(amount)
+		vector[TRADE_FLOW] = self.signed_volume.sum
+		vector[TRADE_IMBALANCE] = self.signed_volume.sum / self.volume.sum if self.volume.sum > 0 else 0.0
+
+		timestamp = message_time(trade)
+		if timestamp is not None:
+			self.timestamp = timestamp
+
+		return vector
+
+	def order_book_callback(self):
+		'''
+		:return: callback for attach_ws on the order book channel
+		'''
+		return self.update_order_book
+
+	def diff_callback(self):
+		'''
+		:return: callback for attach_ws on the diff order book channel
+		'''
+		return self.update_diff
+
+	def trade_callback(self):
+		'''
+		:return: callback for attach_ws on the live trades channel
+		'''
+		return self.update_trade
+
+	def update(self, kind, data):
+		'''
+		:param kind: EVENT_ORDER_BOOK, EVENT_ORDER_BOOK_DIFF or EVENT_TRADE
+		:param data: decoded message
+		:return: the feature vector
+		'''
+		if kind == EVENT_ORDER_BOOK_DIFF:
+			return self.update_diff(data)
+		elif kind == EVENT_TRADE:
+			return self.update_trade(data)
+		elif kind == EVENT_ORDER_BOOK:
+			return self.update_order_book(data)
+
+		raise Exception('Unknown event {}'.format(kind))
+
+
+def frame_events(frames, pair=BTC_USD):
+	'''
+	Decodes raw Pusher frames of one pair, e.g. a recording replayed with bitstamp.soak.recorded_frames, into events.
+	A recording of several pairs has to be evaluated once per pair, one engine can only follow one book.
+	:param frames: iterable of raw frames, frames of other pairs, channels and events are skipped
+	:param pair: one of the currency pairs
+	:return: generator of (kind, decoded message) tuples
+	'''
+	kinds = {pusher_channel(channel, pair): kind for kind, channel in EVENT_CHANNELS.items()}
+
+	for frame in frames:
+		message = json.loads(frame)
+		kind = kinds.get(message.get('channel'))
+
+		if kind is not None and message.get('event') in DATA_EVENTS:
+			yield kind, json.loads(message.get('data'))
+
+
+def evaluate(events, depth=DEFAULT_DEPTH, window=DEFAULT_WINDOW):
+	'''
+	Runs a recorded stream (e.g. a day of frames) through a new engine, so research sees exactly the features the
+	live engine had after every event.
+	:param events: iterable of (kind, decoded message) tuples, see frame_events
+	:param depth: see FeatureEngine
+	:param window: see FeatureEngine
+	:return: (timestamps, features) numpy arrays with one row per event, features in the order of FEATURES
+	'''
+	engine = FeatureEngine(depth, window)
+	capacity = 4096
+	timestamps = numpy.empty(capacity)
+	features = numpy.empty((capacity, len(FEATURES)))
+	count = 0
+
+	for kind, data in events:
+		if count == capacity:
+			capacity *= 2
+			timestamps = numpy.resize(timestamps, capacity)
+			features = numpy.resize(features, (capacity, len(FEATURES)))
+
+		features[count] = engine.update(kind, data)
+		timestamps[count] = numpy.nan if engine.timestamp is None else engine.timestamp
+		count += 1
+
+	return timestamps[:count], features[:count]
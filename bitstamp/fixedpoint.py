@@ -0,0 +1,74 @@
+'''
+Fixed-point representation of prices and amounts. Values are plain integers scaled by 10 ** decimals (satoshis for
+BTC amounts, cents or pair specific ticks for prices), so the arithmetic on them is exact and comparisons are
+integer compares. Strings from the API are converted directly, without going through float or Decimal.
+'''
+from decimal import Decimal
+
+# BTC amounts are expressed in satoshis
+AMOUNT_DECIMALS = 8
+
+
+def parse(value, decimals):
+	'''
+	Converts a decimal string (as returned by the API) to an integer scaled by 10 ** decimals.
+	:param value: string like '605.12', int is accepted as a whole number and float (some fields, like the open of
+	 the ticker, are JSON numbers) as its shortest decimal representation
+	:param decimals: number of decimal places the result is scaled by
+	:return: integer
+	'''
+	if isinstance(value, int):
+		return value * 10 ** decimals
+
+	if isinstance(value, float):
+		# repr gives the shortest string that reads back as the same float, e.g. 605.12 and not 605.1199999...
+		value = format(Decimal(repr(value)), 'f')
+
+	value = value.strip()
+	negative = value.startswith('-')
+	if negative or value.startswith('+'):
+		value = value[1:]
+
+	whole, _, fraction = value.partition('.')
+
+	if len(fraction) > decimals:
+		if fraction[decimals:].strip('0') != '':
+			raise Exception('Value {} has more than {} decimal places'.format(value, decimals))
+		fraction = fraction[:decimals]
+
+	if not (whole + fraction).isdigit():
+		raise Exception('Value {} is not a decimal number'.format(value))
+
+	result = int(whole or '0') * 10 ** decimals + int(fraction.ljust(decimals, '0') or '0')
+
+	return -result if negative else result
+
+
+def to_string(value, decimals):
+	'''
+	Converts an integer scaled by 10 ** decimals to a decimal string the API accepts.
+	:param value: integer
+	:param decimals: number of decimal places the value is scaled by
+	:return: string like '605.12'
+	'''
+	if not isinstance(value, int):
+		raise Exception('Fixed-point values have to be integers, got {}'.format(value))
+
+	sign = '-' if value < 0 else ''
+	whole, fraction = divmod(abs(value), 10 ** decimals)
+
+	if decimals == 0:
+		return '{}{}'.format(sign, whole)
+
+	return '{}{}.{}'.format(sign, whole, str(fraction).rjust(decimals, '0'))
+
+
+def parse_levels(levels, price_decimals, amount_decimals=AMOUNT_DECIMALS):
+	'''
+	Converts order book levels ([price, amount] string pairs) to (price, amount) integer tuples.
+	:param levels: list of levels as returned by the API
+	:param price_decimals: number of decimal places of the pair's price
+	:param amount_decimals: number of decimal places of the amount
+	:return: list of (price, amount) tuples
+	'''
+	return [(parse(price, price_decimals), parse(amount, amount_decimals)) for price, amount in levels]
@@ -0,0 +1,48 @@
+'''
+Latency histogram shared by the soak harness and the latency tracker of bitstamp.clock.
+'''
+from collections import Counter
+import math
+
+# Latency histogram resolution: buckets per doubling of the latency, the error of a percentile is below 1 / 16
+HISTOGRAM_SUB_BUCKETS = 16
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+class LatencyHistogram(object):
+	def __init__(self):
+		'''
+		Log-linear histogram of latencies in nanoseconds. Its size depends only on the range of the latencies, not on
+		the number of messages, so it can record a soak run of any length.
+		:return: The histogram object
+		'''
+		self.buckets = Counter()
+		self.count = 0
+		self.maximum = 0
+
+	def record(self, nanoseconds):
+		if nanoseconds < 1:
+			nanoseconds = 1
+
+		self.buckets[int(math.log2(nanoseconds) * HISTOGRAM_SUB_BUCKETS)] += 1
+		self.count += 1
+		if nanoseconds > self.maximum:
+			self.maximum = nanoseconds
+
+	def percentile(self, percent):
+		'''
+		:param percent: percentile, e.g. 99.9
+		:return: upper bound of the bucket the percentile falls in, in nanoseconds (0 if nothing was recorded)
+		'''
+		if self.count == 0:
+			return 0
+
+		rank = math.ceil(self.count * percent / 100.0)
+		seen = 0
+
+		for bucket in sorted(self.buckets):
+			seen += self.buckets[bucket]
+			if seen >= rank:
+				return min(2 ** ((bucket + 1) / HISTOGRAM_SUB_BUCKETS), self.maximum)
+
+		return self.maximum
@@ -0,0 +1,98 @@
+from bitstamp import fixedpoint
+
+# Prices are compared as fixed-point integers, 8 decimal places covers the prices of all the pairs exactly
+COMPARE_DECIMALS = 8
+# Amount the diff-order-book channel uses for levels that were removed
+REMOVED_AMOUNT = '0'
+
+
+class OrderBookDiffer(object):
+	def __init__(self):
+		'''
+		Turns successive order_book snapshots into diffs of the same shape the diff-order-book web socket channel
+		sends: only levels that were added, removed (with amount '0') or changed are included. Both sides are sorted
+		(bids descending, asks ascending), so each diff is a single linear merge over the two snapshots.
+		:return: The differ object
+		'''
+		self.bids = []
+		self.asks = []
+		# Prices of the previous snapshot as comparable integers (negated for bids), so they're parsed only once
+		self.bid_keys = []
+		self.ask_keys = []
+		# Counts of the last diff: added, removed and changed levels of each side
+		self.last_counts = None
+
+	def update(self, order_book):
+		'''
+		Diffs the snapshot against the previous one. The first snapshot is returned as a diff that adds every level.
+		:param order_book: order book blob as returned by Bitstamp.order_book (unparsed)
+		:return: diff blob with timestamp, bids and asks
+		'''
+		bids = order_book.get('bids')
+		asks = order_book.get('asks')
+
+		if bids is None or asks is None:
+			raise Exception('Not an order book: {}'.format(order_book))
+
+		bid_keys = [-fixedpoint.parse(price, COMPARE_DECIMALS) for price, amount in bids]
+		ask_keys = [fixedpoint.parse(price, COMPARE_DECIMALS) for price, amount in asks]
+
+		bids_diff, bids_counts = self.__diff_side(self.bids, self.bid_keys, bids, bid_keys)
+		asks_diff, asks_counts = self.__diff_side(self.asks, self.ask_keys, asks, ask_keys)
+
+		self.bids = bids
+		self.asks = asks
+		self.bid_keys = bid_keys
+		self.ask_keys = ask_keys
+		self.last_counts = {
+			'bids': bids_counts,
+			'asks': asks_counts,
+		}
+
+		return {
+			'timestamp': order_book.get('timestamp'),
+			'bids': bids_diff,
+			'asks': asks_diff,
+		}
+
+	def changes(self):
+		'''
+		:return: total number of levels in the last diff
+		'''
+		if self.last_counts is None:
+			return 0
+
+		return sum(sum(counts.values()) for counts in self.last_counts.values())
+
+	@staticmethod
+	def __diff_side(old, old_keys, new, new_keys):
+		'''
+		Merges the levels of one side of two snapshots. Keys are ascending in the order the levels are sorted in.
+		:return: diff levels, counts (tuple)
+		'''
+		diff = []
+		counts = {
+			'added': 0,
+			'removed': 0,
+			'changed': 0,
+		}
+		i = 0
+		j = 0
+
+		while i < len(old) or j < len(new):
+			if j >= len(new) or (i < len(old) and old_keys[i] < new_keys[j]):
+				diff.append([old[i][0], REMOVED_AMOUNT])
+				counts['removed'] += 1
+				i += 1
+			elif i >= len(old) or new_keys[j] < old_keys[i]:
+				diff.append([new[j][0], new[j][1]])
+				counts['added'] += 1
+				j += 1
+			else:
+				if old[i][1] != new[j][1]:
+					diff.append([new[j][0], new[j][1]])
+					counts['changed'] += 1
+				i += 1
+				j += 1
+
+		return diff, counts
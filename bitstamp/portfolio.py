@@ -0,0 +1,197 @@
+from collections import deque
+
+from bitstamp.bitstamp import BTC_USD, EUR_USD
+
+ASSETS = ['usd', 'eur', 'btc']
+# Asset whose USD rate is set by trades or tickers of the pair
+PAIR_ASSETS = {
+	BTC_USD: 'btc',
+	EUR_USD: 'eur',
+}
+# Currency the fee of a user transaction on the pair is paid in (keys as found in user_transactions results)
+FEE_CURRENCIES = {
+	'btc_usd': 'usd',
+	'btc_eur': 'eur',
+	'eur_usd': 'usd',
+}
+DEFAULT_INDEX_SIZE = 10000
+
+
+class Portfolio(object):
+	def __init__(self, balance, index_size=DEFAULT_INDEX_SIZE):
+		'''
+		Keeps the USD and EUR value of the account up to date. It's seeded once from a balance() result; after that
+		price updates and own fills adjust the value incrementally, each in constant time.
+		:param balance: result of Bitstamp.balance()
+		:param index_size: number of the latest user transaction ids remembered, so each is applied only once
+		:return: The portfolio object
+		'''
+		if index_size < 1:
+			raise Exception('Index size has to be a positive number')
+
+		if 'error' in balance or balance.get('status') == 'error':
+			raise Exception('Portfolio can\'t be seeded from an error response: {}'.format(balance))
+
+		self.holdings = {asset: float(balance.get('{}_balance'.format(asset), 0)) for asset in ASSETS}
+		# USD value of one unit of each asset, None until the first price arrives
+		self.rates = {asset: None for asset in ASSETS}
+		self.rates['usd'] = 1.0
+		# USD value of the assets whose rate is known
+		self.usd_value = self.holdings['usd']
+		self.index_size = index_size
+		self.applied_transactions = set()
+		self.applied_order = deque()
+		# Transaction ids grow over time, ids up to the largest one dropped from the index count as applied
+		self.forgotten_transaction = None
+		self.subscribers = []
+
+	def subscribe(self, callback):
+		'''
+		Registers a callback that is called with the valuation (see valuation()) after every change.
+		:param callback: callable taking one argument
+		:return: None
+		'''
+		self.subscribers.append(callback)
+
+	def __publish(self):
+		if self.subscribers:
+			valuation = self.valuation()
+			for callback in self.subscribers:
+				callback(valuation)
+
+	def complete(self):
+		'''
+		:return: True if the rates of all the held assets are known, so the valuation covers the whole account
+		'''
+		for asset in ASSETS:
+			if self.holdings[asset] != 0 and self.rates[asset] is None:
+				return False
+
+		return True
+
+	def valuation(self):
+		'''
+		:return: dict with usd and eur exposure (eur is None until the EUR/USD rate is known) and whether it's complete
+		'''
+		eur_rate = self.rates['eur']
+
+		return {
+			'usd': self.usd_value,
+			'eur': self.usd_value / eur_rate if eur_rate else None,
+			'complete': self.complete(),
+		}
+
+	def set_rate(self, asset, rate):
+		'''
+		Sets the USD rate of the asset and revalues only that asset's holding.
+		:param asset: one of ASSETS
+		:param rate: USD value of one unit of the asset
+		:return: None
+		'''
+		old_rate = self.rates[asset]
+		self.usd_value += self.holdings[asset] * (rate - (old_rate or 0))
+		self.rates[asset] = rate
+		self.__publish()
+
+	def __adjust(self, asset, amount):
+		self.holdings[asset] += amount
+		rate = self.rates[asset]
+		if rate is not None:
+			self.usd_value += amount * rate
+
+	def trade_callback(self, pair=BTC_USD):
+		'''
+		Returns a callback for attach_ws on the live trades channel that revalues the portfolio with every trade.
+		:param pair: BTC_USD or EUR_USD, the pair of the channel
+		:return: callback
+		'''
+		if pair not in PAIR_ASSETS:
+			raise Exception('Rates can only be taken from {}'.format(', '.join(PAIR_ASSETS)))
+
+		asset = PAIR_ASSETS[pair]
+
+		def on_trade(trade):
+			self.set_rate(asset, float(trade.get('price')))
+
+		return on_trade
+
+	def update_ticker(self, ticker, pair=BTC_USD):
+		'''
+		Revalues the portfolio with the last price of a ticker() result.
+		:param ticker: result of Bitstamp.ticker()
+		:param pair: BTC_USD or EUR_USD, the pair of the ticker
+		:return: None
+		'''
+		if pair not in PAIR_ASSETS:
+			raise Exception('Rates can only be taken from {}'.format(', '.join(PAIR_ASSETS)))
+
+		self.set_rate(PAIR_ASSETS[pair], float(ticker.get('last')))
+
+	def update_eur_usd(self, eur_usd):
+		'''
+		Revalues the portfolio with the middle of the buy and sell rates of an eur_usd() result.
+		:param eur_usd: result of Bitstamp.eur_usd()
+		:return: None
+		'''
+		self.set_rate('eur', (float(eur_usd.get('buy')) + float(eur_usd.get('sell'))) / 2)
+
+	def apply_user_transaction(self, transaction):
+		'''
+		Applies a user_transactions() entry (a fill, deposit or withdrawal) to the holdings. Entries are applied only
+		once, so overlapping user_transactions results can be passed in as they are; entries older than the last
+		index_size applied ones are taken as applied.
+		:param transaction: one entry of Bitstamp.user_transactions()
+		:return: True if the entry was applied, False if it had been applied before
+		'''
+		transaction_id = int(transaction.get('id'))
+
+		if transaction_id in self.applied_transactions:
+			return False
+
+		if self.forgotten_transaction is not None and transaction_id <= self.forgotten_transaction:
+			return False
+
+		for asset in ASSETS:
+			amount = float(transaction.get(asset) or 0)
+			if amount != 0:
+				self.__adjust(asset, amount)
+
+		fee = float(transaction.get('fee') or 0)
+		if fee != 0:
+			for pair, currency in FEE_CURRENCIES.items():
+				if pair in transaction:
+					self.__adjust(currency, -fee)
+					break
+
+		self.applied_transactions.add(transaction_id)
+		self.applied_order.append(transaction_id)
+		if len(self.applied_order) > self.index_size:
+			forgotten = self.applied_order.popleft()
+			self.applied_transactions.discard(forgotten)
+			self.forgotten_transaction = max(forgotten, self.forgotten_transaction or forgotten)
+		self.__publish()
+
+		return True
+
+	def apply_fill(self, pair, side, amount, price, fee=0):
+		'''
+		Applies a fill of an own order, e.g. from an order event, without waiting for user_transactions. Fills applied
+		this way must not be applied again from user_transactions.
+		:param pair: one of the currency pairs
+		:param side: 'buy' or 'sell'
+		:param amount: filled amount of the base currency
+		:param price: fill price in the quote currency
+		:param fee: fee paid in the quote currency
+		:return: None
+		'''
+		if side != 'buy' and side != 'sell':
+			raise Exception('Side has to be either "buy" or "sell"')
+
+		base, quote = pair[:3], pair[3:]
+		if base not in self.holdings or quote not in self.holdings:
+			raise Exception('Unknown pair {}'.format(pair))
+
+		direction = 1 if side == 'buy' else -1
+		self.__adjust(base, direction * amount)
+		self.__adjust(quote, -direction * amount * price - fee)
+		self.__publish()
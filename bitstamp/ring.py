@@ -0,0 +1,246 @@
+'''
+Shared-memory ring buffer that lets one process own the web socket feed and fan it out to many consumer processes.
+
+The publisher decodes every message once and writes it as a fixed-layout record into a slot of the ring. Consumers
+keep their own cursor and read the slots without any locking; every slot carries the sequence number of the message
+in it, so a consumer that was too slow notices it has been lapped instead of reading a half-written record.
+
+Layout of the shared memory block:
+* header: magic, capacity (number of slots), slot size, sequence number of the last published message
+* capacity slots of slot size bytes, each starting with the slot header (sequence number, channel, payload length)
+'''
+from multiprocessing import resource_tracker, shared_memory
+import json
+import os
+import struct
+import sys
+
+from bitstamp.bitstamp import WS_CHANNEL_LIVE_TRADES, WS_CHANNEL_ORDER_BOOK, WS_CHANNEL_ORDER_BOOK_DIFF
+
+MAGIC = b'BSRB'
+HEADER = struct.Struct('<4sII4xQ')
+HEADER_SIZE = 64
+CURSOR_OFFSET = 16
+CURSOR = struct.Struct('<Q')
+SLOT_HEADER = struct.Struct('<QB3xI')
+# Live trades are the hot path, so they are packed as a fixed record instead of JSON:
+# id, price, amount, type, buy_order_id, sell_order_id, followed by the string fields separated by NUL bytes
+TRADE_RECORD = struct.Struct('<QddBQQ')
+TRADE_FIELDS = ['id', 'price', 'amount', 'type', 'buy_order_id', 'sell_order_id']
+# Exact decimal strings and timestamps, kept as they came so consumers see the same message attach_ws callbacks do
+TRADE_STRING_FIELDS = ['price_str', 'amount_str', 'timestamp', 'microtimestamp']
+TRADE_TYPES = [int, float, float, int, int, int]
+CHANNEL_CODES = {
+	WS_CHANNEL_LIVE_TRADES: 1,
+	WS_CHANNEL_ORDER_BOOK: 2,
+	WS_CHANNEL_ORDER_BOOK_DIFF: 3,
+}
+# Code of the live trades that are packed as a TRADE_RECORD, trades that don't fit it are stored as JSON
+PACKED_TRADE_CODE = 4
+CHANNELS = {code: channel for channel, code in CHANNEL_CODES.items()}
+CHANNELS[PACKED_TRADE_CODE] = WS_CHANNEL_LIVE_TRADES
+DEFAULT_CAPACITY = 1024
+DEFAULT_SLOT_SIZE = 16 * 1024
+# Blocks created by publishers of this process, their registration with the resource tracker has to stay
+PUBLISHED = set()
+
+
+def packable(data):
+	'''
+	:param data: decoded live trades message
+	:return: True if the trade can be packed as a TRADE_RECORD and unpacked to an equal message
+	'''
+	if len(data) != len(TRADE_FIELDS) + len(TRADE_STRING_FIELDS):
+		return False
+
+	for field, field_type in zip(TRADE_FIELDS, TRADE_TYPES):
+		value = data.get(field)
+		# type() and not isinstance, bools are ints but wouldn't come back as bools
+		if type(value) is not field_type:
+			return False
+		if field_type is int and not 0 <= value < (256 if field == 'type' else 2 ** 64):
+			return False
+
+	for field in TRADE_STRING_FIELDS:
+		value = data.get(field)
+		if type(value) is not str or '\x00' in value:
+			return False
+
+	return True
+
+
+def encode(channel, data):
+	'''
+	Encodes a message (as passed to the attach_ws callback) to the payload of a slot.
+	:param channel: one of the web socket channels
+	:param data: decoded message
+	:return: (channel code, bytes) tuple
+	'''
+	if channel == WS_CHANNEL_LIVE_TRADES and packable(data):
+		record = TRADE_RECORD.pack(*[data[field] for field in TRADE_FIELDS])
+		strings = '\x00'.join(data[field] for field in TRADE_STRING_FIELDS)
+		return PACKED_TRADE_CODE, record + strings.encode('utf8')
+
+	return CHANNEL_CODES[channel], json.dumps(data, separators=(',', ':')).encode('utf8')
+
+
+def decode(code, payload):
+	'''
+	Decodes the payload of a slot back to a message.
+	:param code: channel code of the slot
+	:param payload: bytes
+	:return: (channel, decoded message) tuple
+	'''
+	if code == PACKED_TRADE_CODE:
+		data = dict(zip(TRADE_FIELDS, TRADE_RECORD.unpack_from(payload)))
+		strings = payload[TRADE_RECORD.size:].decode('utf8').split('\x00')
+		data.update(zip(TRADE_STRING_FIELDS, strings))
+		return WS_CHANNEL_LIVE_TRADES, data
+
+	return CHANNELS[code], json.loads(payload.decode('utf8'))
+
+
+class RingBufferPublisher(object):
+	def __init__(self, name, capacity=DEFAULT_CAPACITY, slot_size=DEFAULT_SLOT_SIZE):
+		'''
+		Creates the shared memory block. There must be only one publisher per ring.
+		:param name: name of the shared memory block consumers will attach to
+		:param capacity: number of messages the ring holds before the oldest are overwritten
+		:param slot_size: size of a slot in bytes, the largest message has to fit in it
+		:return: The publisher object
+		'''
+		if capacity < 1:
+			raise Exception('Capacity has to be a positive number')
+
+		if slot_size <= SLOT_HEADER.size:
+			raise Exception('Slot size has to be larger than {} bytes'.format(SLOT_HEADER.size))
+
+		self.capacity = capacity
+		self.slot_size = slot_size
+		self.memory = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE + capacity * slot_size)
+		PUBLISHED.add(self.memory._name)
+		self.buffer = self.memory.buf
+		self.sequence = 0
+		HEADER.pack_into(self.buffer, 0, MAGIC, capacity, slot_size, 0)
+
+	def publish(self, channel, data):
+		'''
+		Writes the message into the next slot, overwriting the oldest message once the ring is full.
+		:param channel: one of the web socket channels
+		:param data: decoded message
+		:return: sequence number of the message
+		'''
+		code, payload = encode(channel, data)
+
+		if len(payload) > self.slot_size - SLOT_HEADER.size:
+			raise Exception('Message of {} bytes doesn\'t fit in a slot of {} bytes'.format(len(payload), self.slot_size))
+
+		sequence = self.sequence + 1
+		offset = HEADER_SIZE + ((sequence - 1) % self.capacity) * self.slot_size
+
+		# Sequence number 0 marks the slot as being written, so readers don't take it for a complete record
+		SLOT_HEADER.pack_into(self.buffer, offset, 0, 0, 0)
+		start = offset + SLOT_HEADER.size
+		self.buffer[start:start + len(payload)] = payload
+		SLOT_HEADER.pack_into(self.buffer, offset, sequence, code, len(payload))
+		CURSOR.pack_into(self.buffer, CURSOR_OFFSET, sequence)
+		self.sequence = sequence
+
+		return sequence
+
+	def callback(self, channel):
+		'''
+		Returns a callback for attach_ws that publishes every message of the channel to the ring.
+		:param channel: one of the web socket channels
+		:return: callback
+		'''
+		def publish_message(data):
+			self.publish(channel, data)
+
+		return publish_message
+
+	def close(self):
+		self.buffer = None
+		self.memory.close()
+
+	def unlink(self):
+		'''
+		Removes the shared memory block, call it once all the processes are done with it.
+		:return: None
+		'''
+		self.memory.unlink()
+		PUBLISHED.discard(self.memory._name)
+
+
+class RingBufferConsumer(object):
+	def __init__(self, name, from_start=False):
+		'''
+		Attaches to a ring created by a publisher.
+		:param name: name of the shared memory block
+		:param from_start: if True, reading starts at the oldest message still in the ring, otherwise only messages
+		 published from now on are read
+		:return: The consumer object
+		'''
+		if sys.version_info >= (3, 13):
+			self.memory = shared_memory.SharedMemory(name=name, track=False)
+		else:
+			# Older versions register the block with the resource tracker of this process, which would unlink it
+			# for all the other processes when this one exits
+			self.memory = shared_memory.SharedMemory(name=name)
+			if os.name == 'posix' and self.memory._name not in PUBLISHED:
+				resource_tracker.unregister(self.memory._name, 'shared_memory')
+
+		self.buffer = self.memory.buf
+		magic, self.capacity, self.slot_size, cursor = HEADER.unpack_from(self.buffer, 0)
+
+		if magic != MAGIC:
+			raise Exception('Shared memory block {} is not a ring buffer'.format(name))
+
+		# Sequence number of the next message this consumer wants to read
+		if from_start:
+			self.next_sequence = max(1, cursor - self.capacity + 1)
+		else:
+			self.next_sequence = cursor + 1
+		# Number of messages that were overwritten before this consumer got to read them
+		self.lapped = 0
+
+	def pending(self):
+		'''
+		:return: number of published messages this consumer hasn't read yet
+		'''
+		return CURSOR.unpack_from(self.buffer, CURSOR_OFFSET)[0] - self.next_sequence + 1
+
+	def poll(self, max_messages=None):
+		'''
+		Reads the messages published since the last poll. Never blocks.
+		:param max_messages: optional limit of messages returned
+		:return: list of (channel, data) tuples
+		'''
+		cursor = CURSOR.unpack_from(self.buffer, CURSOR_OFFSET)[0]
+		messages = []
+
+		if cursor - self.next_sequence + 1 > self.capacity:
+			skip_to = cursor - self.capacity + 1
+			self.lapped += skip_to - self.next_sequence
+			self.next_sequence = skip_to
+
+		while self.next_sequence <= cursor and (max_messages is None or len(messages) < max_messages):
+			sequence = self.next_sequence
+			offset = HEADER_SIZE + ((sequence - 1) % self.capacity) * self.slot_size
+			slot_sequence, code, length = SLOT_HEADER.unpack_from(self.buffer, offset)
+			start = offset + SLOT_HEADER.size
+			payload = bytes(self.buffer[start:start + min(length, self.slot_size - SLOT_HEADER.size)])
+
+			# If the sequence changed while copying, the publisher got around the ring and overwrote the slot
+			if slot_sequence != sequence or SLOT_HEADER.unpack_from(self.buffer, offset)[0] != sequence:
+				self.lapped += 1
+			else:
+				messages.append(decode(code, payload))
+
+			self.next_sequence += 1
+
+		return messages
+
+	def close(self):
+		self.buffer = None
+		self.memory.close()
@@ -0,0 +1,268 @@
+'''
+File-backed, memory-mapped cache of the latest public market data, shared between processes on the same host.
+
+One refresher process calls the API and writes the results to the cache; any number of Bitstamp instances created
+with snapshot_cache read ticker, order_book and eur_usd from it instead of calling the API. Every key has its own
+fixed-size slot guarded by a seqlock: the writer makes the slot's sequence number odd before it writes and even again
+after it's done, and readers retry whenever the number was odd or changed while they were copying the slot.
+'''
+import json
+import mmap
+import os
+import struct
+import time
+
+from bitstamp.bitstamp import BTC_USD, BTC_EUR, EUR_USD
+
+MAGIC = b'BSSC'
+HEADER = struct.Struct('<4sII')
+HEADER_SIZE = 64
+SLOT_HEADER = struct.Struct('<QdI4x')
+DEFAULT_PAIRS = [BTC_USD, BTC_EUR, EUR_USD]
+# Deep order books are the largest snapshots, the file is sparse so unused space costs nothing
+DEFAULT_SLOT_SIZE = 4 * 1024 * 1024
+READ_RETRIES = 100
+KEY_EUR_USD = 'eur_usd'
+
+
+def ticker_key(currency):
+	return 'ticker/{}'.format(currency)
+
+
+def order_book_key(currency):
+	return 'order_book/{}'.format(currency)
+
+
+class SnapshotCache(object):
+	def __init__(self, path, pairs=None, slot_size=DEFAULT_SLOT_SIZE, writer=False):
+		'''
+		Opens the cache file. The writer creates the file or resizes it in place, so readers that have it mapped keep
+		working across restarts of the refresher; readers map it read-only once it exists. All the processes sharing
+		the file have to use the same pairs and slot size.
+		:param path: path to the cache file
+		:param pairs: currency pairs tickers and order books are cached for
+		:param slot_size: size of a slot in bytes, the largest snapshot has to fit in it
+		:param writer: True only for the (single) process that refreshes the cache
+		:return: The cache object
+		'''
+		if pairs is None:
+			pairs = DEFAULT_PAIRS
+
+		self.path = path
+		self.pairs = list(pairs)
+		self.slot_size = slot_size
+		self.writer = writer
+		self.keys = [KEY_EUR_USD]
+		for pair in pairs:
+			self.keys.extend([ticker_key(pair), order_book_key(pair)])
+		self.slots = {key: HEADER_SIZE + index * slot_size for index, key in enumerate(self.keys)}
+		self.size = HEADER_SIZE + len(self.keys) * slot_size
+		self.map = None
+
+		if writer:
+			# Truncating the file to zero first would make readers that have it mapped crash on their next access
+			with open(os.open(path, os.O_RDWR | os.O_CREAT), 'r+b') as file:
+				file.truncate(self.size)
+				self.map = mmap.mmap(file.fileno(), self.size, access=mmap.ACCESS_WRITE)
+			self.__reset()
+
+	def __reset(self):
+		'''
+		Prepares the slots for writing. Snapshots left by a previous writer with the same layout are kept (readers
+		judge them by their age), a slot the previous writer died in the middle of writing is emptied and a file with
+		a different layout is emptied altogether.
+		'''
+		magic, slot_count, slot_size = HEADER.unpack_from(self.map, 0)
+		same_layout = magic == MAGIC and slot_count == len(self.keys) and slot_size == self.slot_size
+
+		for offset in self.slots.values():
+			if not same_layout or SLOT_HEADER.unpack_from(self.map, offset)[0] % 2 == 1:
+				SLOT_HEADER.pack_into(self.map, offset, 0, 0, 0)
+
+		HEADER.pack_into(self.map, 0, MAGIC, len(self.keys), self.slot_size)
+
+	def __mapped(self):
+		'''
+		Readers map the file lazily, so they can be started before the refresher created it.
+		:return: True if the file is mapped
+		'''
+		if self.map is not None:
+			return True
+
+		try:
+			with open(self.path, 'rb') as file:
+				if os.fstat(file.fileno()).st_size < self.size:
+					return False
+				self.map = mmap.mmap(file.fileno(), self.size, access=mmap.ACCESS_READ)
+		except OSError:
+			return False
+
+		magic, slot_count, slot_size = HEADER.unpack_from(self.map, 0)
+		if magic != MAGIC or slot_count != len(self.keys) or slot_size != self.slot_size:
+			self.map.close()
+			self.map = None
+			raise Exception('Snapshot cache {} was created with different pairs or slot size'.format(self.path))
+
+		return True
+
+	def write(self, key, blob):
+		'''
+		Stores the blob under the key.
+		:param key: one of the cache keys (see ticker_key, order_book_key and KEY_EUR_USD)
+		:param blob: JSON serializable result of an API call
+		:return: version of the stored snapshot
+		'''
+		if not self.writer:
+			raise Exception('Only the cache opened with writer=True can be written to')
+
+		if key not in self.slots:
+			raise Exception('Key {} is not cached'.format(key))
+
+		payload = json.dumps(blob, separators=(',', ':')).encode('utf8')
+		offset = self.slots[key]
+
+		if len(payload) > self.slot_size - SLOT_HEADER.size:
+			raise Exception('Snapshot of {} bytes doesn\'t fit in a slot of {} bytes'.format(len(payload), self.slot_size))
+
+		sequence = SLOT_HEADER.unpack_from(self.map, offset)[0]
+		# Odd sequence tells the readers the slot is being written
+		struct.pack_into('<Q', self.map, offset, sequence + 1)
+		start = offset + SLOT_HEADER.size
+		self.map[start:start + len(payload)] = payload
+		SLOT_HEADER.pack_into(self.map, offset, sequence + 2, time.time(), len(payload))
+
+		return (sequence + 2) // 2
+
+	def read(self, key, max_age=None):
+		'''
+		Reads the latest snapshot stored under the key.
+		:param key: one of the cache keys (see ticker_key, order_book_key and KEY_EUR_USD)
+		:param max_age: optional maximal age of the snapshot in seconds
+		:return: (blob, version, written_at) tuple or None if there is no consistent snapshot that is fresh enough
+		'''
+		if key not in self.slots or not self.__mapped():
+			return None
+
+		offset = self.slots[key]
+		start = offset + SLOT_HEADER.size
+
+		for _ in range(READ_RETRIES):
+			sequence, written_at, length = SLOT_HEADER.unpack_from(self.map, offset)
+
+			if sequence == 0:
+				return None
+
+			if sequence % 2 == 1:
+				continue
+
+			if max_age is not None and time.time() - written_at > max_age:
+				return None
+
+			payload = self.map[start:start + min(length, self.slot_size - SLOT_HEADER.size)]
+
+			if struct.unpack_from('<Q', self.map, offset)[0] == sequence:
+				return json.loads(payload.decode('utf8')), sequence // 2, written_at
+
+		return None
+
+	def __latest(self, key, max_age):
+		snapshot = self.read(key, max_age)
+
+		if snapshot is None:
+			return None
+
+		return snapshot[0]
+
+	def ticker(self, currency, max_age=None):
+		'''
+		:return: the latest ticker blob of the pair or None (see read)
+		'''
+		return self.__latest(ticker_key(currency), max_age)
+
+	def order_book(self, currency, max_age=None):
+		'''
+		:return: the latest order book blob of the pair or None (see read)
+		'''
+		return self.__latest(order_book_key(currency), max_age)
+
+	def eur_usd(self, max_age=None):
+		'''
+		:return: the latest eur_usd blob or None (see read)
+		'''
+		return self.__latest(KEY_EUR_USD, max_age)
+
+	def close(self):
+		if self.map is not None:
+			self.map.close()
+			self.map = None
+
+
+class SnapshotRefresher(object):
+	def __init__(self, api, cache, interval=1.0):
+		'''
+		Keeps the cache up to date by periodically calling the API.
+		:param api: Bitstamp instance that is not in cache mode
+		:param cache: SnapshotCache opened with writer=True
+		:param interval: seconds between two refreshes
+		:return: The refresher object
+		'''
+		if api.snapshot_cache is not None:
+			raise Exception('The refresher has to call the API, so its client must not read from a snapshot cache')
+
+		self.api = api
+		self.cache = cache
+		self.interval = interval
+		self.running = False
+		# Calls that raised, e.g. connection errors or responses that aren't JSON
+		self.errors = 0
+		self.last_error = None
+
+	def refresh(self):
+		'''
+		Calls eur_usd and ticker and order_book for every pair of the cache and stores the results. Error responses
+		and calls that raise are not stored, so readers keep seeing the last good snapshot until it becomes too stale.
+		:return: number of snapshots that couldn't be refreshed
+		'''
+		failed = 0
+
+		if not self.__store(KEY_EUR_USD, self.api.eur_usd):
+			failed += 1
+
+		for pair in self.cache.pairs:
+			if not self.__store(ticker_key(pair), self.api.ticker, currency=pair):
+				failed += 1
+			if not self.__store(order_book_key(pair), self.api.order_book, currency=pair):
+				failed += 1
+
+		return failed
+
+	def __store(self, key, call, **kwargs):
+		try:
+			blob = call(**kwargs)
+
+			if isinstance(blob, dict) and ('error' in blob or blob.get('status') == 'error'):
+				return False
+
+			# Raises if the snapshot outgrew the slot, e.g. a deep order book
+			self.cache.write(key, blob)
+		except Exception as exception:
+			self.errors += 1
+			self.last_error = exception
+			return False
+
+		return True
+
+	def run(self):
+		'''
+		Refreshes the cache until stop is called.
+		:return: None
+		'''
+		self.running = True
+
+		while self.running:
+			started = time.time()
+			self.refresh()
+			time.sleep(max(0, self.interval - (time.time() - started)))
+
+	def stop(self):
+		self.running = False
@@ -0,0 +1,288 @@
+'''
+Soak harness for web socket consumers. It drives the same message path attach_ws uses (the client's data message
+closure and the callback) with synthetic or recorded Pusher frames at a configurable rate for as long as needed,
+and reports throughput, per-message latency percentiles and memory growth per million messages. Optionally it
+writes tracemalloc snapshots and sampled stacks (in the folded format flame graph tools read) at regular intervals.
+
+Run it from the command line with python -m bitstamp.soak --help.
+'''
+from collections import Counter
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+from bitstamp.bitstamp import Bitstamp, WS_CHANNEL_LIVE_TRADES, WS_CHANNEL_ORDER_BOOK, WS_CHANNEL_ORDER_BOOK_DIFF
+from bitstamp.histogram import LatencyHistogram, PERCENTILES
+
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+
+class StackSampler(object):
+	def __init__(self, thread_id, interval=DEFAULT_SAMPLE_INTERVAL):
+		'''
+		Sampling profiler: a background thread records the stack of the profiled thread every interval seconds.
+		:param thread_id: ident of the thread to sample
+		:param interval: seconds between two samples
+		:return: The sampler object
+		'''
+		self.thread_id = thread_id
+		self.interval = interval
+		self.stacks = Counter()
+		self.running = False
+		self.thread = None
+
+	def __sample(self):
+		while self.running:
+			frame = sys._current_frames().get(self.thread_id)
+			stack = []
+
+			while frame is not None:
+				code = frame.f_code
+				stack.append('{}:{}:{}'.format(os.path.basename(code.co_filename), code.co_name, frame.f_lineno))
+				frame = frame.f_back
+
+			if stack:
+				self.stacks[';'.join(reversed(stack))] += 1
+
+			time.sleep(self.interval)
+
+	def start(self):
+		self.running = True
+		self.thread = threading.Thread(target=self.__sample, daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		self.running = False
+		if self.thread is not None:
+			self.thread.join()
+
+	def dump(self, path):
+		'''
+		Writes the samples collected so far in the folded stacks format and starts collecting anew.
+		:param path: path of the file
+		:return: None
+		'''
+		stacks = self.stacks
+		self.stacks = Counter()
+
+		with open(path, 'w') as file:
+			for stack, count in stacks.most_common():
+				file.write('{} {}\n'.format(stack, count))
+
+
+def synthetic_frames(channel=WS_CHANNEL_LIVE_TRADES, seed=None):
+	'''
+	Endless generator of Pusher frames that look like the ones Bitstamp sends on the channel.
+	:param channel: one of the web socket channels
+	:param seed: optional seed, for repeatable runs
+	:return: generator of raw frames (strings)
+	'''
+	generator = random.Random(seed)
+	price = 600.0
+	message_id = 0
+
+	while True:
+		message_id += 1
+		price = max(1.0, price + generator.gauss(0, 0.5))
+		timestamp = str(int(time.time()))
+
+		if channel == WS_CHANNEL_LIVE_TRADES:
+			amount = round(generator.expovariate(2), 8)
+			data = {
+				'id': message_id,
+				'amount': amount,
+				'amount_str': '{:.8f}'.format(amount),
+				'price': round(price, 2),
+				'price_str': '{:.2f}'.format(price),
+				'type': generator.randint(0, 1),
+				'timestamp': timestamp,
+				'buy_order_id': 2 * message_id,
+				'sell_order_id': 2 * message_id + 1,
+			}
+			yield json.dumps({'event': 'trade', 'channel': 'live_trades', 'data': json.dumps(data)})
+		else:
+			depth = 100 if channel == WS_CHANNEL_ORDER_BOOK else generator.randint(1, 5)
+			data = {
+				'timestamp': timestamp,
+				'bids': [['{:.2f}'.format(price - 0.01 * (level + 1)), '{:.8f}'.format(generator.random())] for level in range(depth)],
+				'asks': [['{:.2f}'.format(price + 0.01 * (level + 1)), '{:.8f}'.format(generator.random())] for level in range(depth)],
+			}
+			name = 'order_book' if channel == WS_CHANNEL_ORDER_BOOK else 'diff_order_book'
+			yield json.dumps({'event': 'data', 'channel': name, 'data': json.dumps(data)})
+
+
+def recorded_frames(path):
+	'''
+	Endless generator of frames recorded to a file, one raw frame per line; the recording is replayed in a loop.
+	:param path: path to the recording
+	:return: generator of raw frames (strings)
+	'''
+	with open(path) as file:
+		frames = [line.rstrip('\n') for line in file if line.strip()]
+
+	if not frames:
+		raise Exception('Recording {} has no frames'.format(path))
+
+	while True:
+		for frame in frames:
+			yield frame
+
+
+class SoakHarness(object):
+	def __init__(self, api, callback, frames, rate=None, duration=60, snapshot_interval=10, output_dir=None,
+	             trace_memory=True, profile=False):
+		'''
+		:param api: Bitstamp instance whose message path is driven
+		:param callback: the callback under test, as it would be passed to attach_ws
+		:param frames: iterator of raw frames, see synthetic_frames and recorded_frames
+		:param rate: messages per second, None to find the throughput ceiling
+		:param duration: length of the run in seconds
+		:param snapshot_interval: seconds between two memory measurements (and dumps, if output_dir is set)
+		:param output_dir: optional directory tracemalloc snapshots and folded stacks are written to
+		:param trace_memory: if True, memory is measured with tracemalloc (which slows down allocations)
+		:param profile: if True, stacks are sampled while the harness runs
+		:return: The harness object
+		'''
+		self.handler = api.message_handler(callback)
+		self.frames = iter(frames)
+		self.rate = rate
+		self.duration = duration
+		self.snapshot_interval = snapshot_interval
+		self.output_dir = output_dir
+		self.trace_memory = trace_memory
+		self.profile = profile
+		self.latencies = LatencyHistogram()
+		# (messages handled, traced memory in bytes) at every snapshot
+		self.memory = []
+		self.messages = 0
+		self.errors = 0
+		self.elapsed = 0
+
+	def __snapshot(self, sampler, index):
+		if self.trace_memory:
+			self.memory.append((self.messages, tracemalloc.get_traced_memory()[0]))
+
+		if self.output_dir is not None:
+			if self.trace_memory:
+				tracemalloc.take_snapshot().dump(os.path.join(self.output_dir, 'snapshot-{:04d}.tracemalloc'.format(index)))
+			if sampler is not None:
+				sampler.dump(os.path.join(self.output_dir, 'stacks-{:04d}.folded'.format(index)))
+
+	def run(self):
+		'''
+		Runs the soak test. Exceptions raised by the callback are counted, not propagated.
+		:return: report (see report())
+		'''
+		if self.output_dir is not None:
+			os.makedirs(self.output_dir, exist_ok=True)
+
+		started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+		if started_tracing:
+			tracemalloc.start()
+
+		sampler = None
+		if self.profile:
+			sampler = StackSampler(threading.get_ident())
+			sampler.start()
+
+		handler = self.handler
+		clock = time.perf_counter_ns
+		started = time.perf_counter()
+		next_snapshot = started + self.snapshot_interval
+		snapshots = 0
+		self.__snapshot(sampler, snapshots)
+
+		try:
+			while True:
+				now = time.perf_counter()
+				if now - started >= self.duration:
+					break
+
+				if now >= next_snapshot:
+					snapshots += 1
+					self.__snapshot(sampler, snapshots)
+					next_snapshot += self.snapshot_interval
+
+				if self.rate is not None:
+					# Sleep only when ahead of schedule by more than a millisecond, sleeping per message is too coarse
+					ahead = started + self.messages / self.rate - now
+					if ahead > 0.001:
+						time.sleep(ahead)
+
+				frame = next(self.frames)
+				handled = clock()
+				try:
+					handler(None, frame)
+				except Exception:
+					self.errors += 1
+				self.latencies.record(clock() - handled)
+				self.messages += 1
+
+			self.elapsed = time.perf_counter() - started
+			self.__snapshot(sampler, snapshots + 1)
+		finally:
+			if sampler is not None:
+				sampler.stop()
+			if started_tracing:
+				tracemalloc.stop()
+
+		return self.report()
+
+	def report(self):
+		'''
+		:return: dict with messages, errors, elapsed seconds, throughput (messages per second), latency percentiles
+		 and maximum in microseconds and memory growth in bytes per million messages (None without tracemalloc)
+		'''
+		growth = None
+		# The first interval warms up caches and interned objects, so growth is measured from its end when possible
+		baseline = self.memory[1] if len(self.memory) >= 3 else self.memory[0] if self.memory else None
+		if baseline is not None and self.memory[-1][0] > baseline[0]:
+			(first_messages, first_bytes), (last_messages, last_bytes) = baseline, self.memory[-1]
+			growth = (last_bytes - first_bytes) * 1000000.0 / (last_messages - first_messages)
+
+		latency = {'p{}'.format(percent): self.latencies.percentile(percent) / 1000.0 for percent in PERCENTILES}
+		latency['max'] = self.latencies.maximum / 1000.0
+
+		return {
+			'messages': self.messages,
+			'errors': self.errors,
+			'elapsed': self.elapsed,
+			'throughput': self.messages / self.elapsed if self.elapsed > 0 else 0,
+			'latency_us': latency,
+			'memory_growth_per_million': growth,
+		}
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Soak test of the web socket message path')
+	parser.add_argument('--channel', default=WS_CHANNEL_LIVE_TRADES,
+	                    choices=[WS_CHANNEL_LIVE_TRADES, WS_CHANNEL_ORDER_BOOK, WS_CHANNEL_ORDER_BOOK_DIFF])
+	parser.add_argument('--frames', help='file with recorded frames, one per line (synthetic frames by default)')
+	parser.add_argument('--rate', type=float, help='messages per second (unlimited by default)')
+	parser.add_argument('--duration', type=float, default=60, help='seconds')
+	parser.add_argument('--snapshot-interval', type=float, default=10, help='seconds')
+	parser.add_argument('--output', help='directory for tracemalloc snapshots and folded stacks')
+	parser.add_argument('--profile', action='store_true', help='sample stacks while running')
+	parser.add_argument('--no-tracemalloc', action='store_true', help='don\'t measure memory')
+	arguments = parser.parse_args()
+
+	if arguments.frames is not None:
+		frames = recorded_frames(arguments.frames)
+	else:
+		frames = synthetic_frames(arguments.channel)
+
+	# The message path doesn't need real credentials
+	api = Bitstamp(api_key='soak', secret='soak', customer_id='soak')
+	harness = SoakHarness(api, lambda data: None, frames, rate=arguments.rate, duration=arguments.duration,
+	                      snapshot_interval=arguments.snapshot_interval, output_dir=arguments.output,
+	                      trace_memory=not arguments.no_tracemalloc, profile=arguments.profile)
+	print(json.dumps(harness.run(), indent=4))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,149 @@
+import codecs
+import json
+
+# Chunk size used when reading the response body; small enough to keep memory flat, big enough to not thrash
+DEFAULT_CHUNK_SIZE = 16 * 1024
+WHITESPACE = ' \t\n\r'
+
+
+class IncrementalJsonReader(object):
+	def __init__(self, chunks):
+		'''
+		Reads JSON values one by one from an iterable of byte chunks (e.g. response.iter_content()). Only the part of
+		the document that hasn't been consumed yet is kept in memory.
+		:param chunks: iterable of bytes objects
+		:return: The reader object
+		'''
+		self.chunks = iter(chunks)
+		self.decoder = json.JSONDecoder()
+		self.utf8 = codecs.getincrementaldecoder('utf-8')()
+		self.buffer = ''
+		self.position = 0
+		self.finished = False
+
+	def __fill(self):
+		'''
+		Appends the next chunk to the buffer, dropping the consumed prefix first.
+		:return: False if there was nothing more to read, True otherwise
+		'''
+		if self.finished:
+			return False
+
+		try:
+			chunk = next(self.chunks)
+		except StopIteration:
+			self.finished = True
+			self.buffer = self.buffer[self.position:] + self.utf8.decode(b'', final=True)
+			self.position = 0
+			return False
+
+		self.buffer = self.buffer[self.position:] + self.utf8.decode(chunk)
+		self.position = 0
+		return True
+
+	def peek(self):
+		'''
+		Skips the whitespace and returns the next significant character without consuming it.
+		:return: a single character or None if the document ended
+		'''
+		while True:
+			while self.position < len(self.buffer) and self.buffer[self.position] in WHITESPACE:
+				self.position += 1
+
+			if self.position < len(self.buffer):
+				return self.buffer[self.position]
+
+			if not self.__fill():
+				return None
+
+	def expect(self, characters):
+		'''
+		Consumes the next significant character, which has to be one of the passed characters.
+		:param characters: string of allowed characters
+		:return: the consumed character
+		'''
+		character = self.peek()
+
+		if character is None or character not in characters:
+			raise Exception('Malformed JSON stream: expected one of "{}", got "{}"'.format(characters, character))
+
+		self.position += 1
+		return character
+
+	def value(self):
+		'''
+		Decodes the next complete JSON value. If the value is cut off at the end of the buffer, more chunks are read
+		until it can be decoded. A value that ends exactly at the end of the buffer is only accepted once the stream
+		is finished, as a number might continue in the next chunk.
+		:return: the decoded value
+		'''
+		self.peek()
+
+		while True:
+			try:
+				result, end = self.decoder.raw_decode(self.buffer, self.position)
+				if end < len(self.buffer) or self.finished:
+					self.position = end
+					return result
+			except ValueError:
+				if self.finished:
+					raise Exception('Malformed JSON stream: {}'.format(self.buffer[self.position:self.position + 100]))
+
+			self.__fill()
+
+
+def iter_array(chunks):
+	'''
+	Yields the items of a top level JSON array as soon as each of them has been fully received.
+	:param chunks: iterable of bytes objects
+	:return: generator of decoded array items
+	'''
+	reader = IncrementalJsonReader(chunks)
+
+	if reader.peek() != '[':
+		# The API returns errors as objects, so pass them on instead of silently yielding nothing
+		raise Exception('Expected a JSON array, got: {}'.format(reader.value()))
+
+	for item in _iter_array_items(reader):
+		yield item
+
+
+def iter_object(chunks):
+	'''
+	Yields the members of a top level JSON object as (key, value) tuples. Members that are arrays are not yielded
+	as a whole; each of their items is yielded as a separate (key, item) tuple instead.
+	:param chunks: iterable of bytes objects
+	:return: generator of (key, value) tuples
+	'''
+	reader = IncrementalJsonReader(chunks)
+	reader.expect('{')
+
+	if reader.peek() == '}':
+		return
+
+	while True:
+		key = reader.value()
+		reader.expect(':')
+
+		if reader.peek() == '[':
+			for item in _iter_array_items(reader):
+				yield key, item
+		else:
+			yield key, reader.value()
+
+		if reader.expect(',}') == '}':
+			return
+
+
+def _iter_array_items(reader):
+	reader.expect('[')
+
+	if reader.peek() == ']':
+		reader.position += 1
+		return
+
+	while True:
+		yield reader.value()
+
+		if reader.expect(',]') == ']':
+			return
@@ -0,0 +1,124 @@
+from bitstamp.bitstamp import BTC_USD, BTC_EUR, EUR_USD
+
+LEGS = [BTC_USD, BTC_EUR, EUR_USD]
+
+
+class CrossRateMonitor(object):
+	def __init__(self, fee=0.0):
+		'''
+		Watches the BTC/USD, BTC/EUR and EUR/USD triangle. It keeps the best bid and ask of every leg and, only when
+		the top of book of a leg actually changes, recomputes the EUR/USD rate implied by the two BTC pairs and the
+		executable edge of going around the triangle in both directions.
+		:param fee: fee per trade as a fraction (0.0025 for 0.25%), taken on each of the three legs
+		:return: The monitor object
+		'''
+		self.fee_factor = (1 - fee) ** 3
+		self.bids = {pair: None for pair in LEGS}
+		self.asks = {pair: None for pair in LEGS}
+		self.implied_eur_usd = None
+		# Edge of USD -> BTC -> EUR -> USD and of USD -> EUR -> BTC -> USD, as a fraction of the starting amount
+		self.forward_edge = None
+		self.reverse_edge = None
+		self.updates = 0
+		self.recomputations = 0
+		# [threshold, callback, armed] lists, see add_threshold
+		self.thresholds = []
+
+	def add_threshold(self, threshold, callback):
+		'''
+		Registers a callback that fires when the better of the two edges rises to the threshold or above. It fires
+		once per crossing and is armed again after the edge falls below the threshold.
+		:param threshold: edge as a fraction, e.g. 0.001
+		:param callback: callable taking the state dict (see state())
+		:return: None
+		'''
+		self.thresholds.append([threshold, callback, True])
+
+	def state(self):
+		return {
+			'bids': dict(self.bids),
+			'asks': dict(self.asks),
+			'implied_eur_usd': self.implied_eur_usd,
+			'forward_edge': self.forward_edge,
+			'reverse_edge': self.reverse_edge,
+		}
+
+	def update(self, pair, bid, ask):
+		'''
+		Sets the top of book of one leg.
+		:param pair: one of LEGS
+		:param bid: best bid
+		:param ask: best ask
+		:return: True if the top of book changed and the edges were recomputed
+		'''
+		self.updates += 1
+
+		if self.bids[pair] == bid and self.asks[pair] == ask:
+			return False
+
+		self.bids[pair] = bid
+		self.asks[pair] = ask
+
+		if None in self.bids.values() or None in self.asks.values():
+			return False
+
+		self.__recompute()
+		return True
+
+	def __recompute(self):
+		self.recomputations += 1
+		bids = self.bids
+		asks = self.asks
+
+		self.implied_eur_usd = (bids[BTC_USD] + asks[BTC_USD]) / (bids[BTC_EUR] + asks[BTC_EUR])
+		# Buy BTC for USD, sell it for EUR, sell EUR for USD
+		self.forward_edge = bids[BTC_EUR] * bids[EUR_USD] / asks[BTC_USD] * self.fee_factor - 1
+		# Buy EUR for USD, buy BTC for EUR, sell it for USD
+		self.reverse_edge = bids[BTC_USD] / (asks[EUR_USD] * asks[BTC_EUR]) * self.fee_factor - 1
+
+		if self.thresholds:
+			edge = max(self.forward_edge, self.reverse_edge)
+			for threshold in self.thresholds:
+				if edge >= threshold[0]:
+					if threshold[2]:
+						threshold[2] = False
+						threshold[1](self.state())
+				else:
+					threshold[2] = True
+
+	def order_book_callback(self, pair):
+		'''
+		Returns a callback for the order book channel of the pair. attach_ws only subscribes to the BTC/USD channels,
+		so feed the other legs from Bitstamp.stream(WS_CHANNEL_ORDER_BOOK, pair=...) or with update_ticker and
+		update_eur_usd.
+		:param pair: one of LEGS
+		:return: callback
+		'''
+		if pair not in LEGS:
+			raise Exception('Pair has to be one of {}'.format(', '.join(LEGS)))
+
+		def on_order_book(data):
+			bids = data.get('bids')
+			asks = data.get('asks')
+			if bids and asks:
+				return self.update(pair, float(bids[0][0]), float(asks[0][0]))
+			return False
+
+		return on_order_book
+
+	def update_ticker(self, pair, ticker):
+		'''
+		Sets the top of book of one leg from a ticker() result.
+		:param pair: one of LEGS
+		:param ticker: result of Bitstamp.ticker()
+		:return: see update
+		'''
+		return self.update(pair, float(ticker.get('bid')), float(ticker.get('ask')))
+
+	def update_eur_usd(self, eur_usd):
+		'''
+		Sets the EUR/USD leg from an eur_usd() result: EUR is sold at the sell rate and bought at the buy rate.
+		:param eur_usd: result of Bitstamp.eur_usd()
+		:return: see update
+		'''
+		return self.update(EUR_USD, float(eur_usd.get('sell')), float(eur_usd.get('buy')))
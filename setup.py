@@ -42,4 +42,9 @@ setup(
     packages=find_packages(exclude=['examples', 'tests']),
 
     install_requires=['requests', 'websocket-client'],
+
+    extras_require={
+        'asyncio': ['websockets'],
+        'features': ['numpy'],
+    },
 )
\ No newline at end of file
@@ -1,10 +1,39 @@
 import unittest
+import asyncio
 import hashlib
 import hmac
+import json
+import math
 import os
+import struct
+import subprocess
+import sys
+import threading
+import time
+from email.utils import formatdate
 
+try:
+	import numpy
+except ImportError:
+	numpy = None
 
+
+from bitstamp import accounts
+from bitstamp import asyncws
 from bitstamp import bitstamp
+from bitstamp import clock
+from bitstamp import collector
+from bitstamp import execution
+from bitstamp import features
+from bitstamp import fixedpoint
+from bitstamp import histogram
+from bitstamp import orderbook
+from bitstamp import portfolio
+from bitstamp import ring
+from bitstamp import snapshot
+from bitstamp import soak
+from bitstamp import streaming
+from bitstamp import triangle
 
 
 class TestInstantiation(unittest.TestCase):
@@ -313,6 +342,1308 @@ class TestSignedValidatedCalls(unittest.TestCase):
 		pass
 
 
+class TestEndpoints(unittest.TestCase):
+	def setUp(self):
+		self.api_key = 'some api key'
+		self.secret = 'some secret'
+		self.customer_id = 'some customer id'
+		self.working_api = bitstamp.Bitstamp(api_key=self.api_key, secret=self.secret, customer_id=self.customer_id, api_endpoint='https://test/api/')
+
+	def test_templates(self):
+		self.assertEqual(sorted(self.working_api.templates.keys()), sorted(bitstamp.ENDPOINTS.keys()), msg='Every endpoint should have a template')
+
+	def test_unsigned(self):
+		method, url, data = self.working_api.prepare('transactions', bitstamp.BTC_EUR, time='minute')
+		self.assertEqual(method, 'GET')
+		self.assertEqual(url, 'https://test/api/v2/transactions/btceur/')
+		self.assertEqual(data, {'time': 'minute'})
+
+	def test_signed(self):
+		method, url, data = self.working_api.prepare('cancel_order', id=123)
+		self.assertEqual(method, 'POST')
+		self.assertEqual(url, 'https://test/api/cancel_order/')
+		self.assertEqual(sorted(data.keys()), ['id', 'key', 'nonce', 'signature'])
+
+		signature_raw = '{}{}{}'.format(data['nonce'], self.customer_id, self.api_key)
+		signature = hmac.new(self.secret.encode('utf8'), msg=signature_raw.encode('utf8'), digestmod=hashlib.sha256).hexdigest().upper()
+		self.assertEqual(data['signature'], signature)
+
+	def test_optional_pair(self):
+		self.assertEqual(self.working_api.prepare('balance')[1], 'https://test/api/v2/balance/', msg='No pair should mean all the balances')
+		self.assertEqual(self.working_api.prepare('balance', bitstamp.BTC_USD)[1], 'https://test/api/v2/balance/btcusd/')
+		self.assertEqual(self.working_api.prepare('open_orders')[1], 'https://test/api/v2/open_orders/all/')
+		self.assertEqual(self.working_api.prepare('user_transactions', bitstamp.BTC_EUR)[1], 'https://test/api/v2/user_transactions/btceur/')
+
+	def test_pair_required(self):
+		self.assertRaises(Exception, lambda: self.working_api.prepare('ticker'), msg='Ticker needs a pair')
+		self.assertRaises(Exception, lambda: self.working_api.prepare('eur_usd', bitstamp.BTC_USD), msg='eur_usd doesn\'t take a pair')
+
+	def test_none_params(self):
+		data = self.working_api.prepare('buy_limit_order', bitstamp.BTC_USD, price='605.12', amount='0.10000000', limit_price=None)[2]
+		self.assertNotIn('limit_price', data, msg='Parameters that are None should be left out')
+		self.assertEqual(data['price'], '605.12')
+
+	def tearDown(self):
+		pass
+
+
+class FakeResponse(object):
+	def __init__(self, blob):
+		self.text = json.dumps(blob)
+
+
+class TestAmendOrder(unittest.TestCase):
+	def setUp(self):
+		self.api_key = 'some api key'
+		self.secret = 'some secret'
+		self.customer_id = 'some customer id'
+		self.working_api = bitstamp.Bitstamp(api_key=self.api_key, secret=self.secret, customer_id=self.customer_id, api_endpoint='https://test/api/')
+		self.sent = []
+		self.responses = {}
+		self.working_api.send = self.send
+
+	def send(self, prepared, stream=False):
+		method, url, data = prepared
+		self.sent.append((url, data))
+		responses = self.responses.get(url)
+		return FakeResponse(responses.pop(0) if responses else {'id': 2})
+
+	def urls(self):
+		return [url for url, data in self.sent]
+
+	def test_nonces_increase(self):
+		nonces = [int(self.working_api.prepare('balance')[2]['nonce']) for _ in range(100)]
+		self.assertEqual(nonces, sorted(set(nonces)), msg='Nonces should be unique and increasing')
+
+	def test_concurrent(self):
+		result = self.working_api.amend_order(1, 0.1, 605.12)
+		self.assertEqual(sorted(self.urls()), ['https://test/api/cancel_order/', 'https://test/api/v2/buy/btcusd/'])
+		self.assertEqual(result['order'], {'id': 2})
+		self.assertEqual(len(self.working_api.amend_latencies), 1)
+		self.assertEqual(result['latency'], self.working_api.amend_latencies[0])
+
+	def test_concurrent_nonce_retry(self):
+		self.responses['https://test/api/v2/sell/btcusd/'] = [{'status': 'error', 'reason': 'Invalid nonce'}]
+		result = self.working_api.amend_order(1, 0.1, 605.12, side=bitstamp.ORDER_SIDE_SELL)
+		self.assertEqual(self.urls().count('https://test/api/v2/sell/btcusd/'), 2, msg='Order rejected for its nonce should be resent')
+		self.assertEqual(result['order'], {'id': 2})
+
+	def test_cancel_first(self):
+		self.responses['https://test/api/cancel_order/'] = [{'error': 'Order not found'}]
+		result = self.working_api.amend_order(1, 0.1, 605.12, mode=bitstamp.AMEND_CANCEL_FIRST)
+		self.assertEqual(self.urls(), ['https://test/api/cancel_order/'], msg='No new order if the old one was not cancelled')
+		self.assertIsNone(result['order'])
+
+	def test_place_first(self):
+		self.working_api.amend_order(1, 0.1, 605.12, mode=bitstamp.AMEND_PLACE_FIRST)
+		self.assertEqual(self.urls(), ['https://test/api/v2/buy/btcusd/', 'https://test/api/cancel_order/'])
+		self.assertLess(int(self.sent[0][1]['nonce']), int(self.sent[1][1]['nonce']), msg='Requests should be sent in nonce order')
+
+	def test_validations(self):
+		self.assertRaises(Exception, lambda: self.working_api.amend_order(1, 0.1, 1), msg='The volume of the order should be 5$ or more')
+		self.assertRaises(Exception, lambda: self.working_api.amend_order(None, 0.1, 605.12), msg='Order id must not be None')
+		self.assertRaises(Exception, lambda: self.working_api.amend_order(1, 0.1, 605.12, side='hold'), msg='Side has to be buy or sell')
+		self.assertRaises(Exception, lambda: self.working_api.amend_order(1, 0.1, 605.12, mode='later'), msg='Unknown mode')
+		self.assertEqual(self.sent, [], msg='Nothing should be sent if validation fails')
+
+	def tearDown(self):
+		pass
+
+
+class TestStreaming(unittest.TestCase):
+	def setUp(self):
+		self.transactions = [
+			{'date': '1475100000', 'tid': 12345, 'price': '605.12', 'type': 0, 'amount': '0.10000000'},
+			{'date': '1475100001', 'tid': 12346, 'price': '605.13', 'type': 1, 'amount': '1.50000000'},
+		]
+		self.order_book = {
+			'timestamp': '1475100002',
+			'bids': [['605.12', '1.00000000'], ['605.00', '2.50000000']],
+			'asks': [['605.20', '0.30000000']],
+		}
+
+	@staticmethod
+	def chunked(blob, size):
+		data = json.dumps(blob, indent=1).encode('utf8')
+		return [data[i:i + size] for i in range(0, len(data), size)]
+
+	def test_array(self):
+		for size in [1, 7, 4096]:
+			items = list(streaming.iter_array(self.chunked(self.transactions, size)))
+			self.assertEqual(items, self.transactions, msg='Items should not depend on the chunk size ({})'.format(size))
+
+	def test_array_empty(self):
+		self.assertEqual(list(streaming.iter_array([b'[', b' ]'])), [], msg='Empty array should yield nothing')
+
+	def test_array_of_numbers(self):
+		self.assertEqual(list(streaming.iter_array([b'[12', b'34,5', b'6]'])), [1234, 56], msg='Numbers split between chunks should not be cut')
+
+	def test_array_error(self):
+		self.assertRaises(Exception, lambda: list(streaming.iter_array([b'{"error": "Invalid currency pair"}'])), msg='Objects are not arrays')
+
+	def test_object(self):
+		for size in [1, 5, 4096]:
+			members = list(streaming.iter_object(self.chunked(self.order_book, size)))
+			self.assertEqual(members[0], ('timestamp', '1475100002'))
+			self.assertEqual([value for key, value in members if key == 'bids'], self.order_book['bids'])
+			self.assertEqual([value for key, value in members if key == 'asks'], self.order_book['asks'])
+
+	def test_unicode_split(self):
+		data = json.dumps(['\u20ac'], ensure_ascii=False).encode('utf8')
+		chunks = [data[i:i + 1] for i in range(len(data))]
+		self.assertEqual(list(streaming.iter_array(chunks)), ['\u20ac'], msg='Multibyte characters split between chunks should be decoded')
+
+	def test_truncated(self):
+		self.assertRaises(Exception, lambda: list(streaming.iter_array([b'[{"tid": 1}, {"tid"'])), msg='Truncated stream should raise')
+
+	def tearDown(self):
+		pass
+
+
+class TestFixedPoint(unittest.TestCase):
+	def setUp(self):
+		self.api_key = 'some api key'
+		self.secret = 'some secret'
+		self.customer_id = 'some customer id'
+		self.fixed_api = bitstamp.Bitstamp(api_key=self.api_key, secret=self.secret, customer_id=self.customer_id, fixed_point=True)
+
+	def test_parse(self):
+		self.assertEqual(fixedpoint.parse('605.12', 2), 60512)
+		self.assertEqual(fixedpoint.parse('0.00000001', 8), 1)
+		self.assertEqual(fixedpoint.parse('12', 8), 1200000000)
+		self.assertEqual(fixedpoint.parse('1.5', 8), 150000000)
+		self.assertEqual(fixedpoint.parse('-0.25', 2), -25)
+		self.assertEqual(fixedpoint.parse('605.1200', 2), 60512, msg='Trailing zeros should not count as precision')
+		self.assertEqual(fixedpoint.parse(3, 2), 300)
+		self.assertEqual(fixedpoint.parse(605.12, 2), 60512, msg='JSON numbers should be parsed as their decimal representation')
+		self.assertEqual(fixedpoint.parse(1e-05, 8), 1000)
+
+	def test_parse_invalid(self):
+		self.assertRaises(Exception, lambda: fixedpoint.parse('605.123', 2), msg='Precision must not be lost')
+		self.assertRaises(Exception, lambda: fixedpoint.parse('abc', 2), msg='Only decimal numbers can be parsed')
+		self.assertRaises(Exception, lambda: fixedpoint.parse('', 2), msg='Empty string is not a number')
+
+	def test_to_string(self):
+		self.assertEqual(fixedpoint.to_string(60512, 2), '605.12')
+		self.assertEqual(fixedpoint.to_string(1, 8), '0.00000001')
+		self.assertEqual(fixedpoint.to_string(-25, 2), '-0.25')
+		self.assertEqual(fixedpoint.to_string(7, 0), '7')
+		self.assertRaises(Exception, lambda: fixedpoint.to_string(1.5, 2), msg='Floats are not fixed-point values')
+
+	def test_round_trip(self):
+		for value in ['0.00', '0.01', '605.12', '12345678.99']:
+			self.assertEqual(fixedpoint.to_string(fixedpoint.parse(value, 2), 2), value)
+
+	def test_parse_levels(self):
+		levels = fixedpoint.parse_levels([['605.12', '1.00000000'], ['605.00', '0.5']], 2)
+		self.assertEqual(levels, [(60512, 100000000), (60500, 50000000)])
+
+	def test_parse_ticker(self):
+		# open comes as a JSON number, the other values as strings
+		blob = {'timestamp': '1475100000', 'high': '610.00', 'ask': '605.20', 'last': '605.12', 'low': '600.00', 'open': 601.1, 'bid': '605.12', 'volume': '1234.50000000', 'vwap': '604.50'}
+		self.fixed_api.send = lambda prepared, stream=False: FakeResponse(blob)
+		ticker = self.fixed_api.ticker(parsed=True)
+		self.assertEqual(ticker['open'], 60110)
+		self.assertEqual(ticker['bid'], 60512)
+		self.assertEqual(ticker['volume'], 123450000000)
+
+	def test_order_validations(self):
+		# 0.01 BTC at 499.99 is 4.9999$, just under the minimal volume
+		self.assertRaises(Exception, lambda: self.fixed_api.buy_limit_order(1000000, 49999), msg='The volume of the order should be 5$ or more')
+		self.assertRaises(Exception, lambda: self.fixed_api.sell_limit_order(1000000, 49999), msg='The volume of the order should be 5$ or more')
+		self.assertRaises(Exception, lambda: self.fixed_api.buy_limit_order(-1, 50000), msg='Amount should be capped at min=0')
+		self.assertRaises(Exception, lambda: self.fixed_api.buy_limit_order(1000000, 50000, bitstamp.BTC_USD, -1), msg='Limit price should be capped at min=0')
+
+	def tearDown(self):
+		pass
+
+
+class TestRingBuffer(unittest.TestCase):
+	def setUp(self):
+		self.name = 'bitstamp_test_{}'.format(os.getpid())
+		self.publisher = ring.RingBufferPublisher(self.name, capacity=4, slot_size=256)
+		self.trade = {'id': 12345, 'price': 605.12, 'price_str': '605.12', 'amount': 0.5, 'amount_str': '0.50000000', 'timestamp': '1475100000', 'microtimestamp': '1475100000123456', 'type': 1, 'buy_order_id': 1, 'sell_order_id': 2}
+		self.diff = {'timestamp': '1475100000', 'bids': [['605.12', '1.00000000']], 'asks': []}
+
+	def test_publish_and_poll(self):
+		consumer = ring.RingBufferConsumer(self.name)
+		self.publisher.callback(bitstamp.WS_CHANNEL_LIVE_TRADES)(self.trade)
+		self.publisher.publish(bitstamp.WS_CHANNEL_ORDER_BOOK_DIFF, self.diff)
+
+		messages = consumer.poll()
+		self.assertEqual(len(messages), 2)
+		self.assertEqual(messages[0], (bitstamp.WS_CHANNEL_LIVE_TRADES, self.trade), msg='Consumers should get the message attach_ws callbacks get')
+		self.assertEqual(messages[1], (bitstamp.WS_CHANNEL_ORDER_BOOK_DIFF, self.diff))
+		self.assertEqual(consumer.poll(), [], msg='Messages should be read only once')
+		self.assertEqual(consumer.lapped, 0)
+		consumer.close()
+
+	def test_trade_round_trip(self):
+		self.assertEqual(ring.encode(bitstamp.WS_CHANNEL_LIVE_TRADES, self.trade)[0], ring.PACKED_TRADE_CODE)
+		self.assertEqual(ring.decode(*ring.encode(bitstamp.WS_CHANNEL_LIVE_TRADES, self.trade)), (bitstamp.WS_CHANNEL_LIVE_TRADES, self.trade))
+
+		# Trades that don't fit the record, e.g. without microtimestamp or with a bool, are stored as JSON
+		unusual = [dict(self.trade), dict(self.trade, type=True), dict(self.trade, extra='x')]
+		del unusual[0]['microtimestamp']
+		for trade in unusual:
+			code, payload = ring.encode(bitstamp.WS_CHANNEL_LIVE_TRADES, trade)
+			self.assertEqual(code, ring.CHANNEL_CODES[bitstamp.WS_CHANNEL_LIVE_TRADES])
+			decoded = ring.decode(code, payload)[1]
+			self.assertEqual(decoded, trade)
+			self.assertEqual([type(value) for value in decoded.values()], [type(value) for value in trade.values()])
+
+	def test_independent_consumers(self):
+		first = ring.RingBufferConsumer(self.name)
+		second = ring.RingBufferConsumer(self.name)
+		self.publisher.publish(bitstamp.WS_CHANNEL_LIVE_TRADES, self.trade)
+
+		self.assertEqual(len(first.poll()), 1)
+		self.assertEqual(len(second.poll(max_messages=1)), 1)
+		first.close()
+		second.close()
+
+	def test_lapped(self):
+		consumer = ring.RingBufferConsumer(self.name)
+		for trade_id in range(1, 11):
+			self.trade['id'] = trade_id
+			self.publisher.publish(bitstamp.WS_CHANNEL_LIVE_TRADES, self.trade)
+
+		self.assertEqual(consumer.pending(), 10)
+		messages = consumer.poll()
+		self.assertEqual([trade['id'] for channel, trade in messages], [7, 8, 9, 10], msg='Only the last capacity messages can be read')
+		self.assertEqual(consumer.lapped, 6)
+		consumer.close()
+
+	def test_from_start(self):
+		self.publisher.publish(bitstamp.WS_CHANNEL_LIVE_TRADES, self.trade)
+		self.assertEqual(len(ring.RingBufferConsumer(self.name, from_start=True).poll()), 1)
+		self.assertEqual(len(ring.RingBufferConsumer(self.name).poll()), 0)
+
+	def test_consumer_process_exit(self):
+		self.publisher.publish(bitstamp.WS_CHANNEL_LIVE_TRADES, self.trade)
+		script = 'from bitstamp import ring; print(len(ring.RingBufferConsumer({!r}, from_start=True).poll()))'.format(self.name)
+		root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+		output = subprocess.check_output([sys.executable, '-c', script], cwd=root)
+		self.assertEqual(output.strip(), b'1')
+		consumer = ring.RingBufferConsumer(self.name, from_start=True)
+		self.assertEqual(len(consumer.poll()), 1, msg='The ring should outlive a consumer process')
+		consumer.close()
+
+	def test_message_too_large(self):
+		self.diff['bids'] = [['605.12', '1.00000000']] * 100
+		self.assertRaises(Exception, lambda: self.publisher.publish(bitstamp.WS_CHANNEL_ORDER_BOOK_DIFF, self.diff), msg='Messages larger than a slot should be rejected')
+
+	def tearDown(self):
+		self.publisher.close()
+		self.publisher.unlink()
+
+
+class TestSnapshotCache(unittest.TestCase):
+	def setUp(self):
+		self.api_key = 'some api key'
+		self.secret = 'some secret'
+		self.customer_id = 'some customer id'
+		self.path = os.path.abspath('snapshot_cache.bin')
+		self.writer = snapshot.SnapshotCache(self.path, slot_size=4096, writer=True)
+		self.reader = snapshot.SnapshotCache(self.path, slot_size=4096)
+		self.ticker = {'timestamp': '1475100000', 'high': '610.00', 'ask': '605.20', 'last': '605.12', 'low': '600.00', 'open': 601.0, 'bid': '605.12', 'volume': '1234.50000000', 'vwap': '604.50'}
+
+	def test_empty(self):
+		self.assertIsNone(self.reader.ticker(bitstamp.BTC_USD), msg='Nothing was written yet')
+
+	def test_versions(self):
+		self.assertEqual(self.writer.write(snapshot.ticker_key(bitstamp.BTC_USD), self.ticker), 1)
+		self.assertEqual(self.writer.write(snapshot.ticker_key(bitstamp.BTC_USD), self.ticker), 2)
+
+		blob, version, written_at = self.reader.read(snapshot.ticker_key(bitstamp.BTC_USD))
+		self.assertEqual(blob, self.ticker)
+		self.assertEqual(version, 2)
+
+	def test_stale(self):
+		self.writer.write(snapshot.KEY_EUR_USD, {'sell': '1.1000', 'buy': '1.1100'})
+		self.assertIsNotNone(self.reader.eur_usd(max_age=60))
+		self.assertIsNone(self.reader.eur_usd(max_age=-1), msg='Snapshots older than max age should be ignored')
+
+	def test_writing_in_progress(self):
+		key = snapshot.order_book_key(bitstamp.BTC_USD)
+		self.writer.write(key, {'timestamp': '1', 'bids': [], 'asks': []})
+		# Simulate a writer that died in the middle of a write, leaving the sequence odd
+		struct.pack_into('<Q', self.writer.map, self.writer.slots[key], 3)
+		self.assertIsNone(self.reader.read(key), msg='Slots that are being written should not be read')
+
+	def test_cached_ticker(self):
+		self.writer.write(snapshot.ticker_key(bitstamp.BTC_USD), self.ticker)
+		api = bitstamp.Bitstamp(api_key=self.api_key, secret=self.secret, customer_id=self.customer_id, snapshot_cache=self.reader)
+
+		self.assertEqual(api.ticker(), self.ticker, msg='Ticker should be read from the cache')
+		self.assertEqual(api.ticker(parsed=True)['bid'], 605.12, msg='Cached ticker should be parsed like a live one')
+
+	def test_too_large(self):
+		self.assertRaises(Exception, lambda: self.writer.write(snapshot.KEY_EUR_USD, {'rate': 'x' * 5000}), msg='Snapshots larger than a slot should be rejected')
+
+	def test_reader_cannot_write(self):
+		self.assertRaises(Exception, lambda: self.reader.write(snapshot.KEY_EUR_USD, {}), msg='Only the writer can write')
+
+	def test_writer_restart(self):
+		self.writer.write(snapshot.ticker_key(bitstamp.BTC_USD), self.ticker)
+		self.assertIsNotNone(self.reader.ticker(bitstamp.BTC_USD))
+		struct.pack_into('<Q', self.writer.map, self.writer.slots[snapshot.KEY_EUR_USD], 5)
+		self.writer.close()
+
+		self.writer = snapshot.SnapshotCache(self.path, slot_size=4096, writer=True)
+		self.assertEqual(self.reader.ticker(bitstamp.BTC_USD), self.ticker, msg='A restarted writer should not wipe the file readers have mapped')
+		self.assertEqual(self.writer.write(snapshot.KEY_EUR_USD, {}), 1, msg='A slot left half written should be emptied')
+		self.assertEqual(self.reader.eur_usd(), {})
+
+	def test_refresher_survives_errors(self):
+		api = bitstamp.Bitstamp(api_key=self.api_key, secret=self.secret, customer_id=self.customer_id)
+		calls = []
+
+		def failing_eur_usd():
+			calls.append('eur_usd')
+			if len(calls) == 1:
+				raise Exception('Connection reset')
+			return {'sell': '1.1000', 'buy': '1.1100'}
+
+		api.eur_usd = failing_eur_usd
+		api.ticker = lambda currency: self.ticker
+		api.order_book = lambda currency: {'error': 'Service unavailable'}
+		refresher = snapshot.SnapshotRefresher(api, self.writer, interval=0)
+
+		self.assertEqual(refresher.refresh(), 4, msg='Failing calls should not stop the other snapshots')
+		self.assertEqual(refresher.errors, 1)
+		self.assertEqual(self.reader.ticker(bitstamp.BTC_EUR), self.ticker)
+
+		api.order_book = lambda currency: refresher.stop() or {'timestamp': '1', 'bids': [], 'asks': []}
+		refresher.run()
+		self.assertEqual(self.reader.eur_usd(), {'sell': '1.1000', 'buy': '1.1100'})
+
+	def test_refresher_snapshot_too_large(self):
+		api = bitstamp.Bitstamp(api_key=self.api_key, secret=self.secret, customer_id=self.customer_id)
+		book = {'timestamp': '1', 'bids': [['605.12', '1.00000000']] * 400, 'asks': []}
+		self.assertGreater(len(json.dumps(book)), 10000)
+
+		api.eur_usd = lambda: {'sell': '1.1000', 'buy': '1.1100'}
+		api.ticker = lambda currency: self.ticker
+		api.order_book = lambda currency: book
+		writer = snapshot.SnapshotCache(self.path + '.small', slot_size=1024, writer=True)
+		reader = snapshot.SnapshotCache(self.path + '.small', slot_size=1024)
+		try:
+			refresher = snapshot.SnapshotRefresher(api, writer, interval=0)
+
+			self.assertEqual(refresher.refresh(), len(writer.pairs), msg='Only the order books should fail')
+			self.assertEqual(refresher.errors, len(writer.pairs), msg='Snapshots that don\'t fit should count as errors')
+			self.assertIsNotNone(refresher.last_error)
+			self.assertEqual(reader.ticker(bitstamp.BTC_EUR), self.ticker, msg='The other snapshots should still be written')
+			self.assertEqual(reader.eur_usd(), {'sell': '1.1000', 'buy': '1.1100'})
+		finally:
+			reader.close()
+			writer.close()
+			os.remove(self.path + '.small')
+
+	def test_mismatched_layout(self):
+		self.writer.write(snapshot.KEY_EUR_USD, {})
+		other = snapshot.SnapshotCache(self.path, pairs=[bitstamp.BTC_USD], slot_size=4096)
+		self.assertRaises(Exception, lambda: other.eur_usd(), msg='Caches with different layouts should not be mixed')
+
+	def tearDown(self):
+		self.reader.close()
+		self.writer.close()
+		os.remove(self.path)
+
+
+class TestOrderBookDiffer(unittest.TestCase):
+	def setUp(self):
+		self.differ = orderbook.OrderBookDiffer()
+		self.first = {
+			'timestamp': '1475100000',
+			'bids': [['605.12', '1.00000000'], ['605.00', '2.00000000'], ['604.50', '0.50000000']],
+			'asks': [['605.20', '0.30000000'], ['605.50', '1.00000000']],
+		}
+		self.second = {
+			'timestamp': '1475100005',
+			'bids': [['605.15', '0.10000000'], ['605.12', '1.00000000'], ['604.50', '0.70000000']],
+			'asks': [['605.50', '1.00000000'], ['606.00', '3.00000000']],
+		}
+
+	def test_first_snapshot(self):
+		diff = self.differ.update(self.first)
+		self.assertEqual(diff['bids'], self.first['bids'], msg='First snapshot should add every level')
+		self.assertEqual(diff['asks'], self.first['asks'], msg='First snapshot should add every level')
+		self.assertEqual(self.differ.changes(), 5)
+
+	def test_diff(self):
+		self.differ.update(self.first)
+		diff = self.differ.update(self.second)
+
+		self.assertEqual(diff['timestamp'], '1475100005')
+		self.assertEqual(diff['bids'], [['605.15', '0.10000000'], ['605.00', '0'], ['604.50', '0.70000000']])
+		self.assertEqual(diff['asks'], [['605.20', '0'], ['606.00', '3.00000000']])
+		self.assertEqual(self.differ.last_counts['bids'], {'added': 1, 'removed': 1, 'changed': 1})
+		self.assertEqual(self.differ.last_counts['asks'], {'added': 1, 'removed': 1, 'changed': 0})
+		self.assertEqual(self.differ.changes(), 5)
+
+	def test_no_change(self):
+		self.differ.update(self.first)
+		diff = self.differ.update(self.first)
+		self.assertEqual(diff['bids'], [])
+		self.assertEqual(diff['asks'], [])
+		self.assertEqual(self.differ.changes(), 0)
+
+	def test_error_response(self):
+		self.assertRaises(Exception, lambda: self.differ.update({'error': 'Invalid currency pair'}), msg='Errors are not order books')
+
+	def tearDown(self):
+		pass
+
+
+class FakeTransactionsApi(object):
+	def __init__(self):
+		self.responses = []
+		self.timespans = []
+
+	def transactions(self, currency, timespan):
+		self.timespans.append(timespan)
+		response = self.responses.pop(0)
+		if isinstance(response, Exception):
+			raise response
+		return response
+
+
+class TestTradeCollector(unittest.TestCase):
+	def setUp(self):
+		self.api = FakeTransactionsApi()
+		self.trades = []
+		self.gaps = []
+		self.collector = collector.TradeCollector(self.api, self.trades.append, index_size=3, gap_callback=lambda *args: self.gaps.append(args))
+
+	@staticmethod
+	def trade(trade_id):
+		return {'date': str(1475100000 + trade_id), 'tid': trade_id, 'price': '605.12', 'type': 0, 'amount': '0.10000000'}
+
+	def test_overlapping_polls(self):
+		# The API returns the newest trades first
+		self.api.responses.append([self.trade(2), self.trade(1)])
+		self.api.responses.append([self.trade(4), self.trade(3), self.trade(2)])
+
+		self.assertEqual(self.collector.poll(now=1000), 2)
+		self.assertEqual(self.collector.poll(now=1010), 2)
+		self.assertEqual([trade['tid'] for trade in self.trades], [1, 2, 3, 4], msg='Trades should be written once and in order')
+		self.assertEqual(self.api.timespans, ['minute', 'minute'])
+
+	def test_bounded_index(self):
+		self.api.responses.append([self.trade(trade_id) for trade_id in range(10, 0, -1)])
+		self.api.responses.append([self.trade(trade_id) for trade_id in range(11, 0, -1)])
+
+		self.collector.poll(now=1000)
+		self.assertEqual(self.collector.poll(now=1010), 1, msg='Trades older than the index should not be written again')
+		self.assertEqual(len(self.collector.seen), 3, msg='Index should not grow beyond its size')
+		self.assertEqual(len(self.trades), 11)
+
+	def test_falling_behind(self):
+		self.api.responses.extend([[self.trade(1)], [self.trade(2)], [self.trade(3)]])
+
+		self.collector.poll(now=1000)
+		self.collector.poll(now=1100)
+		self.assertEqual(self.api.timespans, ['minute', 'hour'], msg='Late polls should use the hour window')
+		self.assertEqual(self.gaps, [])
+
+		self.collector.poll(now=10000)
+		self.assertEqual(self.gaps, [(1475100002, 10000)], msg='Polls later than an hour should report a gap')
+
+	def test_gap_reported_once(self):
+		self.api.responses.extend([[self.trade(1)], {'error': 'Service unavailable'}, ValueError('No JSON object could be decoded'), [self.trade(2)], [self.trade(3)]])
+
+		self.collector.poll(now=1000)
+		self.assertRaises(Exception, lambda: self.collector.poll(now=10000))
+		self.assertRaises(Exception, lambda: self.collector.poll(now=10010))
+		self.collector.poll(now=10020)
+		self.assertEqual(self.gaps, [(1475100001, 10000)], msg='Failed polls should not report the same gap again')
+		self.assertEqual(self.collector.gaps, 1)
+
+		self.collector.poll(now=20000)
+		self.assertEqual(self.collector.gaps, 2, msg='A new gap after a good poll should be reported')
+
+	def test_error_response(self):
+		self.api.responses.append({'error': 'Invalid currency pair'})
+		self.assertRaises(Exception, lambda: self.collector.poll(), msg='Error responses should not be taken for trades')
+
+	def test_run_survives_errors(self):
+		self.collector = collector.TradeCollector(self.api, self.trades.append, interval=0)
+		self.api.responses.append([self.trade(1)])
+		self.api.responses.append(ValueError('No JSON object could be decoded'))
+		self.api.responses.append({'error': 'Service unavailable'})
+		self.api.responses.append([self.trade(2), self.trade(1)])
+		self.collector.sink = lambda trade: self.trades.append(trade) or (trade['tid'] == 2 and self.collector.stop())
+
+		self.collector.run()
+		self.assertEqual(self.collector.errors, 2)
+		self.assertEqual([trade['tid'] for trade in self.trades], [1, 2], msg='The collector should recover after failed polls')
+
+	def test_interval(self):
+		self.assertRaises(Exception, lambda: collector.TradeCollector(self.api, self.trades.append, interval=60), msg='Polls a minute apart can miss trades')
+
+	def tearDown(self):
+		pass
+
+
+class FakeConnection(object):
+	def __init__(self):
+		self.sent = []
+		self.incoming = asyncio.Queue()
+		self.closed = False
+
+	async def send(self, message):
+		self.sent.append(json.loads(message))
+
+	async def close(self):
+		self.closed = True
+
+	def push(self, channel, data, event='trade'):
+		self.incoming.put_nowait(json.dumps({'event': event, 'channel': channel, 'data': json.dumps(data)}))
+
+	def __aiter__(self):
+		return self
+
+	async def __anext__(self):
+		message = await self.incoming.get()
+		if message is None:
+			raise StopAsyncIteration
+		return message
+
+
+class TestAsyncStreams(unittest.TestCase):
+	def setUp(self):
+		self.connections = []
+
+	async def connect(self, url):
+		connection = FakeConnection()
+		self.connections.append(connection)
+		return connection
+
+	def test_pusher_channel(self):
+		self.assertEqual(asyncws.pusher_channel(bitstamp.WS_CHANNEL_LIVE_TRADES), 'live_trades')
+		self.assertEqual(asyncws.pusher_channel(bitstamp.WS_CHANNEL_LIVE_TRADES, bitstamp.BTC_USD), 'live_trades')
+		self.assertEqual(asyncws.pusher_channel(bitstamp.WS_CHANNEL_ORDER_BOOK_DIFF, bitstamp.BTC_EUR), 'diff_order_book_btceur')
+		self.assertRaises(Exception, lambda: asyncws.pusher_channel('not-a-channel'), msg='Unknown channels should raise')
+
+	def test_shared_connection(self):
+		async def scenario():
+			client = asyncws.AsyncStreamClient('ws://test', connect=self.connect)
+			trades = client.stream(bitstamp.WS_CHANNEL_LIVE_TRADES)
+			book = client.stream(bitstamp.WS_CHANNEL_ORDER_BOOK, pair=bitstamp.BTC_EUR)
+
+			first = asyncio.ensure_future(trades.__anext__())
+			second = asyncio.ensure_future(book.__anext__())
+			await asyncio.sleep(0)
+			connection = self.connections[0]
+			connection.push('live_trades', {'id': 1, 'price': 605.12})
+			connection.push('order_book_btceur', {'bids': [], 'asks': []}, event='data')
+
+			self.assertEqual(await first, {'id': 1, 'price': 605.12})
+			self.assertEqual(await second, {'bids': [], 'asks': []})
+			self.assertEqual(len(self.connections), 1, msg='Streams should share the connection')
+
+			await book.aclose()
+			self.assertEqual(connection.sent[-1], {'event': 'pusher:unsubscribe', 'data': {'channel': 'order_book_btceur'}})
+			self.assertFalse(connection.closed)
+
+			await trades.aclose()
+			self.assertTrue(connection.closed, msg='Connection should be closed with the last stream')
+
+		asyncio.run(scenario())
+
+	def test_cancellation(self):
+		async def scenario():
+			client = asyncws.AsyncStreamClient('ws://test', connect=self.connect)
+
+			async def consume():
+				async for trade in client.stream(bitstamp.WS_CHANNEL_LIVE_TRADES):
+					pass
+
+			task = asyncio.ensure_future(consume())
+			await asyncio.sleep(0)
+			task.cancel()
+			with self.assertRaises(asyncio.CancelledError):
+				await task
+			self.assertTrue(self.connections[0].closed, msg='Cancelled stream should unsubscribe')
+			self.assertEqual(client.subscriptions, {})
+
+		asyncio.run(scenario())
+
+	def test_bounded_buffer(self):
+		async def scenario():
+			client = asyncws.AsyncStreamClient('ws://test', connect=self.connect)
+			trades = client.stream(bitstamp.WS_CHANNEL_LIVE_TRADES, maxsize=2)
+			first = asyncio.ensure_future(trades.__anext__())
+			await asyncio.sleep(0)
+			connection = self.connections[0]
+			connection.push('live_trades', {'id': 0})
+			self.assertEqual(await first, {'id': 0})
+
+			for trade_id in range(1, 5):
+				connection.push('live_trades', {'id': trade_id})
+			await asyncio.sleep(0.01)
+
+			self.assertEqual(await trades.__anext__(), {'id': 3}, msg='Oldest messages should be dropped')
+			self.assertEqual(await trades.__anext__(), {'id': 4})
+			await trades.aclose()
+
+		asyncio.run(scenario())
+
+	def test_connection_closed(self):
+		async def scenario():
+			client = asyncws.AsyncStreamClient('ws://test', connect=self.connect)
+			trades = client.stream(bitstamp.WS_CHANNEL_LIVE_TRADES)
+			first = asyncio.ensure_future(trades.__anext__())
+			await asyncio.sleep(0)
+			self.connections[0].incoming.put_nowait(None)
+
+			with self.assertRaises(Exception):
+				await first
+
+		asyncio.run(scenario())
+
+	def tearDown(self):
+		pass
+
+
+class TestPortfolio(unittest.TestCase):
+	def setUp(self):
+		self.portfolio = portfolio.Portfolio({'usd_balance': '1000.00', 'eur_balance': '500.00', 'btc_balance': '2.00000000'})
+		self.valuations = []
+		self.portfolio.subscribe(self.valuations.append)
+
+	def test_incomplete(self):
+		self.assertFalse(self.portfolio.complete(), msg='BTC and EUR rates are not known yet')
+		self.assertEqual(self.portfolio.valuation()['usd'], 1000)
+		self.assertIsNone(self.portfolio.valuation()['eur'])
+
+	def test_revaluation(self):
+		self.portfolio.trade_callback(bitstamp.BTC_USD)({'id': 1, 'price': 600.0, 'amount': 0.1})
+		self.portfolio.update_eur_usd({'buy': '1.2100', 'sell': '1.1900'})
+
+		valuation = self.valuations[-1]
+		self.assertTrue(valuation['complete'])
+		self.assertAlmostEqual(valuation['usd'], 1000 + 2 * 600 + 500 * 1.2)
+		self.assertAlmostEqual(valuation['eur'], (1000 + 2 * 600 + 500 * 1.2) / 1.2)
+
+		self.portfolio.update_ticker({'last': '610.00'}, bitstamp.BTC_USD)
+		self.assertAlmostEqual(self.valuations[-1]['usd'], 1000 + 2 * 610 + 500 * 1.2)
+
+	def test_user_transaction(self):
+		self.portfolio.set_rate('btc', 600.0)
+		transaction = {'id': 7, 'type': '2', 'usd': '-60.00', 'btc': '0.10000000', 'eur': '0.00', 'fee': '0.15', 'btc_usd': '600.00'}
+
+		self.assertTrue(self.portfolio.apply_user_transaction(transaction))
+		self.assertFalse(self.portfolio.apply_user_transaction(transaction), msg='Transactions should be applied once')
+		self.assertAlmostEqual(self.portfolio.holdings['usd'], 1000 - 60 - 0.15)
+		self.assertAlmostEqual(self.portfolio.holdings['btc'], 2.1)
+		self.assertAlmostEqual(self.portfolio.usd_value, 1000 - 0.15 + 2 * 600)
+
+	def test_bounded_index(self):
+		self.portfolio = portfolio.Portfolio({'usd_balance': '1000.00'}, index_size=3)
+		for transaction_id in [5, 3, 4, 6, 8, 7]:
+			self.assertTrue(self.portfolio.apply_user_transaction({'id': transaction_id, 'usd': '1.00'}))
+
+		self.assertEqual(len(self.portfolio.applied_transactions), 3, msg='Index should not grow beyond its size')
+		for transaction_id in range(3, 9):
+			self.assertFalse(self.portfolio.apply_user_transaction({'id': transaction_id, 'usd': '1.00'}), msg='Transactions should be applied once')
+		self.assertTrue(self.portfolio.apply_user_transaction({'id': 9, 'usd': '1.00'}))
+		self.assertAlmostEqual(self.portfolio.holdings['usd'], 1007)
+
+	def test_fill(self):
+		self.portfolio.set_rate('btc', 600.0)
+		self.portfolio.apply_fill(bitstamp.BTC_USD, 'sell', 1.0, 610.0, fee=1.5)
+		self.assertAlmostEqual(self.portfolio.holdings['btc'], 1.0)
+		self.assertAlmostEqual(self.portfolio.holdings['usd'], 1000 + 610 - 1.5)
+		self.assertRaises(Exception, lambda: self.portfolio.apply_fill(bitstamp.BTC_USD, 'hold', 1.0, 610.0), msg='Side has to be buy or sell')
+
+	def test_error_balance(self):
+		self.assertRaises(Exception, lambda: portfolio.Portfolio({'error': 'Invalid nonce'}), msg='Errors are not balances')
+
+	def tearDown(self):
+		pass
+
+
+class TestSoakHarness(unittest.TestCase):
+	def setUp(self):
+		self.api_key = 'some api key'
+		self.secret = 'some secret'
+		self.customer_id = 'some customer id'
+		self.working_api = bitstamp.Bitstamp(api_key=self.api_key, secret=self.secret, customer_id=self.customer_id)
+		self.received = []
+
+	def test_histogram(self):
+		latencies = histogram.LatencyHistogram()
+		for nanoseconds in range(1, 10001):
+			latencies.record(nanoseconds * 1000)
+
+		self.assertAlmostEqual(latencies.percentile(50), 5000000, delta=5000000 / 16.0)
+		self.assertAlmostEqual(latencies.percentile(99), 9900000, delta=9900000 / 16.0)
+		self.assertEqual(latencies.percentile(100), 10000000)
+		self.assertEqual(histogram.LatencyHistogram().percentile(50), 0)
+
+	def test_synthetic_frames(self):
+		frames = soak.synthetic_frames(bitstamp.WS_CHANNEL_LIVE_TRADES, seed=1)
+		handler = self.working_api.message_handler(self.received.append)
+		for _ in range(10):
+			handler(None, next(frames))
+
+		self.assertEqual([trade['id'] for trade in self.received], list(range(1, 11)))
+
+	def test_run(self):
+		frames = soak.synthetic_frames(bitstamp.WS_CHANNEL_ORDER_BOOK_DIFF, seed=1)
+		harness = soak.SoakHarness(self.working_api, self.received.append, frames, duration=0.2, snapshot_interval=0.05, profile=True)
+		report = harness.run()
+
+		self.assertGreater(report['messages'], 0)
+		self.assertEqual(report['messages'], len(self.received), msg='Every frame should reach the callback')
+		self.assertEqual(report['errors'], 0)
+		self.assertIsNotNone(report['memory_growth_per_million'])
+		self.assertGreater(report['latency_us']['p99'], 0)
+
+	def test_rate(self):
+		frames = soak.synthetic_frames(seed=1)
+		report = soak.SoakHarness(self.working_api, self.received.append, frames, rate=200, duration=0.25, trace_memory=False).run()
+		self.assertLess(report['messages'], 100, msg='Rate should limit the number of messages')
+		self.assertIsNone(report['memory_growth_per_million'])
+
+	def test_callback_errors(self):
+		def failing(data):
+			raise ValueError('broken consumer')
+
+		report = soak.SoakHarness(self.working_api, failing, soak.synthetic_frames(seed=1), duration=0.05, trace_memory=False).run()
+		self.assertEqual(report['errors'], report['messages'], msg='Callback errors should be counted')
+
+	def tearDown(self):
+		pass
+
+
+class TestCrossRateMonitor(unittest.TestCase):
+	def setUp(self):
+		self.monitor = triangle.CrossRateMonitor()
+		self.fired = []
+
+	def seed(self):
+		self.monitor.update(bitstamp.BTC_USD, 600.0, 601.0)
+		self.monitor.update(bitstamp.BTC_EUR, 500.0, 501.0)
+		return self.monitor.update_eur_usd({'sell': '1.1900', 'buy': '1.2100'})
+
+	def test_incomplete(self):
+		self.assertFalse(self.monitor.update(bitstamp.BTC_USD, 600.0, 601.0), msg='Nothing to compute before all legs are known')
+		self.assertIsNone(self.monitor.forward_edge)
+
+	def test_edges(self):
+		self.assertTrue(self.seed())
+		self.assertAlmostEqual(self.monitor.implied_eur_usd, 1201.0 / 1001.0)
+		self.assertAlmostEqual(self.monitor.forward_edge, 500.0 * 1.19 / 601.0 - 1)
+		self.assertAlmostEqual(self.monitor.reverse_edge, 600.0 / (1.21 * 501.0) - 1)
+
+	def test_unchanged_top(self):
+		self.seed()
+		self.assertFalse(self.monitor.order_book_callback(bitstamp.BTC_USD)({'bids': [['600.00', '1.0']], 'asks': [['601.00', '2.0']]}), msg='Same top of book should not recompute')
+		self.assertEqual(self.monitor.recomputations, 1)
+
+	def test_threshold(self):
+		self.seed()
+		self.monitor.add_threshold(0.01, self.fired.append)
+		# Cheap BTC in USD opens the forward edge
+		self.monitor.update(bitstamp.BTC_USD, 580.0, 581.0)
+		self.monitor.update(bitstamp.BTC_USD, 579.0, 580.0)
+		self.assertEqual(len(self.fired), 1, msg='Threshold should fire once per crossing')
+		self.assertGreater(self.fired[0]['forward_edge'], 0.01)
+
+		self.monitor.update(bitstamp.BTC_USD, 600.0, 601.0)
+		self.monitor.update(bitstamp.BTC_USD, 580.0, 581.0)
+		self.assertEqual(len(self.fired), 2, msg='Threshold should be armed again after the edge fell below it')
+
+	def test_fee(self):
+		monitor = triangle.CrossRateMonitor(fee=0.0025)
+		monitor.update(bitstamp.BTC_USD, 600.0, 601.0)
+		monitor.update(bitstamp.BTC_EUR, 500.0, 501.0)
+		monitor.update(bitstamp.EUR_USD, 1.19, 1.21)
+		self.assertAlmostEqual(monitor.forward_edge, 500.0 * 1.19 / 601.0 * 0.9975 ** 3 - 1)
+
+	def tearDown(self):
+		pass
+
+
+class FakeSession(object):
+	def __init__(self, delay=0):
+		self.delay = delay
+		self.calls = []
+		self.lock = threading.Lock()
+		self.in_flight = 0
+		self.max_in_flight = 0
+
+	def post(self, url, data=None, stream=False):
+		with self.lock:
+			self.calls.append((url, data))
+			self.in_flight += 1
+			self.max_in_flight = max(self.max_in_flight, self.in_flight)
+		time.sleep(self.delay)
+		with self.lock:
+			self.in_flight -= 1
+		if data['key'] == 'failing key':
+			raise Exception('Connection refused')
+		return FakeResponse({'usd_balance': '1.00', 'key': data['key']})
+
+	def get(self, url, params=None, stream=False):
+		return self.post(url, params, stream)
+
+	def close(self):
+		pass
+
+
+class TestMultiAccountExecutor(unittest.TestCase):
+	def setUp(self):
+		self.session = FakeSession(delay=0.05)
+		self.accounts = {
+			'account {}'.format(index): {'api_key': 'key {}'.format(index), 'secret': 'secret', 'customer_id': str(index)}
+			for index in range(8)
+		}
+		self.executor = accounts.MultiAccountExecutor(self.accounts, max_workers=8, session=self.session)
+
+	def test_shared_session(self):
+		for client in self.executor.clients.values():
+			self.assertIs(client.http, self.session)
+
+	def test_instances(self):
+		own = FakeSession()
+		instances = {
+			'default': bitstamp.Bitstamp(api_key='key 4', secret='secret', customer_id='4'),
+			'own session': bitstamp.Bitstamp(api_key='key 5', secret='secret', customer_id='5', session=own),
+		}
+		executor = accounts.MultiAccountExecutor(instances, session=self.session)
+
+		self.assertIs(executor.clients['default'].http, self.session, msg='Instances without a session should share the pool')
+		self.assertIs(executor.clients['own session'].http, own, msg='Instances with their own session should keep it')
+		executor.executor.shutdown()
+
+	def test_run_concurrently(self):
+		started = time.time()
+		results = self.executor.run('balance')
+		self.assertLess(time.time() - started, 8 * 0.05, msg='Accounts should be called concurrently')
+		self.assertGreater(self.session.max_in_flight, 1)
+		self.assertEqual(sorted(results), sorted(self.accounts))
+		for name, result in results.items():
+			self.assertIsNone(result['error'])
+			self.assertEqual(result['result']['key'], self.accounts[name]['api_key'])
+			self.assertGreater(result['elapsed'], 0)
+
+	def test_failures_kept_separate(self):
+		self.executor.clients['account 3'] = bitstamp.Bitstamp(api_key='failing key', secret='secret', customer_id='3', session=self.session)
+		results = self.executor.run('balance')
+		self.assertIsNotNone(results['account 3']['error'])
+		self.assertIsNone(results['account 3']['result'])
+		self.assertIsNone(results['account 4']['error'])
+
+	def test_account_calls_do_not_overlap(self):
+		for _ in range(3):
+			self.executor.run('balance')
+		for name in self.accounts:
+			nonces = [int(data['nonce']) for url, data in self.session.calls if data['key'] == self.accounts[name]['api_key']]
+			self.assertEqual(nonces, sorted(set(nonces)), msg='Nonces of an account should reach the API in order')
+
+	def test_unknown_method(self):
+		self.assertRaises(Exception, self.executor.run, 'no_such_method')
+
+	def test_rate_limiter(self):
+		limiter = accounts.RateLimiter(100, burst=1)
+		started = time.time()
+		for _ in range(6):
+			limiter.wait()
+		self.assertGreaterEqual(time.time() - started, 0.045)
+
+	def tearDown(self):
+		self.executor.close()
+
+
+class FakeExchange(object):
+	fixed_point = False
+
+	def __init__(self):
+		self.orders = {}
+		self.fills = {}
+		# Accepted orders not on the book yet, order_status reports them In Queue
+		self.queued = set()
+		self.calls = []
+		self.next_id = 0
+
+	def fill(self, order_id, amount):
+		order = self.orders[order_id]
+		order['amount'] = round(order['amount'] - amount, 8)
+		self.fills[order_id] = self.fills.get(order_id, 0) + amount
+		if order['amount'] <= 0:
+			del self.orders[order_id]
+
+	def place(self, side, amount, price):
+		self.calls.append((side, amount, price))
+		self.next_id += 1
+		self.orders[str(self.next_id)] = {'id': self.next_id, 'amount': amount, 'price': price}
+		return {'id': self.next_id, 'amount': str(amount), 'price': str(price)}
+
+	def buy_limit_order(self, amount, price, currency=bitstamp.BTC_USD, limit_price=None):
+		return self.place('buy', amount, price)
+
+	def sell_limit_order(self, amount, price, currency=bitstamp.BTC_USD, limit_price=None):
+		return self.place('sell', amount, price)
+
+	def cancel_order(self, order_id):
+		self.calls.append(('cancel', order_id))
+		if order_id not in self.orders:
+			return {'error': 'Order not found'}
+		del self.orders[order_id]
+		# Like the real cancel_order/ endpoint
+		return True
+
+	def open_orders(self, currency=None):
+		self.calls.append(('open_orders',))
+		return [{'id': order['id'], 'amount': '{:.8f}'.format(order['amount'])} for order_id, order in self.orders.items() if order_id not in self.queued]
+
+	def order_status(self, order_id):
+		self.calls.append(('order_status', order_id))
+		if order_id in self.queued:
+			status = 'In Queue'
+		elif order_id in self.orders:
+			status = 'Open'
+		else:
+			status = 'Finished'
+		return {'status': status, 'transactions': [{'btc': '{:.8f}'.format(self.fills.get(order_id, 0)), 'price': '600.00'}]}
+
+	def placed(self):
+		return [call for call in self.calls if call[0] in ['buy', 'sell']]
+
+
+class TestExecutionScheduler(unittest.TestCase):
+	def setUp(self):
+		self.exchange = FakeExchange()
+		self.scheduler = execution.ExecutionScheduler(self.exchange, request_burst=100)
+
+	def test_twap_slices(self):
+		parent = self.scheduler.add(execution.ParentOrder(bitstamp.ORDER_SIDE_BUY, 1.0, 600.0, duration=40, slices=4), now=0)
+		self.scheduler.poll(now=0)
+		self.assertEqual(self.exchange.placed(), [('buy', 0.25, 600.0)])
+		self.scheduler.poll(now=5)
+		self.assertEqual(len(self.exchange.placed()), 1, msg='The next slice should wait for its time')
+
+		self.exchange.fill('1', 0.25)
+		self.scheduler.poll(now=10)
+		self.assertEqual(parent.filled, 0.25)
+		self.assertEqual(self.exchange.placed()[-1], ('buy', 0.25, 600.0))
+
+		self.scheduler.poll(now=30)
+		self.assertEqual(self.exchange.placed()[-1], ('buy', 0.5, 600.0), msg='Slices released meanwhile should be placed at once')
+
+		self.exchange.fill('2', 0.25)
+		self.exchange.fill('3', 0.5)
+		self.assertEqual(self.scheduler.poll(now=40), 0)
+		self.assertEqual(parent.state, execution.PARENT_DONE)
+		self.assertAlmostEqual(parent.filled, 1.0)
+
+	def test_iceberg(self):
+		parent = self.scheduler.add(execution.ParentOrder(bitstamp.ORDER_SIDE_SELL, 1.0, 600.0, display_size=0.2), now=0)
+		self.scheduler.poll(now=0)
+		self.exchange.fill('1', 0.1)
+		self.scheduler.poll(now=1)
+		self.assertEqual(len(self.exchange.placed()), 1, msg='No new child while one is on the book')
+		self.assertAlmostEqual(parent.filled, 0.1)
+
+		self.exchange.fill('1', 0.1)
+		self.scheduler.poll(now=2)
+		self.assertEqual(self.exchange.placed()[-1], ('sell', 0.2, 600.0))
+		self.assertAlmostEqual(parent.filled, 0.2)
+
+	def test_stale_child_replaced(self):
+		prices = [600.0]
+		parent = self.scheduler.add(execution.ParentOrder(bitstamp.ORDER_SIDE_BUY, 0.5, lambda now: prices[-1], max_child_age=10, limit_price=605.0), now=0)
+		self.scheduler.poll(now=0)
+		self.exchange.fill('1', 0.1)
+		self.scheduler.poll(now=11)
+		self.assertEqual(len(self.exchange.placed()), 1, msg='A child at the current price should be left alone')
+
+		prices.append(610.0)
+		self.scheduler.poll(now=22)
+		self.assertIn(('cancel', '1'), self.exchange.calls)
+		self.assertEqual(self.exchange.placed()[-1], ('buy', 0.4, 605.0), msg='Remaining amount should be replaced at the capped price')
+		self.assertAlmostEqual(parent.filled, 0.1)
+
+	def test_parents_share_budget(self):
+		self.scheduler = execution.ExecutionScheduler(self.exchange, requests_per_second=0.001, request_burst=1)
+		parents = [self.scheduler.add(execution.ParentOrder(bitstamp.ORDER_SIDE_BUY, 0.1, 600.0), now=0) for _ in range(2)]
+		self.scheduler.poll(now=0)
+		self.assertEqual(self.scheduler.requests, 1)
+		self.assertEqual(len(self.exchange.placed()), 1, msg='Work beyond the budget should wait for later polls')
+		self.assertEqual(len(parents[0].children), 1)
+
+	def test_cancel_parent(self):
+		parent = self.scheduler.add(execution.ParentOrder(bitstamp.ORDER_SIDE_BUY, 1.0, 600.0, duration=40, slices=4), now=0)
+		self.scheduler.poll(now=0)
+		self.exchange.fill('1', 0.05)
+		parent.cancel()
+		self.scheduler.poll(now=1)
+		self.assertEqual(parent.state, execution.PARENT_CANCELLED)
+		self.assertAlmostEqual(parent.filled, 0.05)
+		self.assertEqual(self.exchange.orders, {})
+
+	def test_filled_child_resolved_with_order_status(self):
+		parent = self.scheduler.add(execution.ParentOrder(bitstamp.ORDER_SIDE_BUY, 0.5, 600.0, display_size=0.25), now=0)
+		self.scheduler.poll(now=0)
+		self.exchange.fill('1', 0.25)
+		self.scheduler.poll(now=1)
+		self.assertIn(('order_status', '1'), self.exchange.calls)
+		self.assertAlmostEqual(parent.filled, 0.25)
+
+	def test_queued_child_keeps_its_amount(self):
+		parent = self.scheduler.add(execution.ParentOrder(bitstamp.ORDER_SIDE_BUY, 0.5, 600.0, display_size=0.25), now=0)
+		self.scheduler.poll(now=0)
+		self.exchange.queued.add('1')
+		self.scheduler.poll(now=1)
+		self.assertEqual(parent.children[0].state, execution.CHILD_WORKING, msg='A child In Queue may still be filled')
+		self.assertEqual(len(self.exchange.placed()), 1)
+
+		self.exchange.queued.discard('1')
+		self.exchange.fill('1', 0.25)
+		self.scheduler.poll(now=2)
+		self.assertAlmostEqual(parent.filled, 0.25)
+		self.assertEqual(len(self.exchange.placed()), 2)
+
+	def fail_once(self, method):
+		call = getattr(self.exchange, method)
+
+		def failing(*args):
+			setattr(self.exchange, method, call)
+			raise Exception('Connection reset')
+
+		setattr(self.exchange, method, failing)
+
+	def test_exchange_raises_mid_poll(self):
+		parent = self.scheduler.add(execution.ParentOrder(bitstamp.ORDER_SIDE_BUY, 0.5, 600.0, display_size=0.25), now=0)
+		self.fail_once('buy_limit_order')
+		self.scheduler.poll(now=0)
+		self.assertEqual(parent.children, [], msg='A failed placement should not leave a child')
+		self.assertEqual(self.scheduler.errors, 1)
+		self.assertEqual(len(parent.errors), 1)
+
+		self.scheduler.poll(now=1)
+		self.exchange.fill('1', 0.1)
+		self.fail_once('open_orders')
+		self.scheduler.poll(now=2)
+		self.assertEqual(self.scheduler.errors, 2)
+		self.assertEqual(parent.children[0].state, execution.CHILD_WORKING)
+		self.assertEqual(len(self.exchange.placed()), 1, msg='Nothing should be placed while the fills are unknown')
+
+		parent.cancel()
+		self.fail_once('cancel_order')
+		self.scheduler.poll(now=3)
+		self.assertEqual(self.scheduler.errors, 3)
+		self.assertEqual(parent.state, execution.PARENT_CANCELLING, msg='The child is still open after the failed cancel')
+		self.assertEqual(parent.children[0].state, execution.CHILD_CLOSING)
+
+		self.scheduler.poll(now=4)
+		self.assertEqual(parent.state, execution.PARENT_CANCELLED, msg='order_status should tell the child is open, so it is cancelled again')
+		self.assertAlmostEqual(parent.filled, 0.1)
+		self.assertEqual(self.exchange.orders, {})
+		self.assertIsInstance(self.scheduler.last_error, Exception)
+
+	def test_run_survives_errors(self):
+		prices = []
+
+		def price(now):
+			prices.append(now)
+			if len(prices) == 1:
+				raise Exception('No quote yet')
+			self.scheduler.stop()
+			return 600.0
+
+		self.scheduler.interval = 0
+		parent = self.scheduler.add(execution.ParentOrder(bitstamp.ORDER_SIDE_BUY, 0.5, price), now=0)
+		self.scheduler.run()
+		self.assertEqual(self.scheduler.errors, 1, msg='A poll that raises should not stop the scheduler')
+		self.assertEqual(len(parent.children), 1)
+
+		prices[:] = []
+		self.scheduler.add(execution.ParentOrder(bitstamp.ORDER_SIDE_BUY, 0.5, price), now=0)
+		asyncio.run(self.scheduler.run_async())
+		self.assertEqual(self.scheduler.errors, 2)
+		self.assertEqual(len(self.exchange.placed()), 2)
+
+	def test_real_client_cancel(self):
+		api = bitstamp.Bitstamp(api_key='key', secret='secret', customer_id='1', api_endpoint='https://test/api/')
+		responses = {
+			'https://test/api/v2/buy/btcusd/': {'id': 1, 'amount': '0.25000000', 'price': '600.00'},
+			'https://test/api/v2/open_orders/all/': [{'id': 1, 'amount': '0.20000000'}],
+			'https://test/api/cancel_order/': True,
+			'https://test/api/order_status/': {'status': 'Finished', 'transactions': [{'btc': '0.05000000', 'price': '600.00'}]},
+		}
+		api.send = lambda prepared, stream=False: FakeResponse(responses[prepared[1]])
+		scheduler = execution.ExecutionScheduler(api, request_burst=100)
+		parent = scheduler.add(execution.ParentOrder(bitstamp.ORDER_SIDE_BUY, 0.25, 600.0), now=0)
+
+		scheduler.poll(now=0)
+		parent.cancel()
+		scheduler.poll(now=1)
+		self.assertEqual(parent.state, execution.PARENT_CANCELLED)
+		self.assertAlmostEqual(parent.filled, 0.05)
+
+	def test_validation(self):
+		self.assertRaises(Exception, execution.ParentOrder, 'hold', 1.0, 600.0)
+		self.assertRaises(Exception, execution.ParentOrder, bitstamp.ORDER_SIDE_BUY, -1.0, 600.0)
+		self.exchange.fixed_point = True
+		self.assertRaises(Exception, execution.ExecutionScheduler, self.exchange)
+
+	def tearDown(self):
+		pass
+
+
+class FakeDatedResponse(object):
+	def __init__(self, date):
+		self.headers = {'Date': date}
+		self.text = '{}'
+
+
+class TestClockSync(unittest.TestCase):
+	def setUp(self):
+		self.clock = clock.ClockSync(window=8)
+
+	def test_unsynchronized(self):
+		self.assertFalse(self.clock.synchronized())
+		self.assertEqual(self.clock.offset(), 0.0)
+		self.assertIsNone(self.clock.error())
+
+	def test_intervals_narrow_offset(self):
+		# The server clock is 2.3 seconds ahead, the Date header has whole seconds and requests take 0.2 seconds
+		for sent in [1000.0, 1000.45, 1000.9, 1001.15, 1001.6]:
+			self.clock.add_sample(sent, sent + 0.2, float(int(sent + 0.1 + 2.3)))
+		self.assertLessEqual(abs(self.clock.offset() - 2.3), self.clock.error())
+		self.assertLess(self.clock.error(), 0.2, msg='Samples should narrow the offset below the header resolution')
+		self.assertAlmostEqual(self.clock.min_rtt, 0.2)
+
+	def test_drift_drops_old_samples(self):
+		self.clock.add_sample(1000.0, 1000.1, 1002.0)
+		self.clock.add_sample(1010.0, 1010.1, 1000.0)
+		self.assertEqual(len(self.clock.samples), 1, msg='Samples contradicting newer ones should be dropped')
+		self.assertLess(self.clock.offset(), -9)
+
+	def test_event_raises_lower_bound(self):
+		self.clock.add_sample(1000.0, 1000.5, 1000.0, resolution=1.0)
+		self.assertAlmostEqual(self.clock.low, -0.5)
+		self.clock.add_event(1000.2, 1000.4)
+		self.assertAlmostEqual(self.clock.low, -0.2)
+
+	def test_date_header(self):
+		self.assertTrue(self.clock.add_response(784111776.5, 784111777.0, FakeDatedResponse('Sun, 06 Nov 1994 08:49:37 GMT')))
+		self.assertTrue(self.clock.synchronized())
+		self.assertFalse(self.clock.add_response(0, 1, FakeDatedResponse('not a date')))
+
+	def test_client_nonces_and_samples(self):
+		api = bitstamp.Bitstamp(api_key='key', secret='secret', customer_id='1', session=FakeSession(), clock=self.clock)
+		# The server clock is an hour ahead; nonces never go back, so only a clock ahead of the local one shows
+		server_date = formatdate(time.time() + 3600, usegmt=True)
+		api.http.post = lambda url, data=None, stream=False: FakeDatedResponse(server_date)
+		api.balance()
+		self.assertTrue(self.clock.synchronized(), msg='Responses should feed the clock')
+		nonce = int(api.prepare('balance')[2]['nonce'])
+		self.assertLess(abs(nonce / 1000.0 - time.time() - 3600), 10, msg='Nonces should follow the server clock')
+
+	def test_latency_tracker(self):
+		tracker = clock.LatencyTracker(self.clock)
+		handled = []
+		callback = tracker.wrap(handled.append)
+		callback({'microtimestamp': str(int((time.time() - 0.05) * 1000000)), 'price': 600})
+		callback({'price': 600})
+		self.assertEqual(len(handled), 2)
+		report = tracker.report()
+		self.assertEqual(report['messages'], 1, msg='Messages without a timestamp should not be recorded')
+		self.assertGreaterEqual(report['delivery_ms']['max'], 49)
+		self.assertLess(report['processing_ms']['max'], 49)
+		self.assertEqual(report['early'], 0)
+
+	def tearDown(self):
+		pass
+
+
+@unittest.skipIf(features.numpy is None, 'numpy is not installed')
+class TestFeatureEngine(unittest.TestCase):
+	def setUp(self):
+		self.engine = features.FeatureEngine(depth=2, window=3)
+		self.engine.update_order_book({
+			'timestamp': '1475100000',
+			'bids': [['600.00', '1.0'], ['599.00', '2.0'], ['598.00', '5.0']],
+			'asks': [['601.00', '3.0'], ['602.00', '1.0']],
+		})
+
+	@staticmethod
+	def trade(price, amount, trade_type):
+		return {'price': price, 'amount': amount, 'type': trade_type, 'timestamp': '1475100001'}
+
+	def test_book_features(self):
+		vector = self.engine.latest()
+		self.assertEqual(vector[features.MID], 600.5)
+		self.assertEqual(vector[features.SPREAD], 1.0)
+		self.assertEqual(vector[features.MICROPRICE], (600.0 * 3.0 + 601.0 * 1.0) / 4.0)
+		self.assertEqual(vector[features.IMBALANCE], (3.0 - 4.0) / 7.0, msg='Imbalance should cover only the top levels')
+
+	def test_diff(self):
+		vector = self.engine.update_diff({'bids': [['600.00', '0'], ['600.50', '2.0']], 'asks': [['601.00', '0']]})
+		self.assertEqual(vector[features.MID], (600.5 + 602.0) / 2)
+		self.assertEqual(self.engine.bids.prices, [598.0, 599.0, 600.5])
+		self.engine.update_diff({'asks': [['602.00', '0']]})
+		self.assertTrue(numpy.isnan(vector[features.MID]), msg='An empty side has no mid')
+
+	def test_latest_is_not_a_copy(self):
+		vector = self.engine.latest()
+		self.engine.update_diff({'bids': [['600.50', '1.0']]})
+		self.assertEqual(vector[features.MID], 600.75)
+
+	def test_trade_features(self):
+		prices = ['600', '606', '600', '612']
+		for index, price in enumerate(prices):
+			self.engine.update_trade(self.trade(price, '1.5' if index % 2 else '0.5', index % 2))
+		vector = self.engine.latest()
+		returns = numpy.diff(numpy.log(numpy.array(prices, dtype=float)))
+		self.assertAlmostEqual(vector[features.VOLATILITY], math.sqrt((returns ** 2).sum()))
+		# The window holds the last three trades: sell 1.5, buy 0.5, sell 1.5
+		self.assertAlmostEqual(vector[features.TRADE_FLOW], -2.5)
+		self.assertAlmostEqual(vector[features.TRADE_IMBALANCE], -2.5 / 3.5)
+
+	def test_frame_events_of_pair(self):
+		frames = [
+			json.dumps({'event': 'trade', 'channel': 'live_trades', 'data': json.dumps(self.trade('600.00', '1.0', 0))}),
+			json.dumps({'event': 'trade', 'channel': 'live_trades_btceur', 'data': json.dumps(self.trade('550.00', '1.0', 0))}),
+		]
+		events = list(features.frame_events(frames, pair=bitstamp.BTC_EUR))
+		self.assertEqual(events, [(features.EVENT_TRADE, self.trade('550.00', '1.0', 0))])
+
+	def test_ring_window(self):
+		window = features.RingWindow(4)
+		for value in range(1, 11):
+			window.push(float(value))
+		self.assertTrue(window.full())
+		self.assertEqual(window.sum, 7.0 + 8.0 + 9.0 + 10.0)
+		self.assertRaises(Exception, features.RingWindow, 0)
+
+	def test_evaluate_frames(self):
+		frames = [
+			json.dumps({'event': 'data', 'channel': 'order_book', 'data': json.dumps({'timestamp': '1', 'bids': [['600.00', '1.0']], 'asks': [['601.00', '1.0']]})}),
+			json.dumps({'event': 'pusher_internal:subscription_succeeded', 'channel': 'live_trades', 'data': '{}'}),
+			json.dumps({'event': 'trade', 'channel': 'live_trades', 'data': json.dumps(self.trade('600.50', '0.5', 0))}),
+		]
+		frames.extend(json.dumps({'event': 'data', 'channel': 'diff_order_book', 'data': json.dumps({'timestamp': str(index), 'bids': [['600.00', str(index)]], 'asks': []})}) for index in range(2, 5000))
+		frames.insert(2, json.dumps({'event': 'trade', 'channel': 'live_trades_btceur', 'data': json.dumps(self.trade('550.00', '9.0', 1))}))
+		frames.insert(3, json.dumps({'event': 'data', 'channel': 'diff_order_book_btceur', 'data': json.dumps({'timestamp': '2', 'bids': [['550.00', '1.0']], 'asks': []})}))
+		timestamps, values = features.evaluate(features.frame_events(frames), depth=2, window=3)
+		self.assertEqual(values.shape, (len(frames) - 3, len(features.FEATURES)), msg='Frames of other pairs should be skipped')
+		self.assertEqual(timestamps[0], 1.0)
+		self.assertEqual(values[1, features.TRADE_FLOW], 0.5)
+		self.assertEqual(timestamps[-1], 4999.0)
+		self.assertEqual(values[-1, features.MICROPRICE], (600.0 * 1.0 + 601.0 * 4999.0) / 5000.0)
+
+	def tearDown(self):
+		pass
+
+
 # class TestWebSocketsLiveTrades(unittest.TestCase):
 # 	def setUp(self):
 # 		self.api_key = 'some api key'